@@ -1,4 +1,5 @@
 import {FiSave} from "react-icons/fi";
+import {useRef} from "react";
 import {useRouter} from "next/navigation";
 import {useTest} from "../context/testContext";
 
@@ -6,16 +7,21 @@ import {useTest} from "../context/testContext";
 export default function SaveTest() {
     const router = useRouter();
     const { testData, testName, comments } = useTest();
+    // Sent with every attempt to save this test, so a retry never saves it twice
+    const idempotencyKey = useRef(crypto.randomUUID());
 
     const handleSaveTest = async () => {
         if (!window.electronAPI) return;
 
         // Call IPC function to save test data
         try {
+            const token = localStorage.getItem('access_token');
             const response = await fetch("http://localhost:8000/db/write_test", {
                 method: "POST",
                 headers: {
-                    "content-type": "application/json"
+                    "content-type": "application/json",
+                    "Idempotency-Key": idempotencyKey.current,
+                    ...(token ? {'Authorization': `Bearer ${token}`} : {})
                 },
                 body: JSON.stringify({
                     testData,
@@ -7,14 +7,16 @@ import Link from "next/link";
 export default function TestFileList({filters, searchTerm}) {
     const [testFiles, setTestFiles] = useState([]);
     const [loading, setLoading] = useState(true);
-    const [currentPage, setCurrentPage] = useState(1);
+    // Pages are fetched by cursor, the page number is only for display
+    const [currentPage, setCurrentPage] = useState({ number: 1, cursor: null });
     const [pagination, setPagination] = useState(null);
     const limit = 10;
 
-    const fetchTestFiles = async (page = 1) => {
+    const fetchTestFiles = async (cursor = null) => {
         setLoading(true);
         try {
-            const response = await fetch(`http://localhost:8000/db/tests?page=${page}&limit=${limit}`, {
+            const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : "";
+            const response = await fetch(`http://localhost:8000/db/tests?limit=${limit}${cursorParam}`, {
                 method: 'GET',
                 headers: {
                     'Content-Type': 'application/json'
@@ -32,11 +34,12 @@ export default function TestFileList({filters, searchTerm}) {
     };
 
     useEffect(() => {
-        fetchTestFiles(currentPage);
+        fetchTestFiles(currentPage.cursor);
     }, [currentPage]);
 
-    const handlePageChange = (newPage) => {
-        setCurrentPage(newPage);
+    const handlePageChange = (step) => {
+        const cursor = step > 0 ? pagination.next_cursor : pagination.previous_cursor;
+        setCurrentPage({ number: currentPage.number + step, cursor });
         window.scrollTo({ top: 0, behavior: 'smooth' });
     };
 
@@ -46,7 +49,7 @@ export default function TestFileList({filters, searchTerm}) {
         return (
             <div className="flex justify-center items-center gap-4 mt-6 p-4">
                 <button
-                    onClick={() => handlePageChange(currentPage - 1)}
+                    onClick={() => handlePageChange(-1)}
                     disabled={!pagination.has_previous}
                     className="px-4 py-2 bg-blue-600 text-white rounded-lg disabled:bg-gray-300 disabled:cursor-not-allowed hover:bg-blue-700 transition"
                 >
@@ -55,7 +58,7 @@ export default function TestFileList({filters, searchTerm}) {
                 
                 <div className="flex items-center gap-2">
                     <span className="text-gray-600">
-                        Page {pagination.current_page} of {pagination.total_pages}
+                        Page {currentPage.number} of {pagination.total_pages}
                     </span>
                     <span className="text-gray-400 text-sm">
                         ({pagination.total_count} total tests)
@@ -63,7 +66,7 @@ export default function TestFileList({filters, searchTerm}) {
                 </div>
                 
                 <button
-                    onClick={() => handlePageChange(currentPage + 1)}
+                    onClick={() => handlePageChange(1)}
                     disabled={!pagination.has_next}
                     className="px-4 py-2 bg-blue-600 text-white rounded-lg disabled:bg-gray-300 disabled:cursor-not-allowed hover:bg-blue-700 transition"
                 >
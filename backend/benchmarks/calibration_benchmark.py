@@ -0,0 +1,88 @@
+# Residual evaluations per second and wall time per calibration, for the
+# original residual (per-sample loops, dense linspace reference lines, three
+# KD-trees per call) against CalibrationProblem.residuals, and the default
+# fsolve calibration against the multi-start mode.
+#
+# Run from the backend directory:
+#   python -m benchmarks.calibration_benchmark
+import time
+import warnings
+import numpy as np
+from scipy.optimize import fsolve
+
+from benchmarks.kinematics_benchmark import legacy_displacement, legacy_heading, legacy_traj, legacy_velocity
+from benchmarks.synthetic import out_and_back
+from calc import smooth_data
+from routers.calibrate import Calibration, CalibrationProblem, compute_net_loss, largest_consecutive_group
+
+EVALUATIONS = 20
+
+
+# The original minimize_turnaround, with its turnaround cache passed in
+def legacy_residuals(params, test, turn):
+    ml, mr, W = params
+    timeStamps = np.array(test['timeStamps'])
+    min_len = min(len(timeStamps), len(test['gyroLeftSmoothed']), len(test['gyroRightSmoothed']))
+    timeStamps = timeStamps[:min_len]
+    gyroLeft = np.array(test['gyroLeftSmoothed'])[:min_len]
+    gyroRight = np.array(test['gyroRightSmoothed'])[:min_len]
+
+    disp_m = np.array(legacy_displacement(timeStamps, gyroLeft*ml, gyroRight*mr, diameter=1))
+    heading = np.array(legacy_heading(timeStamps, gyroLeft*ml, gyroRight*mr, dist_wheels=W, diameter=1))
+    velocity = np.array(legacy_velocity(timeStamps, gyroLeft*ml, gyroRight*mr, diameter=1))
+    traj = np.array(legacy_traj(disp_m, velocity, heading, timeStamps))
+
+    if not turn:
+        heading_diff = [0]
+        for i in range(1, len(heading)):
+            heading_diff.append(heading[i] - heading[i-1])
+        group = largest_consecutive_group(np.where(np.abs(np.array(heading_diff)) > 0.1)[0])
+        turn.extend([group[0], group[-1]])
+    start_turn, end_turn = turn
+
+    first_half = traj[:start_turn]
+    second_half = traj[end_turn:]
+    straight_line_start = np.linspace(np.array([0,0]), np.array(first_half[-1]), 3000)
+    straight_line_end = np.linspace(np.array(second_half[0]), np.array([0,0]), 3000)
+    turn_loss = (compute_net_loss(first_half, straight_line_start) + compute_net_loss(second_half, straight_line_end)) / 2
+    return compute_net_loss(first_half, second_half), 10 - disp_m[-1], turn_loss
+
+def smoothed(data):
+    response = smooth_data(data)
+    return {**data, 'gyroLeftSmoothed': response['gyro_left_smoothed'], 'gyroRightSmoothed': response['gyro_right_smoothed']}
+
+def per_second(fn, count=EVALUATIONS):
+    start = time.perf_counter()
+    for i in range(count):
+        fn([20 + i * 0.01, 20, 20])
+    return count / (time.perf_counter() - start)
+
+def main():
+    warnings.simplefilter("ignore", RuntimeWarning)
+    print(f"{'samples':>8} {'legacy eval/s':>14} {'new eval/s':>11} {'legacy solve (s)':>17} {'new solve (s)':>14} {'new evals':>10}"
+          f" {'multistart (s)':>15} {'fsolve resid':>13} {'multistart resid':>17}")
+    for straight_s in (10, 30, 120):
+        data = out_and_back(straight_s=straight_s)
+        test = smoothed(data)
+
+        turn = []
+        legacy_rate = per_second(lambda params: legacy_residuals(params, test, turn))
+        new_rate = per_second(CalibrationProblem(test).residuals)
+
+        start = time.perf_counter()
+        fsolve(legacy_residuals, [20, 20, 20], args=(test, []))
+        legacy_solve = time.perf_counter() - start
+
+        start = time.perf_counter()
+        calibration = Calibration(data)
+        calibration.perform_calibration()
+        new_solve = time.perf_counter() - start
+
+        multistart = Calibration(data)
+        multistart.perform_calibration("multistart")
+
+        print(f"{len(data['timeStamps']):>8} {legacy_rate:>14.1f} {new_rate:>11.1f} {legacy_solve:>17.2f} {new_solve:>14.3f} {calibration.problem.evaluations:>10}"
+              f" {multistart.diagnostics['wall_time']:>15.2f} {calibration.diagnostics['residual']:>13.4f} {multistart.diagnostics['residual']:>17.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Concurrency benchmark for database calls: many clients opening tests at once,
+# with the blocking Supabase calls made on the event loop (the old behaviour) and
+# on the db_executor thread pool with a few pool sizes.
+#
+# Supabase is replaced by benchmarks.postgrest_stub on localhost, which answers
+# every request after a fixed delay like a network round trip. The backend's
+# client is pointed at it through SUPABASE_URL, so requests take the real
+# supabase-py and httpx code path, including the shared connection pool.
+# Every request asks for a different test so the response cache never answers.
+#
+# Run from the backend directory:
+#   python -m benchmarks.db_concurrency_benchmark [requests] [latency ms]
+import asyncio
+import os
+import sys
+import time
+import httpx
+import numpy as np
+from fastapi import FastAPI
+
+from benchmarks.postgrest_stub import PostgrestStub
+
+WORKER_COUNTS = (4, 16, 64)
+
+
+def seed_tests(count):
+    test_files = {"timeStamp": list(range(0, 2000, 10)),
+                  **{name: [0.0] * 200 for name in ("distance", "displacement", "velocity", "heading", "trajectory_x",
+                                                    "trajectory_y", "gyroLeft", "gyroRight", "accelLeft", "accelRight")}}
+    return [{"id": test_id, "test_name": f"test {test_id}", "test_files": test_files} for test_id in range(1, count + 1)]
+
+async def run_scenario(client, requests):
+    latencies = []
+
+    async def open_test(test_id):
+        start = time.perf_counter()
+        response = await client.get(f"/db/tests/{test_id}")
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(open_test(test_id) for test_id in range(1, requests + 1)))
+    return latencies, time.perf_counter() - start
+
+def report(name, latencies, elapsed, stub):
+    ms = np.asarray(latencies) * 1000
+    print(f"{name:>18} {np.percentile(ms, 50):>9.1f} {np.percentile(ms, 99):>9.1f} {len(latencies) / elapsed:>10.1f}"
+          f" {stub.max_active:>11} {len(stub.connections):>12}")
+
+async def main(requests, latency):
+    with PostgrestStub({"test_info": seed_tests(requests)}, latency=latency) as stub:
+        os.environ["SUPABASE_URL"] = stub.url
+        os.environ.setdefault("SUPABASE_KEY", "benchmark-key")
+        # The connection pool is sized once, big enough for the largest thread pool
+        os.environ["DB_WORKERS"] = str(max(WORKER_COUNTS))
+        from executors import cpu_executor, db_executor
+        from routers import db
+
+        # Only the database side is measured, let the decode step queue freely
+        cpu_executor.max_queue = None
+
+        app = FastAPI()
+        app.include_router(db.router)
+        print(f"{requests} concurrent requests, {latency * 1000:.0f} ms per database round trip")
+        print(f"{'scenario':>18} {'p50 ms':>9} {'p99 ms':>9} {'requests/s':>10} {'max in flight':>11} {'connections':>12}")
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            scenarios = [("event loop", "inline", 1)] + [(f"{workers} db threads", "thread", workers) for workers in WORKER_COUNTS]
+            for name, kind, workers in scenarios:
+                db_executor.shutdown()
+                db_executor.kind, db_executor.workers, db_executor.max_queue = kind, workers, None
+                db.test_response_cache.clear()
+                stub.max_active, stub.connections = 0, set()
+                latencies, elapsed = await run_scenario(client, requests)
+                report(name, latencies, elapsed, stub)
+        db_executor.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+                     float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05))
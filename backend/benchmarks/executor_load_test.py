@@ -0,0 +1,89 @@
+# Load test for the CPU executor: latency of live /calculate/smooth requests while
+# calibrations run, with the handlers inline on the event loop (the old behaviour)
+# and dispatched to the thread pool.
+#
+# Requests go through httpx's ASGI transport on one event loop, so a handler that
+# blocks the loop delays every other request exactly as it would under uvicorn.
+# Calibrations are not saved or looked up; save_calibration and find_calibration
+# are swapped for no-ops here, which also keeps every resubmission solving.
+#
+# Run from the backend directory:
+#   python -m benchmarks.executor_load_test [calibrations]
+import asyncio
+import contextlib
+import io
+import sys
+import time
+import httpx
+import numpy as np
+from fastapi import FastAPI
+
+from benchmarks.synthetic import out_and_back
+from executors import cpu_executor
+from routers import calculate, calibrate
+
+SMOOTH_INTERVAL_S = 1 / 17  # the recorder sends about 17 packets per second
+PACKET = {"timeStamps": [0, 1/68, 2/68, 3/68], "gyroLeft": [1, 1.1, 1.2, 1.1], "gyroRight": [1, 1.05, 1.1, 1.0]}
+
+
+class NoSave:
+    data = {}
+
+async def no_save(*args):
+    return NoSave()
+
+# Latency is measured from when each packet was due to be sent, not from when the
+# client got around to sending it, so time spent with the event loop blocked counts
+async def smooth_latencies(client, stop):
+    latencies = []
+    due = time.perf_counter()
+    while not stop.is_set():
+        await client.post("/calculate/smooth", json=PACKET)
+        latencies.append(time.perf_counter() - due)
+        due += SMOOTH_INTERVAL_S
+        await asyncio.sleep(max(0, due - time.perf_counter()))
+    return latencies
+
+async def run_scenario(client, calibrations, payload):
+    stop = asyncio.Event()
+    live = asyncio.create_task(smooth_latencies(client, stop))
+    await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    for _ in range(calibrations):
+        await client.post("/calibrate/", json=payload)
+    calibration_time = time.perf_counter() - start
+    await asyncio.sleep(0.5)
+    stop.set()
+    return await live, calibration_time
+
+def report(name, latencies, calibration_time):
+    ms = np.asarray(latencies) * 1000
+    print(f"{name:>28} {len(ms):>9} {np.percentile(ms, 50):>9.1f} {np.percentile(ms, 99):>9.1f} {ms.max():>9.1f} {calibration_time:>16.2f}")
+
+async def main(calibrations):
+    calibrate.save_calibration = no_save
+    calibrate.find_calibration = lambda fingerprint: []
+    app = FastAPI()
+    app.include_router(calculate.router)
+    app.include_router(calibrate.router)
+    payload = out_and_back(straight_s=60)
+
+    print(f"{'scenario':>28} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'calibrations (s)':>16}")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        stop = asyncio.Event()
+        idle = asyncio.create_task(smooth_latencies(client, stop))
+        await asyncio.sleep(3)
+        stop.set()
+        report("no calibration", await idle, 0)
+
+        for kind in ("inline", "thread"):
+            cpu_executor.kind = kind
+            latencies, calibration_time = await run_scenario(client, calibrations, payload)
+            report(f"calibrating, {kind}", latencies, calibration_time)
+    cpu_executor.shutdown()
+
+if __name__ == "__main__":
+    # /calculate/smooth logs every request, keep that out of the output
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
+    print("\n".join(line for line in output.getvalue().splitlines() if not line.startswith(("Received", "Data types"))))
@@ -0,0 +1,104 @@
+# Compares the vectorized kinematics in calc.py (the per-series views and the fused
+# compute_kinematics pass) against the original per-sample loops.
+#
+# Run from the backend directory:
+#   python -m benchmarks.kinematics_benchmark
+import sys
+import time
+import numpy as np
+
+from calc import compute_kinematics, get_displacement_m, get_velocity_m_s, get_heading_deg, get_top_traj
+from params import WHEEL_DIAM_IN, DIST_WHEELS_IN, IN_TO_M
+
+SIZES = [1_000, 100_000, 1_000_000]
+
+
+# Original loop implementations, kept here as the baseline
+def legacy_displacement(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN):
+    gyroLeft = abs(np.array(gyroLeft))
+    gyroRight = abs(np.array(gyroRight))
+    timeStamps = np.array(timeStamps)
+    dist_m = [0]
+    for i in range(len(gyroRight) - 1):
+        dx_r = (gyroLeft[i]+gyroRight[i])/2 * (timeStamps[i + 1] - timeStamps[i])
+        dist_m.append(dx_r * (diameter * IN_TO_M / 2) + dist_m[-1])
+    return dist_m
+
+def legacy_velocity(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN):
+    gyroLeft = np.array(gyroLeft)
+    gyroRight = np.array(gyroRight)
+    vel_ms = [0]
+    for i in range(len(gyroRight) - 1):
+        v_r = (gyroRight[i]) * diameter/2*IN_TO_M
+        v_l = (gyroLeft[i]) * diameter/2*IN_TO_M
+        vel_ms.append((v_r+v_l)/2)
+    return vel_ms
+
+def legacy_heading(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    gyroLeft = np.array(gyroLeft)
+    gyroRight = np.array(gyroRight)
+    timeStamps = np.array(timeStamps)
+    heading_deg = [0]
+    for i in range(len(gyroRight) - 1):
+        w = ((gyroRight[i]-gyroLeft[i]) * diameter*IN_TO_M/2) / (dist_wheels*IN_TO_M)
+        dh = w * (timeStamps[i + 1] - timeStamps[i])
+        heading_deg.append(dh*180/np.pi + heading_deg[-1])
+    return heading_deg
+
+def legacy_traj(disp_m, vel_ms, heading_deg, timeStamps):
+    x, y = [], []
+    dx, dy = 0, 0
+    for i in range(len(disp_m) - 1):
+        dx += vel_ms[i]*np.cos(heading_deg[i]*np.pi/180) * (timeStamps[i + 1] - timeStamps[i])
+        dy += vel_ms[i]*np.sin(heading_deg[i]*np.pi/180) * (timeStamps[i + 1] - timeStamps[i])
+        x.append(dx)
+        y.append(dy)
+    return [[x[i], y[i]] for i in range(len(x))]
+
+
+def make_recording(n, seed=0):
+    rng = np.random.default_rng(seed)
+    timeStamps = np.cumsum(rng.uniform(0.01, 0.02, n))
+    gyroLeft = np.sin(np.linspace(0, n / 100, n)) + rng.normal(0, 0.1, n)
+    gyroRight = np.cos(np.linspace(0, n / 120, n)) + rng.normal(0, 0.1, n)
+    return list(timeStamps), list(gyroLeft), list(gyroRight)
+
+def run_legacy(timeStamps, gyroLeft, gyroRight):
+    disp = legacy_displacement(timeStamps, gyroLeft, gyroRight)
+    vel = legacy_velocity(timeStamps, gyroLeft, gyroRight)
+    heading = legacy_heading(timeStamps, gyroLeft, gyroRight)
+    traj = legacy_traj(disp, vel, heading, timeStamps)
+    return disp, vel, heading, traj
+
+def run_vectorized(timeStamps, gyroLeft, gyroRight):
+    disp = get_displacement_m(timeStamps, gyroLeft, gyroRight)
+    vel = get_velocity_m_s(timeStamps, gyroLeft, gyroRight)
+    heading = get_heading_deg(timeStamps, gyroLeft, gyroRight)
+    traj = get_top_traj(disp, vel, heading, timeStamps)
+    return disp, vel, heading, traj
+
+def run_fused(timeStamps, gyroLeft, gyroRight):
+    kinematics = compute_kinematics(timeStamps, gyroLeft, gyroRight)
+    return kinematics.displacement, kinematics.velocity, kinematics.heading, kinematics.trajectory
+
+def best_of(fn, args, repeats):
+    best, result = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main(sizes):
+    print(f"{'samples':>10} {'loops (s)':>12} {'vectorized (s)':>15} {'fused (s)':>10} {'speedup':>9} {'max abs err':>12}")
+    for n in sizes:
+        args = make_recording(n)
+        repeats = 3 if n <= 100_000 else 1
+        legacy_time, legacy = best_of(run_legacy, args, repeats)
+        vector_time, vector = best_of(run_vectorized, args, repeats)
+        fused_time, fused = best_of(run_fused, args, repeats)
+        err = max(np.max(np.abs(np.asarray(a, dtype=float) - np.asarray(b, dtype=float)), initial=0) for a, b in zip(legacy, fused))
+        print(f"{n:>10} {legacy_time:>12.4f} {vector_time:>15.5f} {fused_time:>10.5f} {legacy_time / fused_time:>8.0f}x {err:>12.2e}")
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
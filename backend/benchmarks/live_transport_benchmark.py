@@ -0,0 +1,69 @@
+# Throughput of the live-data paths: one POST to /calculate/smooth per packet
+# (what the recorder does today) against streaming the same packets over the
+# /calculate/ws WebSocket, which also returns the derived kinematics.
+#
+# Both run in-process through Starlette's TestClient, so the numbers cover JSON
+# encoding, routing and handler work but not the loopback network.
+#
+# Run from the backend directory:
+#   python -m benchmarks.live_transport_benchmark [packets]
+import contextlib
+import io
+import sys
+import time
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import calculate
+
+PACKETS = 2000
+PACKET_SIZE = 4
+SAMPLE_RATE_HZ = 68
+
+
+def make_packets(count):
+    rng = np.random.default_rng(0)
+    packets = []
+    for i in range(count):
+        start = i * PACKET_SIZE
+        packets.append({
+            "timeStamps": [(start + j) / SAMPLE_RATE_HZ for j in range(PACKET_SIZE)],
+            "gyroLeft": rng.normal(1, 0.2, PACKET_SIZE).tolist(),
+            "gyroRight": rng.normal(1, 0.2, PACKET_SIZE).tolist()
+        })
+    return packets
+
+def bench_post(client, packets):
+    start = time.perf_counter()
+    # /calculate/smooth logs every request, keep that out of the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        for packet in packets:
+            client.post("/calculate/smooth", json=packet).json()
+    return time.perf_counter() - start
+
+def bench_websocket(client, packets):
+    start = time.perf_counter()
+    with client.websocket_connect("/calculate/ws") as websocket:
+        websocket.receive_json()
+        for packet in packets:
+            websocket.send_json(packet)
+        received = 0
+        while received < len(packets):
+            received += websocket.receive_json()["packets"]
+    return time.perf_counter() - start
+
+def main(count):
+    app = FastAPI()
+    app.include_router(calculate.router)
+    client = TestClient(app)
+    packets = make_packets(count)
+
+    post_time = bench_post(client, packets)
+    ws_time = bench_websocket(client, packets)
+    print(f"{'path':>22} {'total (s)':>10} {'packets/s':>10}")
+    print(f"{'POST /calculate/smooth':>22} {post_time:>10.3f} {count / post_time:>10.0f}")
+    print(f"{'WS /calculate/ws':>22} {ws_time:>10.3f} {count / ws_time:>10.0f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else PACKETS)
@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+# Local stand-in for the PostgREST API behind Supabase, so the backend can be
+# load tested without the network. Every request sleeps for `latency` seconds
+# like a round trip would, then answers from in-memory tables:
+#   GET  /rest/v1/<table>?id=eq.1&limit=10  rows matching eq/gt/lt filters
+#   POST /rest/v1/<table>                   inserts the JSON body, returns it with ids
+# Embedded selects, ordering and counts are not supported, every column is returned.
+#
+#   with PostgrestStub(latency=0.05) as stub:
+#       os.environ["SUPABASE_URL"] = stub.url
+class PostgrestStub:
+    def __init__(self, tables=None, latency=0.05, host="127.0.0.1", port=0):
+        self.tables = tables or {}
+        self.latency = latency
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._next_id = 1 + max((row.get("id", 0) for rows in self.tables.values() for row in rows), default=0)
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def select(self, table, params):
+        rows = self.tables.get(table, [])
+        for column, condition in params:
+            if column in ("select", "limit", "offset", "order"):
+                continue
+            operator, _, value = condition.partition(".")
+            rows = [row for row in rows if _matches(row.get(column), operator, value)]
+        limit = dict(params).get("limit")
+        return rows[:int(limit)] if limit else rows
+
+    def insert(self, table, values):
+        values = values if isinstance(values, list) else [values]
+        with self._lock:
+            inserted = []
+            for row in values:
+                inserted.append({"id": self._next_id, **row})
+                self._next_id += 1
+            self.tables.setdefault(table, []).extend(inserted)
+        return inserted
+
+
+def _matches(value, operator, expected):
+    if value is None:
+        return False
+    if operator == "eq":
+        return str(value) == expected
+    if operator == "gt":
+        return float(value) > float(expected)
+    if operator == "lt":
+        return float(value) < float(expected)
+    raise ValueError(f"Unsupported filter: {operator}")
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _respond(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _table(self):
+            path = urlsplit(self.path).path
+            if not path.startswith("/rest/v1/"):
+                self._respond(404, {"message": f"Unknown path {path}"})
+                return None
+            return path[len("/rest/v1/"):]
+
+        def _serve(self, handle):
+            with stub._lock:
+                stub.requests += 1
+                stub.active += 1
+                stub.max_active = max(stub.max_active, stub.active)
+                stub.connections.add(self.client_address)
+            try:
+                time.sleep(stub.latency)
+                table = self._table()
+                if table is not None:
+                    self._respond(*handle(table))
+            finally:
+                with stub._lock:
+                    stub.active -= 1
+
+        def do_GET(self):
+            self._serve(lambda table: (200, stub.select(table, parse_qsl(urlsplit(self.path).query))))
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            self._serve(lambda table: (201, stub.insert(table, body)))
+
+    return Handler
@@ -0,0 +1,44 @@
+# Time to build and serialize a test for review, and the size of the JSON, for the
+# per-sample format_for_review against format_for_review_columnar. Serializing
+# goes through jsonable_encoder and json.dumps as a FastAPI response does.
+#
+# Run from the backend directory:
+#   python -m benchmarks.review_format_benchmark [minutes ...]
+import json
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+from params import SAMPLE_RATE_HZ
+from routers.db import REVIEW_SERIES, format_for_review, format_for_review_columnar
+
+MINUTES = [1, 10, 30]
+
+
+def stored_test(n, rng):
+    test_files = {"timeStamp": (np.arange(n) * 1000 / SAMPLE_RATE_HZ).tolist()}
+    for name in REVIEW_SERIES:
+        test_files[name] = np.cumsum(rng.normal(0, 1, n)).tolist()
+    return SimpleNamespace(data=[{"id": 1, "test_name": "benchmark", "test_files": test_files}])
+
+def build_and_serialize(format_fn, response):
+    start = time.perf_counter()
+    formatted = format_fn(response)
+    built = time.perf_counter()
+    body = json.dumps(jsonable_encoder(formatted))
+    return built - start, time.perf_counter() - built, len(body)
+
+def main(minutes):
+    rng = np.random.default_rng(0)
+    print(f"{'minutes':>8} {'samples':>8} {'format':>9} {'build (s)':>10} {'serialize (s)':>14} {'JSON (MB)':>10}")
+    for length in minutes:
+        n = int(length * 60 * SAMPLE_RATE_HZ)
+        response = stored_test(n, rng)
+        for name, format_fn in (("rows", format_for_review), ("columnar", format_for_review_columnar)):
+            build, serialize, size = build_and_serialize(format_fn, response)
+            print(f"{length:>8} {n:>8} {name:>9} {build:>10.3f} {serialize:>14.3f} {size / 1e6:>10.2f}")
+
+if __name__ == "__main__":
+    main([float(arg) for arg in sys.argv[1:]] or MINUTES)
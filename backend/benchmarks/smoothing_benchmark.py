@@ -0,0 +1,49 @@
+# Compares smooth_data (scipy.fft, both channels in one batch, padded to a fast
+# length, cached cutoff mask) against the original per-channel scipy.fftpack path.
+#
+# Run from the backend directory:
+#   python -m benchmarks.smoothing_benchmark
+import sys
+import time
+import numpy as np
+from scipy.fftpack import fftfreq, irfft, rfft
+
+from calc import smooth_data
+
+# Lengths include awkward sizes (primes) that the padding helps with
+SIZES = [1_000, 40_813, 100_000, 1_000_003]
+
+
+def legacy_smooth(data, filter_freq=6):
+    response = {}
+    for side in ('Right', 'Left'):
+        W = fftfreq(len(data['gyro' + side]), d=data['timeStamps'][1]-data['timeStamps'][0])
+        f_gyro = rfft(data['gyro' + side])
+        f_filtered = f_gyro.copy()
+        f_filtered[(np.abs(W)>filter_freq)] = 0
+        response['gyro_' + side.lower() + '_smoothed'] = list(irfft(f_filtered))
+    return response
+
+def best_of(fn, data, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(sizes):
+    rng = np.random.default_rng(0)
+    print(f"{'samples':>10} {'fftpack (s)':>12} {'scipy.fft (s)':>14} {'speedup':>8}")
+    for n in sizes:
+        data = {
+            'timeStamps': (np.arange(n) / 68).tolist(),
+            'gyroLeft': rng.normal(0, 1, n).tolist(),
+            'gyroRight': rng.normal(0, 1, n).tolist()
+        }
+        legacy_time = best_of(legacy_smooth, data)
+        new_time = best_of(smooth_data, data)
+        print(f"{n:>10} {legacy_time:>12.4f} {new_time:>14.4f} {legacy_time / new_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,54 @@
+# Size of a test_files row stored as JSON arrays against the float32 and delta
+# codecs, with encode/decode time and the largest error per codec.
+#
+# Run from the backend directory:
+#   python -m benchmarks.storage_codec_benchmark [minutes ...]
+import json
+import sys
+import time
+import numpy as np
+
+from benchmarks.synthetic import out_and_back
+from calc import compute_kinematics
+from codec import decode_test_files, encode_test_files
+
+MINUTES = [1, 10, 60]
+
+
+# A stored row as the recorder writes it: 2-decimal sensor values and the derived series
+def stored_row(minutes):
+    data = out_and_back(straight_s=minutes * 30, turn_s=2)
+    n = len(data['timeStamps'])
+    rng = np.random.default_rng(0)
+    gyroLeft = np.round(np.asarray(data['gyroLeft']), 2)
+    gyroRight = np.round(np.asarray(data['gyroRight']), 2)
+    kinematics = compute_kinematics(data['timeStamps'], gyroLeft, gyroRight)
+    return {
+        "timeStamp": (np.asarray(data['timeStamps']) * 1000).tolist(),
+        "distance": kinematics.displacement.tolist(),
+        **kinematics.to_dict(),
+        "gyroLeft": gyroLeft.tolist(),
+        "gyroRight": gyroRight.tolist(),
+        "accelLeft": np.round(rng.normal(0, 1, n), 2).tolist(),
+        "accelRight": np.round(rng.normal(0, 1, n), 2).tolist()
+    }
+
+def main(minutes):
+    print(f"{'minutes':>8} {'codec':>8} {'size (MB)':>10} {'ratio':>6} {'encode (s)':>11} {'decode (s)':>11} {'max error':>10}")
+    for length in minutes:
+        row = stored_row(length)
+        json_size = len(json.dumps(row))
+        print(f"{length:>8} {'json':>8} {json_size / 1e6:>10.2f} {1:>6.1f}")
+        for codec in ("float32", "delta"):
+            start = time.perf_counter()
+            encoded = encode_test_files(row, codec)
+            encoded_at = time.perf_counter()
+            decoded = decode_test_files(encoded)
+            decoded_at = time.perf_counter()
+            size = len(json.dumps(encoded))
+            error = max(np.abs(np.asarray(decoded[name]) - np.asarray(row[name])).max() for name in row)
+            print(f"{length:>8} {codec:>8} {size / 1e6:>10.2f} {json_size / size:>6.1f} "
+                  f"{encoded_at - start:>11.3f} {decoded_at - encoded_at:>11.3f} {error:>10.1e}")
+
+if __name__ == "__main__":
+    main([float(arg) for arg in sys.argv[1:]] or MINUTES)
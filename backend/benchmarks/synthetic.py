@@ -0,0 +1,29 @@
+# Synthetic recordings for the benchmarks
+import numpy as np
+
+SAMPLE_RATE_HZ = 68
+
+
+# An out-and-back calibration run: push straight out, spin 180 degrees on the
+# spot and push straight back. gyro values are in the units the SmartHubs send.
+def out_and_back(straight_s=10, turn_s=2.5, speed=4.0, noise=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    straight = int(straight_s * SAMPLE_RATE_HZ)
+    turn = int(turn_s * SAMPLE_RATE_HZ)
+    # Ease in and out of each segment so the data looks like pushes, not steps
+    ease = np.sin(np.linspace(0, np.pi, straight))
+    spin = np.sin(np.linspace(0, np.pi, turn))
+
+    gyroLeft = np.concatenate((speed * ease, -speed / 2 * spin, speed * ease))
+    gyroRight = np.concatenate((speed * ease, speed / 2 * spin, speed * ease))
+    timeStamps = np.arange(len(gyroLeft)) / SAMPLE_RATE_HZ
+
+    gyroLeft = gyroLeft + rng.normal(0, noise, len(gyroLeft))
+    gyroRight = gyroRight + rng.normal(0, noise, len(gyroRight))
+    return {
+        "smarthubId": "benchmark",
+        "calibrationName": "synthetic out and back",
+        "timeStamps": timeStamps.tolist(),
+        "gyroLeft": gyroLeft.tolist(),
+        "gyroRight": gyroRight.tolist()
+    }
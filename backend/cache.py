@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+# Small thread-safe least-recently-used cache. Once it holds maxsize entries,
+# adding a new one drops the entry that was used longest ago. With a ttl (in
+# seconds) entries also expire that long after they were put. With max_bytes,
+# entries are also dropped until the sizes given by sizeof(value) fit in it.
+class LRUCache:
+    def __init__(self, maxsize=128, ttl=None, max_bytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, expiry time or None, size in bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    # Returns the cached value, or default if the key is not cached or has expired
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            value, expires, _ = self._entries[key]
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # A value larger than the whole cache would only push everything else out
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (value, expires, size)
+            self._bytes += size
+            while len(self._entries) > self.maxsize or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    # Drops every entry whose key matches, returns how many were dropped
+    def discard_where(self, predicate):
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.maxsize,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions
+            }
+
+    def _remove(self, key):
+        value, _, size = self._entries.pop(key)
+        self._bytes -= size
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return False
+            expires = self._entries[key][1]
+            return expires is None or expires > time.monotonic()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -1,15 +1,27 @@
 import numpy as np
-import copy
-from scipy.fftpack import fftfreq, irfft, rfft
+from functools import lru_cache
+from scipy.fft import irfft, next_fast_len, rfft, rfftfreq
+from scipy.signal import butter, sosfilt, sosfilt_zi
 
 # Load Wheelchair Measurements:
 from params import (
     WHEEL_DIAM_IN,
     DIST_WHEELS_IN,
-    IN_TO_M
+    IN_TO_M,
+    SAMPLE_RATE_HZ,
+    FILTER_CUTOFF_HZ,
+    FILTER_ORDER,
+    FFT_WORKERS,
+    FFT_MASK_CACHE_SIZE
 )
 
-def smooth_data(dataValues):
+# Low pass filters the gyro data in the frequency domain.
+# With resample=True the gyro data is first interpolated onto a uniform time
+# grid at the recording's effective sample rate, so the cutoff lands at the same
+# frequency whatever the arrival jitter was. The response then also holds the
+# uniform 'timeStamps'. Without it the spacing of the first two samples is
+# taken as the sample spacing, which is faster but assumes the data is uniform.
+def smooth_data(dataValues, resample=False):
     response = {}
     
     # Validate required keys
@@ -18,36 +30,39 @@ def smooth_data(dataValues):
     if missing_keys:
         raise ValueError(f"Missing required keys: {missing_keys}. Received keys: {list(dataValues.keys())}")
     
-    data = {'timeStamps': copy.deepcopy(dataValues['timeStamps']),
-        'gyroLeft': copy.deepcopy(dataValues['gyroLeft']),
-        'gyroRight': copy.deepcopy(dataValues['gyroRight'])}
+    # The inputs are only read, so no copy is needed
+    data = {key: dataValues[key] for key in required_keys}
 
-    try:
-        # Filtering with low pass filter
-        filter_freq =  6
-        # Calculate fourier transform of right gyroscope data to convert to frequency domain
-        W_right = fftfreq(len(data['gyroRight']), d=data['timeStamps'][1]-data['timeStamps'][0])
-        f_gyro_right = rfft(data['gyroRight'])
-        # Filter out right gyroscope signal above 6 Hz
-        f_right_filtered = f_gyro_right.copy()
-        f_right_filtered[(np.abs(W_right)>filter_freq)] = 0
-        # convert filtered signal back to time domain
-        gyro_right_smoothed = irfft(f_right_filtered)
+    if resample:
+        data['timeStamps'], (data['gyroLeft'], data['gyroRight']), sample_rate = resample_uniform(
+            data['timeStamps'], data['gyroLeft'], data['gyroRight'])
+        response['timeStamps'] = data['timeStamps'].tolist()
+        sample_spacing = 1 / sample_rate
+    else:
+        sample_spacing = data['timeStamps'][1]-data['timeStamps'][0]
+        if not sample_spacing > 0:
+            raise ValueError(f"The first two time stamps must increase, got {data['timeStamps'][0]} and {data['timeStamps'][1]}")
+    response['sample_rate'] = 1 / sample_spacing
 
-        response['gyro_right_smoothed'] = list(gyro_right_smoothed)
+    try:
+        gyro = np.vstack((np.asarray(data['gyroRight'], dtype=float), np.asarray(data['gyroLeft'], dtype=float)))
+    except ValueError:
+        raise ValueError(f"gyroLeft and gyroRight must have the same length, got {len(data['gyroLeft'])} and {len(data['gyroRight'])}")
 
-        # Calculate fourier transform of right gyroscope data to convert to frequency domain
-        W_left = fftfreq(len(data['gyroLeft']), d=data['timeStamps'][1]-data['timeStamps'][0])
-        f_gyro_left = rfft(data['gyroLeft'])
-        # Filter out right gyroscope signal above 6 Hz
-        f_left_filtered = f_gyro_left.copy()
-        f_left_filtered[(np.abs(W_left)>filter_freq)] = 0
+    try:
+        # Filtering with low pass filter
+        # Right and left channels are transformed together, zero padded to a fast FFT length
+        n = gyro.shape[1]
+        n_fft = next_fast_len(n, real=True)
+        # Calculate fourier transform of gyroscope data to convert to frequency domain
+        f_gyro = rfft(gyro, n=n_fft, axis=-1, workers=FFT_WORKERS)
+        # Filter out gyroscope signal above 6 Hz
+        f_gyro[:, ~_cutoff_mask(n_fft, float(sample_spacing), FILTER_CUTOFF_HZ)] = 0
         # convert filtered signal back to time domain
-        gyro_left_smoothed = irfft(f_left_filtered)
+        gyro_right_smoothed, gyro_left_smoothed = irfft(f_gyro, n=n_fft, axis=-1, workers=FFT_WORKERS)[:, :n]
 
-        data['gyro_left_smoothed'] = gyro_left_smoothed
-
-        response['gyro_left_smoothed'] = list(gyro_left_smoothed)
+        response['gyro_right_smoothed'] = gyro_right_smoothed.tolist()
+        response['gyro_left_smoothed'] = gyro_left_smoothed.tolist()
     except ValueError as e:
         print(f'Value error in filtering: {e}')
         raise
@@ -58,81 +73,223 @@ def smooth_data(dataValues):
     return response
 
 
-def get_displacement_m(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    gyroLeft = np.array(gyroLeft)  # Rotation of left wheel (converted to rps by Arduino)
-    gyroRight = np.array(gyroRight)  # Rotation of right wheel (converted to rps by Arduino)
-    timeStamps = np.array(timeStamps)  # Time (sec)
+# Which bins of a real FFT of length n_fft with sample spacing dt are at or below the cutoff.
+# Cached since the same recording length and rate come up again and again
+# when reprocessing stored tests.
+@lru_cache(maxsize=FFT_MASK_CACHE_SIZE)
+def _cutoff_mask(n_fft, dt, cutoff):
+    mask = np.abs(rfftfreq(n_fft, d=dt)) <= cutoff
+    mask.setflags(write=False)
+    return mask
 
-    # remove spikes
-    # gyro_data[gyro_data > 20] = 0
 
-    gyroLeft = abs(gyroLeft)
-    gyroRight = abs(gyroRight)
+# Interpolates one or more series sampled at timeStamps onto a uniform time grid.
+# The grid spans the same time range with the recording's effective sample rate
+# (samples over duration) unless a sample_rate is given.
+# Returns the uniform time stamps, the resampled series and the sample rate used.
+def resample_uniform(timeStamps, *series, sample_rate=None):
+    timeStamps = np.asarray(timeStamps, dtype=float)
+    if len(timeStamps) < 2:
+        raise ValueError(f"Need at least 2 samples to resample, got {len(timeStamps)}")
+    if np.any(np.diff(timeStamps) <= 0):
+        raise ValueError("Time stamps must be strictly increasing to resample")
 
-    dist_m = [0]
-        
-    for i in range(len(gyroRight) - 1):
-        # Wheel rotation in time step:
-        dx_r = (gyroLeft[i]+gyroRight[i])/2 * (timeStamps[i + 1] - timeStamps[i])
-        # Change in displacement over time step:
-        dx_m = dx_r * (diameter * IN_TO_M / 2)
-        # Append last change to overall Displacement:
-        dist_m.append(dx_m + dist_m[-1])
-    return dist_m
+    duration = timeStamps[-1] - timeStamps[0]
+    if sample_rate is None:
+        sample_rate = (len(timeStamps) - 1) / duration
+
+    uniform_time = timeStamps[0] + np.arange(int(np.floor(duration * sample_rate + 1e-9)) + 1) / sample_rate
+    resampled = [np.interp(uniform_time, timeStamps, np.asarray(values, dtype=float)) for values in series]
+    return uniform_time, resampled, sample_rate
 
-def get_velocity_m_s(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    gyroLeft = np.array(gyroLeft)  # Rotation of left wheel (converted to rps by Arduino)
-    gyroRight = np.array(gyroRight)  # Rotation of right wheel (converted to rps by Arduino)
-    timeStamps = np.array(timeStamps)  # Time (sec)
+
+# Causal low pass filter for live data.
+# smooth_data filters a whole recording at once in the frequency domain, which
+# needs the full buffer and means nothing for a 4 sample packet. This is a
+# Butterworth filter that keeps its state between calls, so a recording can be
+# filtered packet by packet in O(packet) time. Filtering a recording in chunks
+# gives the same output as filtering it in one go.
+# Left and right gyro data are filtered together as two channels.
+class LowPassStream:
+    def __init__(self, sample_rate=SAMPLE_RATE_HZ, cutoff=FILTER_CUTOFF_HZ, order=FILTER_ORDER):
+        if not 0 < cutoff < sample_rate / 2:
+            raise ValueError(f"Cutoff must be between 0 and the Nyquist frequency ({sample_rate / 2} Hz), got {cutoff}")
+        self.sample_rate = sample_rate
+        self.cutoff = cutoff
+        self.sos = butter(order, cutoff, fs=sample_rate, output='sos')
+        self._zi = None
+
+    def filter(self, gyroLeft, gyroRight):
+        channels = np.vstack((np.asarray(gyroLeft, dtype=float), np.asarray(gyroRight, dtype=float)))
+        if channels.shape[1] == 0:
+            return channels[0], channels[1]
+
+        if self._zi is None:
+            # Start in steady state at the first sample to avoid a startup transient
+            self._zi = sosfilt_zi(self.sos)[:, None, :] * channels[None, :, 0, None]
+
+        filtered, self._zi = sosfilt(self.sos, channels, axis=-1, zi=self._zi)
+        return filtered[0], filtered[1]
+
+
+# Derived series for one recording, all aligned to the same time stamps.
+# displacement, velocity and heading have one value per sample; the trajectory
+# has one [x, y] point per time step (one fewer than the number of samples).
+class Kinematics:
+    def __init__(self, timeStamps, displacement, velocity, heading, trajectory_x, trajectory_y):
+        self.timeStamps = timeStamps
+        self.displacement = displacement
+        self.velocity = velocity
+        self.heading = heading
+        self.trajectory_x = trajectory_x
+        self.trajectory_y = trajectory_y
+
+    @property
+    def trajectory(self):
+        return np.column_stack((self.trajectory_x, self.trajectory_y))
+
+    def to_dict(self):
+        return {
+            "displacement": self.displacement.tolist(),
+            "velocity": self.velocity.tolist(),
+            "heading": self.heading.tolist(),
+            "trajectory_x": self.trajectory_x.tolist(),
+            "trajectory_y": self.trajectory_y.tolist(),
+        }
+
+
+# Computes displacement, velocity, heading and trajectory in a single pass over the data
+def compute_kinematics(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    gyroLeft = np.asarray(gyroLeft, dtype=float)  # Rotation of left wheel (converted to rps by Arduino)
+    gyroRight = np.asarray(gyroRight, dtype=float)  # Rotation of right wheel (converted to rps by Arduino)
+    timeStamps = np.asarray(timeStamps, dtype=float)  # Time (sec)
 
     # remove spikes
     # gyro_data[gyro_data > 20] = 0
 
-    vel_ms = [0]
-    for i in range(len(gyroRight) - 1):
-        # Right wheel velocity:
-        v_r = (gyroRight[i]) * diameter/2*IN_TO_M
-        # Left wheel velocity:
-        v_l = (gyroLeft[i]) * diameter/2*IN_TO_M
-        # Velocity of wheelchair over time:
-        v_curr = (v_r+v_l)/2
-        # Append last change to overall Displacement:
-        vel_ms.append(v_curr)
-    return vel_ms
+    n = len(gyroRight)
+    return _integrate(timeStamps[:n], gyroLeft[:n], gyroRight[:n], diameter, dist_wheels)
+
+
+# Integrates the gyro data starting from the given state at the first sample.
+# Starting from zero gives the full recording; starting from the last emitted
+# sample lets KinematicsStream continue a recording chunk by chunk.
+def _integrate(timeStamps, gyroLeft, gyroRight, diameter, dist_wheels,
+               displacement0=0.0, velocity0=0.0, heading0=0.0, x0=0.0, y0=0.0):
+    dt = np.diff(timeStamps)
+    left = gyroLeft[:-1]
+    right = gyroRight[:-1]
+    wheel_radius_m = diameter * IN_TO_M / 2
+
+    # Change in displacement over each time step, from the wheel rotation in that step:
+    dx_m = (np.abs(left) + np.abs(right)) / 2 * dt * wheel_radius_m
+    displacement = displacement0 + np.concatenate(([0.0], np.cumsum(dx_m)))
+
+    # Velocity of wheelchair over time, lagging the gyro data by one sample:
+    velocity = np.concatenate(([velocity0], (right + left) / 2 * wheel_radius_m))
+
+    # Angular Velocity in each time step (rotating left is positive), converted to a change in degrees:
+    w = (right - left) * wheel_radius_m / (dist_wheels * IN_TO_M)
+    heading = heading0 + np.concatenate(([0.0], np.cumsum(w * dt * 180/np.pi)))
+
+    trajectory_x, trajectory_y = _trajectory(velocity, heading, dt)
+    return Kinematics(timeStamps, displacement, velocity, heading, x0 + trajectory_x, y0 + trajectory_y)
+
+
+# Keeps the running displacement, heading and x/y position of a live recording.
+# Each call to append() integrates only the new chunk of samples and returns the
+# derived points for those samples, so an update costs O(chunk) regardless of
+# how long the recording has been running. Concatenating the chunks returned by
+# append() gives the same series as compute_kinematics over the whole recording.
+class KinematicsStream:
+    def __init__(self, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+        self.diameter = diameter
+        self.dist_wheels = dist_wheels
+        self.count = 0
+        # Last sample seen and the derived state at that sample
+        self._last_sample = None
+        self._last_state = None
+
+    def append(self, timeStamps, gyroLeft, gyroRight):
+        timeStamps = np.asarray(timeStamps, dtype=float)
+        gyroLeft = np.asarray(gyroLeft, dtype=float)
+        gyroRight = np.asarray(gyroRight, dtype=float)
+        if not len(timeStamps) == len(gyroLeft) == len(gyroRight):
+            raise ValueError(
+                f"Chunk arrays must have the same length, got timeStamps={len(timeStamps)}, "
+                f"gyroLeft={len(gyroLeft)}, gyroRight={len(gyroRight)}"
+            )
+
+        if len(timeStamps) == 0:
+            empty = np.empty(0)
+            return Kinematics(empty, empty, empty, empty, empty, empty)
+
+        if self._last_sample is None:
+            kinematics = _integrate(timeStamps, gyroLeft, gyroRight, self.diameter, self.dist_wheels)
+        else:
+            # Prepend the last sample so the first new time step can be integrated, then drop it
+            t0, left0, right0 = self._last_sample
+            kinematics = _integrate(
+                np.concatenate(([t0], timeStamps)),
+                np.concatenate(([left0], gyroLeft)),
+                np.concatenate(([right0], gyroRight)),
+                self.diameter,
+                self.dist_wheels,
+                *self._last_state
+            )
+            kinematics = Kinematics(
+                kinematics.timeStamps[1:],
+                kinematics.displacement[1:],
+                kinematics.velocity[1:],
+                kinematics.heading[1:],
+                kinematics.trajectory_x,
+                kinematics.trajectory_y
+            )
+
+        self._last_sample = (timeStamps[-1], gyroLeft[-1], gyroRight[-1])
+        x, y = self._last_state[3:] if self._last_state is not None else (0.0, 0.0)
+        if len(kinematics.trajectory_x):
+            x, y = kinematics.trajectory_x[-1], kinematics.trajectory_y[-1]
+        self._last_state = (kinematics.displacement[-1], kinematics.velocity[-1], kinematics.heading[-1], x, y)
+        self.count += len(timeStamps)
+        return kinematics
+
+
+# Steps along the current heading at the current velocity for each time step
+def _trajectory(vel_ms, heading_deg, dt):
+    heading_rad = heading_deg[:len(dt)] * np.pi/180
+    dx = vel_ms[:len(dt)] * np.cos(heading_rad) * dt
+    dy = vel_ms[:len(dt)] * np.sin(heading_rad) * dt
+    return np.cumsum(dx), np.cumsum(dy)
+
+
+def get_displacement_m(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    return compute_kinematics(timeStamps, gyroLeft, gyroRight, diameter, dist_wheels).displacement
+
+
+# Displacement along the direction of travel, negative when rolling backwards.
+# Kinematics.displacement is the distance covered, from the absolute wheel rotation.
+def get_signed_displacement_m(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN):
+    timeStamps = np.asarray(timeStamps, dtype=float)
+    n = len(gyroRight)
+    left = np.asarray(gyroLeft, dtype=float)[:n - 1]
+    right = np.asarray(gyroRight, dtype=float)[:n - 1]
+    dx_m = (left + right) / 2 * np.diff(timeStamps[:n]) * diameter * IN_TO_M / 2
+    return np.concatenate(([0.0], np.cumsum(dx_m)))
+
+
+def get_velocity_m_s(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
+    return compute_kinematics(timeStamps, gyroLeft, gyroRight, diameter, dist_wheels).velocity
 
 
 def get_heading_deg(timeStamps, gyroLeft, gyroRight, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    gyroLeft = np.array(gyroLeft)  # Rotation of left wheel (converted to rps by Arduino)
-    gyroRight = np.array(gyroRight)  # Rotation of right wheel (converted to rps by Arduino)
-    timeStamps = np.array(timeStamps)  # Time (sec)
-
-    heading_deg = [0]
-    for i in range(len(gyroRight) - 1):
-        # Angular Velocity in time step (rotating left is positive):
-        w = ((gyroRight[i]-gyroLeft[i]) * diameter*IN_TO_M/2) / (dist_wheels*IN_TO_M)
-        # Change in heading angle over time step:
-        dh = w * (timeStamps[i + 1] - timeStamps[i])
-        # convert to degrees:
-        dh = dh*180/np.pi
-        # Append last change to overall heading angle:
-        heading_deg.append(dh + heading_deg[-1])
-    return heading_deg
+    return compute_kinematics(timeStamps, gyroLeft, gyroRight, diameter, dist_wheels).heading
 
 
 def get_top_traj(disp_m, vel_ms, heading_deg, timeStamps, diameter=WHEEL_DIAM_IN, dist_wheels=DIST_WHEELS_IN):
-    x, y = [], []
-    dx, dy = 0, 0
-
-    for i in range(len(disp_m) - 1):
-        '''
-        dr = disp_m[i + 1] - disp_m[i]
-        dh = heading_deg[i] * np.pi / 180  # radian
-        dx += dr * np.cos(dh)
-        dy += dr * np.sin(dh)
-        '''
-        dx += vel_ms[i]*np.cos(heading_deg[i]*np.pi/180) * (timeStamps[i + 1] - timeStamps[i])
-        dy += vel_ms[i]*np.sin(heading_deg[i]*np.pi/180) * (timeStamps[i + 1] - timeStamps[i])
-        x.append(dx)
-        y.append(dy)
-    traj = [[x[i], y[i]] for i in range(len(x))]
-    return traj
\ No newline at end of file
+    vel_ms = np.asarray(vel_ms, dtype=float)
+    heading_deg = np.asarray(heading_deg, dtype=float)
+    dt = np.diff(np.asarray(timeStamps, dtype=float)[:len(disp_m)])
+
+    # Trajectory is an (n - 1, 2) array of [x, y] positions
+    return np.column_stack(_trajectory(vel_ms, heading_deg, dt))
@@ -0,0 +1,101 @@
+import threading
+import time
+from fastapi import HTTPException
+
+from constants import supabase, CALIBRATION_REFRESH_S
+from executors import db_executor
+
+# Columns kept for each calibration, everything but the raw recording
+CALIBRATION_FIELDS = "id, smarthub_id, calibration_name, left_gain, right_gain, wheel_distance, created_at"
+REFRESH_PAGE_SIZE = 1000
+
+
+# In-process copy of the calibrations table without the raw_data column, indexed
+# by id and by smarthub id. Calibrations are never edited once saved, so a
+# refresh only asks for rows with an id above the highest one already loaded.
+# Rows deleted from the table stay here until the process restarts.
+class CalibrationRegistry:
+    def __init__(self, client=None, refresh_interval=CALIBRATION_REFRESH_S):
+        self.client = client or supabase
+        self.refresh_interval = refresh_interval
+        self.last_id = 0
+        self.last_refresh = None
+        self._by_id = {}
+        self._by_hub = {}
+        self._lock = threading.Lock()
+
+    # Loads calibrations saved since the last refresh, returns how many were new
+    def refresh(self):
+        added = 0
+        while True:
+            response = (
+                self.client.table("calibrations")
+                .select(CALIBRATION_FIELDS)
+                .gt("id", self.last_id)
+                .order("id")
+                .limit(REFRESH_PAGE_SIZE)
+                .execute()
+            )
+            for row in response.data:
+                added += self.add(row)
+            if len(response.data) < REFRESH_PAGE_SIZE:
+                break
+        self.last_refresh = time.monotonic()
+        return added
+
+    def refresh_if_stale(self):
+        if self.last_refresh is None or time.monotonic() - self.last_refresh > self.refresh_interval:
+            return self.refresh()
+        return 0
+
+    # Adds one row, e.g. straight after it was saved. Returns whether it was new.
+    def add(self, row):
+        row = {key: row.get(key) for key in CALIBRATION_FIELDS.split(", ")}
+        with self._lock:
+            if row["id"] in self._by_id:
+                return False
+            self._by_id[row["id"]] = row
+            self._by_hub.setdefault(row["smarthub_id"], []).append(row)
+            self.last_id = max(self.last_id, row["id"])
+            return True
+
+    # Returns the calibration with this id, or None if it is not loaded
+    def get(self, calibration_id):
+        return self._by_id.get(int(calibration_id))
+
+    # Like get, but reloads the registry once when the id is not loaded yet,
+    # e.g. for a calibration saved by another process
+    def get_or_refresh(self, calibration_id):
+        calibration = self.get(calibration_id)
+        if calibration is None:
+            self.refresh()
+            calibration = self.get(calibration_id)
+        return calibration
+
+    # Calibrations of one smarthub, oldest first
+    def for_hub(self, smarthub_id):
+        return list(self._by_hub.get(smarthub_id, []))
+
+    # Every calibration, oldest first
+    def all(self):
+        with self._lock:
+            return sorted(self._by_id.values(), key=lambda row: row["id"])
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+calibrations = CalibrationRegistry()
+
+
+# Looks a calibration up in the registry, reloading it once if the id is not there yet
+async def get_calibration_or_404(calibration_id):
+    try:
+        calibration = calibrations.get(calibration_id)
+        if calibration is None:
+            calibration = await db_executor.run(calibrations.get_or_refresh, calibration_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail=f"Invalid calibration id: {calibration_id}")
+    if calibration is None:
+        raise HTTPException(status_code=404, detail=f"Calibration {calibration_id} not found")
+    return calibration
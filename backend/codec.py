@@ -0,0 +1,138 @@
+import base64
+import struct
+import zlib
+import numpy as np
+
+# Encoded arrays are stored as text so they fit the existing JSON columns:
+#   PREFIX + base64(header + zlib(segment lengths + values))
+# Anything without the prefix is a plain JSON array and is returned as is.
+PREFIX = "swc:"
+MAGIC = b"SWC"
+VERSION = 1
+
+# Floats stored as they are: float32, or float64 when the header's width is 8
+CODEC_FLOAT = 1
+CODEC_DELTA = 2
+
+# magic, version, codec, integer width (bytes), sample count, segment count,
+# step, and the first value (in steps for the delta codec)
+HEADER = struct.Struct("<3sBBBII2d")
+
+# Quantization step per series for the delta codec, the largest error is half a step.
+# Time stamps are in ms, gyro and accel in sensor units, distances in m, heading in degrees.
+SERIES_STEPS = {
+    "timeStamp": 1e-3,
+    "gyroLeft": 1e-4,
+    "gyroRight": 1e-4,
+    "accelLeft": 1e-4,
+    "accelRight": 1e-4,
+    "distance": 1e-5,
+    "displacement": 1e-5,
+    "velocity": 1e-5,
+    "heading": 1e-4,
+    "trajectory_x": 1e-5,
+    "trajectory_y": 1e-5,
+    # Time of the level-of-detail chunks in test_lod (see lod.py), in seconds
+    "time": 1e-6,
+}
+COMPRESSION_LEVEL = 6
+
+
+# Quantized values beyond this many steps fall back to float64, so neither they
+# nor their differences can overflow int64
+MAX_STEPS = 2 ** 62
+
+
+# Packs a series (flat, or one list per BLE packet) into an encoded string.
+# With codec="delta" the values are rounded to multiples of `step`, and the
+# differences between neighbours are stored as int16, int32 or int64, the
+# smallest they fit in. Series with NaN or inf, or without a step, fall back
+# to float32, and values too large to quantize to float64.
+# Raises ValueError for anything but a flat list of numbers or a list of such lists.
+def encode_series(values, step=None, codec="delta"):
+    nested = [isinstance(value, (list, tuple)) for value in values]
+    if any(nested) and not all(nested):
+        raise ValueError("Series mixes packet lists and single values")
+    nested = len(values) > 0 and all(nested)
+    lengths = np.array([len(value) for value in values], dtype="<i4") if nested else np.empty(0, dtype="<i4")
+    try:
+        flat = np.asarray([item for value in values for item in value] if nested else values, dtype=float)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Series values must be numbers: {e}")
+    if flat.ndim != 1:
+        raise ValueError(f"Series must be a list of numbers or of packet lists, got {flat.ndim} levels")
+
+    finite = np.all(np.isfinite(flat))
+    if codec == "delta" and step and finite and (len(flat) == 0 or np.abs(flat).max() / step < MAX_STEPS):
+        quantized = np.round(flat / step).astype(np.int64)
+        first = int(quantized[0]) if len(quantized) else 0
+        deltas = np.diff(quantized, prepend=first)
+        largest = np.abs(deltas).max() if len(deltas) else 0
+        width = 2 if largest < 2 ** 15 else 4 if largest < 2 ** 31 else 8
+        body = deltas.astype(f"<i{width}").tobytes()
+        header = HEADER.pack(MAGIC, VERSION, CODEC_DELTA, width, len(flat), len(lengths), step, first)
+    else:
+        width = 8 if codec == "delta" and step and finite else 4
+        body = flat.astype(f"<f{width}").tobytes()
+        header = HEADER.pack(MAGIC, VERSION, CODEC_FLOAT, width, len(flat), len(lengths), 0.0, 0.0)
+
+    packed = header + zlib.compress(lengths.tobytes() + body, COMPRESSION_LEVEL)
+    return PREFIX + base64.b64encode(packed).decode("ascii")
+
+
+# Decimal places a multiple of step needs, e.g. 4 for 1e-4 and 2 for 0.25
+def _decimals(step):
+    for decimals in range(16):
+        if abs(step * 10 ** decimals - round(step * 10 ** decimals)) < 1e-9:
+            return decimals
+    return 15
+
+
+def is_encoded(value):
+    return isinstance(value, str) and value.startswith(PREFIX)
+
+
+# Unpacks a string from encode_series back into a list, nested again if it was
+# encoded per packet. Values that are not encoded are returned unchanged.
+def decode_series(value):
+    if not is_encoded(value):
+        return value
+    packed = base64.b64decode(value[len(PREFIX):])
+    magic, version, codec, width, count, segments, step, first = HEADER.unpack_from(packed)
+    if magic != MAGIC or version > VERSION:
+        raise ValueError(f"Unsupported encoded series (magic {magic!r}, version {version})")
+
+    raw = zlib.decompress(packed[HEADER.size:])
+    lengths = np.frombuffer(raw, dtype="<i4", count=segments)
+    body = raw[segments * 4:]
+    if codec == CODEC_DELTA:
+        flat = (int(first) + np.cumsum(np.frombuffer(body, dtype=f"<i{width}", count=count), dtype=np.int64)) * step
+        # Round off the float noise of the multiplication, 0.3 rather than 0.30000000000000004
+        flat = np.round(flat, _decimals(step))
+    elif codec == CODEC_FLOAT:
+        flat = np.frombuffer(body, dtype=f"<f{width}", count=count).astype(float)
+    else:
+        raise ValueError(f"Unknown codec {codec}")
+
+    if segments:
+        return [segment.tolist() for segment in np.split(flat, np.cumsum(lengths)[:-1])]
+    return flat.tolist()
+
+
+# Encodes every array column of a test_files row, leaving other columns alone.
+# codec="json" stores the arrays as they are.
+def encode_test_files(row, codec="delta"):
+    if codec == "json":
+        return dict(row)
+    return {
+        name: encode_series(values, SERIES_STEPS.get(name), codec) if isinstance(values, list) else values
+        for name, values in row.items()
+    }
+
+
+# Decodes every encoded column of a test_files row, so rows written in either
+# format read the same
+def decode_test_files(row):
+    if not row:
+        return row
+    return {name: decode_series(value) for name, value in row.items()}
@@ -1,13 +1,31 @@
 import os
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 
 load_dotenv()
 
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
+# Secret Supabase signs access tokens with (Project Settings > API > JWT secret).
+# When set, tokens are checked locally instead of with a call to the auth server.
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
 
-supabase: Client = create_client(url, key)
+# Database calls run on DB_WORKERS threads (see executors.db_executor), which share
+# one HTTP connection pool of the same size, so every worker can keep a connection open
+DB_WORKERS = int(os.environ.get("DB_WORKERS", 16))
+# Database calls allowed to wait for a worker before requests are turned away with a 503
+DB_MAX_QUEUE = int(os.environ.get("DB_MAX_QUEUE", 256))
+DB_TIMEOUT_S = float(os.environ.get("DB_TIMEOUT_S", 120))
+
+http_client = httpx.Client(
+    limits=httpx.Limits(max_connections=DB_WORKERS, max_keepalive_connections=DB_WORKERS),
+    timeout=DB_TIMEOUT_S,
+    follow_redirects=True
+)
+# Every sub-client (PostgREST, auth, storage) takes the pool through ClientOptions.httpx_client,
+# supported by the supabase version pinned in requirements.txt
+supabase: Client = create_client(url, key, options=ClientOptions(httpx_client=http_client))
 
 
 # API configuration
@@ -18,4 +36,40 @@ API_PORT = 8000
 ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000"
-]
\ No newline at end of file
+]
+
+# Executor for CPU-bound request handlers: "thread", "process" or "inline" (run on the event loop)
+EXECUTOR_KIND = os.environ.get("EXECUTOR_KIND", "thread")
+EXECUTOR_WORKERS = int(os.environ.get("EXECUTOR_WORKERS", 4))
+# Requests allowed to wait for a worker before new ones are turned away with a 503
+EXECUTOR_MAX_QUEUE = int(os.environ.get("EXECUTOR_MAX_QUEUE", 32))
+
+# Pool for multi-start calibration solves, one start per worker (0 uses one per CPU core)
+SOLVER_EXECUTOR_KIND = os.environ.get("SOLVER_EXECUTOR_KIND", "process")
+SOLVER_WORKERS = int(os.environ.get("SOLVER_WORKERS", 0)) or None
+
+# Worker processes for batch reprocessing (0 uses one per CPU core)
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 0)) or None
+# Tests of one batch request being fetched or reprocessed at the same time
+BATCH_MAX_IN_FLIGHT = int(os.environ.get("BATCH_MAX_IN_FLIGHT", 16))
+
+# Solved calibrations kept in memory, keyed by their raw-data fingerprint
+CALIBRATION_CACHE_SIZE = int(os.environ.get("CALIBRATION_CACHE_SIZE", 256))
+# Seconds between refreshes of the in-process calibration registry
+CALIBRATION_REFRESH_S = float(os.environ.get("CALIBRATION_REFRESH_S", 30))
+
+# Seconds the total test count shown by the test listing is reused for
+TEST_COUNT_TTL_S = float(os.environ.get("TEST_COUNT_TTL_S", 60))
+
+# How write_test stores test_files arrays: "delta" (quantized, delta coded and
+# compressed), "float32" (compressed) or "json" (plain arrays). Reads handle all three.
+STORAGE_CODEC = os.environ.get("STORAGE_CODEC", "delta")
+
+# What write_test stores in test_files: "full" (raw and derived series) or "raw"
+# (time, gyro and accel only; derived series are computed when the test is read)
+STORAGE_MODE = os.environ.get("STORAGE_MODE", "full")
+# Derived series kept in memory for tests stored raw, by test and calibration
+DERIVED_CACHE_SIZE = int(os.environ.get("DERIVED_CACHE_SIZE", 32))
+# In-process cache of /db/tests/{id} responses, bounded by the size of their JSON
+TEST_CACHE_MAX_BYTES = int(os.environ.get("TEST_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+TEST_CACHE_TTL_S = float(os.environ.get("TEST_CACHE_TTL_S", 600))
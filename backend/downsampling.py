@@ -0,0 +1,101 @@
+import numpy as np
+
+# Points a chart needs, used when a caller asks for downsampling without a size
+DEFAULT_MAX_POINTS = 2000
+METHODS = ("lttb", "minmax")
+
+
+# Splits n samples into `buckets` contiguous ranges of near equal size
+def _bucket_edges(start, stop, buckets):
+    return np.linspace(start, stop, buckets + 1).astype(np.int64)
+
+
+# Largest-Triangle-Three-Buckets: keeps the first and last sample and, from each
+# bucket in between, the sample forming the largest triangle with the sample
+# kept from the previous bucket and the mean of the next bucket.
+# Returns the indices of the n_out kept samples, in order.
+def lttb_indices(x, y, n_out):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    # The first and last sample are always kept, so fewer than 3 points is not useful
+    n_out = max(n_out, 3)
+    if n_out >= n:
+        return np.arange(n)
+
+    edges = _bucket_edges(1, n - 1, n_out - 2)
+    # Means of every bucket in one go, the last "bucket" is the final sample
+    sums_x = np.add.reduceat(x[:n - 1], edges[:-1])
+    sums_y = np.add.reduceat(y[:n - 1], edges[:-1])
+    counts = np.diff(edges)
+    mean_x = np.append(sums_x / counts, x[-1])
+    mean_y = np.append(sums_y / counts, y[-1])
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    anchor = 0
+    # Each bucket depends on the sample kept from the one before, so only the
+    # search inside a bucket is vectorized
+    for bucket in range(n_out - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        ax, ay = x[anchor], y[anchor]
+        area = np.abs((ax - mean_x[bucket + 1]) * (y[start:stop] - ay) - (ax - x[start:stop]) * (mean_y[bucket + 1] - ay))
+        anchor = start + int(np.argmax(area))
+        indices[bucket + 1] = anchor
+    return indices
+
+
+# Keeps the minimum and maximum of each bucket plus the first and last sample,
+# so every peak survives. Returns at most max(n_out, 4) indices, in order.
+def minmax_indices(y, n_out):
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    buckets = max((n_out - 2) // 2, 1)
+    edges = _bucket_edges(1, n - 1, buckets)
+
+    # Buckets are padded to the longest one by repeating their last sample
+    offsets = np.arange(int(np.diff(edges).max()))
+    grid = np.minimum(edges[:-1, None] + offsets, edges[1:, None] - 1)
+    values = y[grid]
+    rows = np.arange(buckets)
+    picked = np.concatenate(([0], grid[rows, values.argmin(axis=1)], grid[rows, values.argmax(axis=1)], [n - 1]))
+    return np.unique(picked)
+
+
+def downsample_indices(x, y, n_out, method="lttb"):
+    if method == "lttb":
+        return lttb_indices(x, y, n_out)
+    if method == "minmax":
+        return minmax_indices(y, n_out)
+    raise ValueError(f"Unknown downsampling method: {method}")
+
+
+# Indices to keep for several series that share one time axis: each series gets
+# an equal share of max_points and the selections are merged, so the result has
+# at most max_points samples and keeps the peaks of every series
+def shared_indices(x, series, max_points, method="lttb"):
+    n = len(x)
+    if max_points >= n or not series:
+        return np.arange(n)
+    share = max(max_points // len(series), 3)
+    picked = [downsample_indices(x[:len(values)], values, share, method) for values in series]
+    return np.unique(np.concatenate(picked))
+
+
+# Downsamples a dict of arrays that share the time axis `x`, picking the samples
+# by the `reference` columns (all columns when not given). Columns shorter than x,
+# such as the trajectory, keep the picked samples that fall inside them.
+# Columns that are not arrays are passed through.
+def downsample_columns(x, columns, max_points, method="lttb", reference=None):
+    x = np.asarray(x, dtype=float)
+    arrays = {name: np.asarray(values, dtype=float) for name, values in columns.items()
+              if isinstance(values, (list, tuple, np.ndarray)) and len(values) > 0}
+    reference = [arrays[name] for name in (reference or arrays) if name in arrays]
+    indices = shared_indices(x, reference, max_points, method)
+
+    downsampled = dict(columns)
+    for name, values in arrays.items():
+        downsampled[name] = values[indices[indices < len(values)]].tolist()
+    return x[indices], downsampled
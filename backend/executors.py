@@ -0,0 +1,74 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from fastapi import HTTPException
+
+from constants import (EXECUTOR_KIND, EXECUTOR_WORKERS, EXECUTOR_MAX_QUEUE, BATCH_WORKERS, SOLVER_EXECUTOR_KIND, SOLVER_WORKERS,
+                       DB_WORKERS, DB_MAX_QUEUE)
+
+
+# Runs CPU-bound work (FFTs, kinematics, calibration solves) off the event loop
+# so one heavy request does not stall every other request.
+#
+# kind is "thread", "process" or "inline". Process workers need functions and
+# arguments that can be pickled. "inline" runs on the event loop as before and is
+# only meant for comparison. At most `workers` jobs run at once and at most
+# `max_queue` more wait for a worker; past that, requests get a 503 instead of
+# piling up. max_queue=None means no limit.
+class CPUExecutor:
+    def __init__(self, kind=EXECUTOR_KIND, workers=EXECUTOR_WORKERS, max_queue=EXECUTOR_MAX_QUEUE, name="cpu"):
+        if kind not in ("thread", "process", "inline"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.name = name
+        self.workers = workers or os.cpu_count()
+        self.max_queue = max_queue
+        self.pending = 0
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._pool
+
+    async def run(self, fn, *args, **kwargs):
+        if self.kind == "inline":
+            return fn(*args, **kwargs)
+
+        if self.max_queue is not None and self.pending >= self.workers + self.max_queue:
+            raise HTTPException(status_code=503, detail="Server is busy, try again shortly")
+
+        # Only touched from the event loop, so a plain counter is enough
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_pool(), partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    # Blocking map for code that is already running off the event loop
+    def map(self, fn, iterable):
+        if self.kind == "inline":
+            return list(map(fn, iterable))
+        return list(self._get_pool().map(fn, iterable))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Request handlers (/calculate, /calibrate)
+cpu_executor = CPUExecutor()
+# Multi-start calibration, called from inside a calibration job
+solver_executor = CPUExecutor(SOLVER_EXECUTOR_KIND, SOLVER_WORKERS, max_queue=None)
+# Archive reprocessing, one process per core and no queue limit since a batch queues all its tests up front
+batch_executor = CPUExecutor("process", BATCH_WORKERS, max_queue=None)
+# Blocking Supabase calls. The client is synchronous, so each call holds a thread
+# for its round trip; a bounded pool keeps them off the event loop without
+# starting a thread per request. Its threads share constants.http_client.
+db_executor = CPUExecutor("thread", DB_WORKERS, max_queue=DB_MAX_QUEUE, name="db")
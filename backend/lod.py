@@ -0,0 +1,97 @@
+import numpy as np
+
+from codec import encode_test_files
+from downsampling import downsample_columns, shared_indices
+
+# Each level keeps about 1/LOD_FACTOR of the samples of the level below it
+LOD_FACTOR = 4
+# Levels stop once one has no more than this many samples
+LOD_MIN_POINTS = 1000
+# Samples per stored chunk, a window only loads the chunks it overlaps
+LOD_CHUNK_POINTS = 4096
+
+
+# Builds the level-of-detail pyramid of a recording as rows for the test_lod table.
+# Level 0 is the full recording, level k has about 1/LOD_FACTOR**k of its samples,
+# picked per bucket by min-max from level k - 1 so peaks survive every level.
+# Level 0 already lives in test_files, so it gets a single row without data that
+# only describes it. Every coarser level is cut into chunks of LOD_CHUNK_POINTS samples:
+#   {"level", "chunk", "level_count", "start_time", "end_time", "data": {"time": [], <series>: []}}
+# time is in seconds. Series shorter than time (the trajectory) are shorter in the last chunk too.
+# The arrays of data are encoded with codec like test_files (see codec.py), decode_test_files reads them.
+def build_pyramid(time, series, factor=LOD_FACTOR, min_points=LOD_MIN_POINTS, chunk_points=LOD_CHUNK_POINTS, codec="delta"):
+    time = np.asarray(time, dtype=float)
+    series = {name: np.asarray(values, dtype=float) for name, values in series.items()}
+    if len(time) == 0:
+        return []
+    rows = [_level_row(0, 0, time, 0, len(time), None)]
+    level = 0
+    while True:
+        target = len(time) // factor
+        if len(time) <= min_points or target < 3:
+            return rows
+        indices = shared_indices(time, list(series.values()), target, "minmax")
+        series = {name: values[indices[indices < len(values)]] for name, values in series.items()}
+        time = time[indices]
+        level += 1
+        rows.extend(_chunk_level(level, time, series, chunk_points, codec))
+
+
+def _chunk_level(level, time, series, chunk_points, codec):
+    rows = []
+    for chunk, start in enumerate(range(0, len(time), chunk_points)):
+        stop = min(start + chunk_points, len(time))
+        data = {"time": time[start:stop].tolist(), **{name: values[start:stop].tolist() for name, values in series.items()}}
+        rows.append(_level_row(level, chunk, time, start, stop, encode_test_files(data, codec)))
+    return rows
+
+
+def _level_row(level, chunk, time, start, stop, data):
+    return {
+        "level": level,
+        "chunk": chunk,
+        "level_count": len(time),
+        "start_time": float(time[start]),
+        "end_time": float(time[stop - 1]),
+        "data": data
+    }
+
+
+# Picks the finest level that has no more than max_points samples in [t0, t1],
+# from the chunk metadata of a pyramid (rows without "data").
+# Returns the level and the chunks of it that overlap the window.
+def choose_level(chunks, t0, t1, max_points):
+    levels = {}
+    for chunk in chunks:
+        levels.setdefault(chunk["level"], []).append(chunk)
+
+    for level in sorted(levels):
+        level_chunks = levels[level]
+        start = min(chunk["start_time"] for chunk in level_chunks)
+        end = max(chunk["end_time"] for chunk in level_chunks)
+        # Samples are close enough to evenly spread for an estimate
+        fraction = (min(t1, end) - max(t0, start)) / (end - start) if end > start else 1
+        if level_chunks[0]["level_count"] * max(fraction, 0) <= max_points or level == max(levels):
+            overlapping = [chunk["chunk"] for chunk in level_chunks if chunk["end_time"] >= t0 and chunk["start_time"] <= t1]
+            return level, sorted(overlapping)
+
+
+# Joins the decoded chunks of one level and cuts them to [t0, t1], downsampling further
+# with LTTB if the window still has more than max_points samples.
+# Returns {"time": [], "series": {<series>: []}}, series padded with None to the length of time.
+def window(chunks, t0, t1, max_points):
+    chunks = sorted(chunks, key=lambda chunk: chunk["chunk"])
+    time = np.concatenate([chunk["data"]["time"] for chunk in chunks]) if chunks else np.empty(0)
+    names = [name for name in (chunks[0]["data"] if chunks else {}) if name != "time"]
+    series = {name: np.concatenate([chunk["data"][name] for chunk in chunks]) for name in names}
+
+    start, stop = np.searchsorted(time, t0, side="left"), np.searchsorted(time, t1, side="right")
+    time = time[start:stop]
+    columns = {name: values[start:stop] for name, values in series.items()}
+    if len(time) > max_points:
+        time, columns = downsample_columns(time, columns, max_points)
+
+    return {
+        "time": np.asarray(time).tolist(),
+        "series": {name: np.asarray(values).tolist() + [None] * (len(time) - len(values)) for name, values in columns.items()}
+    }
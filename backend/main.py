@@ -2,7 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from routers import auth, db, calibrate, calculate
-from constants import ALLOWED_ORIGINS, API_HOST, API_PORT
+from constants import ALLOWED_ORIGINS, API_HOST, API_PORT, SUPABASE_JWT_SECRET
 
 app = FastAPI()
 
@@ -20,6 +20,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Without the secret every request that needs the user asks the auth server, see auth_tokens.py
+if not SUPABASE_JWT_SECRET:
+    print("SUPABASE_JWT_SECRET is not set: access tokens are checked with the Supabase auth server, "
+          "which adds a round trip to /db/write_test")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=API_HOST, port=API_PORT)
\ No newline at end of file
@@ -48,6 +48,13 @@ class Metrics:
         self.st_freq_su.append(st_freq_su)
         self.st_freq_ss.append(st_freq_ss)
 
+    # Plain lists of floats for JSON responses, with NaN (e.g. the mean of an empty phase) as None
+    def to_dict(self):
+        return {
+            name: [None if np.isnan(value) else value for value in np.asarray(values, dtype=float).ravel().tolist()]
+            for name, values in vars(self).items()
+        }
+
 
 def data_analyze_main(time_from_start, distance, velocity):
     metrics = calculate_bout(time_from_start, distance, velocity)
@@ -11,6 +11,16 @@ WHEEL_DIAM_IN = 24
 IN_TO_M = 0.0254
 DIST_WHEELS_IN = 26
 
+# Low pass filtering of the gyro data
+SAMPLE_RATE_HZ = 68
+FILTER_CUTOFF_HZ = 6
+FILTER_ORDER = 4
+# Threads used by one FFT smoothing call (-1 for all cores) and how many cutoff masks to cache.
+# smooth_data runs inside the executor pools, which already spread requests over
+# the cores, so each call uses a single thread instead of competing for all of them.
+FFT_WORKERS = int(os.environ.get("FFT_WORKERS", 1))
+FFT_MASK_CACHE_SIZE = 64
+
 DATETIME_FMT = '%Y%m%d'
 DATETIME_HMS_FMT = '%Y%m%d-%H%M%S'
 DATE_DAY = datetime.now().strftime(DATETIME_FMT)
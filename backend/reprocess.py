@@ -0,0 +1,134 @@
+import numpy as np
+
+from calc import compute_kinematics, get_signed_displacement_m, resample_uniform, smooth_data
+from metricsService import data_analyze_main
+from params import WHEEL_DIAM_IN, DIST_WHEELS_IN, SAMPLE_RATE_HZ
+from sessions import DEFAULT_LEFT_GAIN, DEFAULT_RIGHT_GAIN
+
+# Bump when a change to derive_series should stop cached results from being used
+DERIVATION_VERSION = 2
+
+# Settings used when a batch request does not give its own
+DEFAULT_SETTINGS = {
+    "leftGain": DEFAULT_LEFT_GAIN,
+    "rightGain": DEFAULT_RIGHT_GAIN,
+    "diameter": WHEEL_DIAM_IN,
+    "wheel_distance": DIST_WHEELS_IN,
+    "smooth": True,
+    "resample": False,
+    "include_series": False
+}
+
+
+# Reprocesses one test: smoothing, gains, kinematics and bout/stroke metrics.
+# Runs in a worker process, so it only takes and returns plain data.
+#
+# payload: {"id": any, "timeStamps" or "timeStamp": [floats], "gyroLeft": [floats], "gyroRight": [floats]}
+def reprocess_test(payload, settings):
+    settings = {**DEFAULT_SETTINGS, **settings}
+    timeStamps, kinematics = process_arrays(*test_arrays(payload), settings)
+    metrics = data_analyze_main(timeStamps, kinematics.displacement, kinematics.velocity)
+
+    result = {
+        "id": payload.get("id"),
+        "sample_count": len(timeStamps),
+        "duration": float(timeStamps[-1] - timeStamps[0]),
+        "distance": float(kinematics.displacement[-1]),
+        "metrics": metrics.to_dict()
+    }
+    if settings["include_series"]:
+        result.update(kinematics.to_dict())
+        result["timeStamp"] = timeStamps.tolist()
+    return result
+
+
+# Reprocesses a stored test_files row. Like derive_series, its time stamps are
+# converted from ms, and its gyro data, already smoothed and multiplied by the
+# default gains by the recorder, is not smoothed again: the settings' gains are
+# applied relative to the default ones.
+def reprocess_test_files(test_id, test_files, settings):
+    settings = {**DEFAULT_SETTINGS, **settings}
+    payload = {
+        "id": test_id,
+        "timeStamp": flatten_series(test_files.get("timeStamp") or []) / 1000,
+        "gyroLeft": test_files["gyroLeft"],
+        "gyroRight": test_files["gyroRight"]
+    }
+    return reprocess_test(payload, {
+        **settings,
+        "smooth": False,
+        "leftGain": settings["leftGain"] / DEFAULT_LEFT_GAIN,
+        "rightGain": settings["rightGain"] / DEFAULT_RIGHT_GAIN
+    })
+
+
+# Smoothing, gains and kinematics for one recording, returns the (possibly
+# resampled) time stamps and the Kinematics. resample works with or without smoothing.
+def process_arrays(timeStamps, gyroLeft, gyroRight, settings):
+    if settings["smooth"]:
+        smoothed = smooth_data({'timeStamps': timeStamps, 'gyroLeft': gyroLeft, 'gyroRight': gyroRight},
+                               resample=settings["resample"])
+        timeStamps = np.asarray(smoothed.get('timeStamps', timeStamps))
+        gyroLeft = np.asarray(smoothed['gyro_left_smoothed'])
+        gyroRight = np.asarray(smoothed['gyro_right_smoothed'])
+    elif settings["resample"]:
+        timeStamps, (gyroLeft, gyroRight), _ = resample_uniform(timeStamps, gyroLeft, gyroRight)
+
+    gyroLeft = gyroLeft * settings["leftGain"]
+    gyroRight = gyroRight * settings["rightGain"]
+    return timeStamps, compute_kinematics(timeStamps, gyroLeft, gyroRight, settings["diameter"], settings["wheel_distance"])
+
+
+# Derived series of a stored test_files row, computed from its gyro data the
+# way the recorder computes them. Stored time stamps are in ms.
+#
+# The stored gyro data has already been smoothed, multiplied by the default
+# gains and thresholded by the recorder, so it is used as it is. A calibration
+# replaces the default gains: the data is scaled by calibration gain / default
+# gain, with the unit wheel diameter calibrations are solved with.
+# Returns NumPy arrays named as the test_files columns: "distance" from the
+# absolute wheel rotation, "displacement" signed.
+def derive_series(test_files, calibration=None):
+    timeStamps = flatten_series(test_files.get("timeStamp") or [])
+    timeStamps, gyroLeft, gyroRight = test_arrays({**test_files, "timeStamp": timeStamps / 1000})
+
+    diameter, wheel_distance = WHEEL_DIAM_IN, DIST_WHEELS_IN
+    if calibration is not None:
+        gyroLeft = gyroLeft * calibration["left_gain"] / DEFAULT_LEFT_GAIN
+        gyroRight = gyroRight * calibration["right_gain"] / DEFAULT_RIGHT_GAIN
+        diameter, wheel_distance = 1, calibration["wheel_distance"]
+
+    kinematics = compute_kinematics(timeStamps, gyroLeft, gyroRight, diameter, wheel_distance)
+    return {
+        "distance": kinematics.displacement,
+        "displacement": get_signed_displacement_m(timeStamps, gyroLeft, gyroRight, diameter),
+        "velocity": kinematics.velocity,
+        "heading": kinematics.heading,
+        "trajectory_x": kinematics.trajectory_x,
+        "trajectory_y": kinematics.trajectory_y
+    }
+
+
+# Pulls flat, equally long time/gyro arrays out of a test payload.
+# Stored tests keep one list per BLE packet and may have no time stamps, in
+# which case they are spaced at the nominal sample rate.
+def test_arrays(payload):
+    gyroLeft = flatten_series(payload["gyroLeft"])
+    gyroRight = flatten_series(payload["gyroRight"])
+    timeStamps = payload.get("timeStamps", payload.get("timeStamp"))
+    timeStamps = flatten_series(timeStamps if timeStamps is not None else [])
+
+    n = min(len(gyroLeft), len(gyroRight))
+    if len(timeStamps) == 0:
+        timeStamps = np.arange(n) / SAMPLE_RATE_HZ
+    n = min(n, len(timeStamps))
+    if n < 2:
+        raise ValueError(f"Test needs at least 2 samples, got {n}")
+    return timeStamps[:n], gyroLeft[:n], gyroRight[:n]
+
+
+# Flattens a series that may be stored as a list of per-packet lists
+def flatten_series(values):
+    if any(isinstance(value, (list, tuple)) for value in values):
+        return np.concatenate([np.atleast_1d(np.asarray(value, dtype=float)) for value in values])
+    return np.asarray(values, dtype=float)
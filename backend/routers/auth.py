@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from constants import supabase
+from executors import db_executor
 from pydantic import BaseModel
 
 router = APIRouter(
@@ -18,12 +19,16 @@ class AuthRequest(BaseModel):
 @router.post("/login")
 async def login(request: AuthRequest):
     try:
-        response = supabase.auth.sign_in_with_password(
+        response = await db_executor.run(
+            supabase.auth.sign_in_with_password,
             {
                 "email": request.email,
                 "password": request.password,
             }
         )
+    except HTTPException:
+        # e.g. the 503 of a saturated db_executor, not a failed login
+        raise
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
     return response
@@ -31,18 +36,19 @@ async def login(request: AuthRequest):
 # Returns the current auth session
 @router.get("/me")
 async def me():
-    return supabase.auth.get_user()
+    return await db_executor.run(supabase.auth.get_user)
 
 # Logs the user out and deletes their current session in supabase
 @router.post("/logout")
 async def logout():
-    response = supabase.auth.sign_out()
+    response = await db_executor.run(supabase.auth.sign_out)
     return response
 
 # Creates a new user in the db
 @router.post("/signup")
 async def signup(request: AuthRequest):
-    new_user = supabase.auth.sign_up(
+    new_user = await db_executor.run(
+        supabase.auth.sign_up,
         {
             "email": request.email,
             "password": request.password,
@@ -1,6 +1,19 @@
-from fastapi import APIRouter
-from calc import get_displacement_m, get_velocity_m_s, get_heading_deg, get_top_traj, smooth_data
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.websockets import WebSocketState
+import asyncio
+import itertools
+import json
+import numpy as np
+from calc import compute_kinematics, smooth_data
 from metricsService import data_analyze_main
+from reprocess import reprocess_test, reprocess_test_files
+from sessions import packet_error, sessions
+from calibrations import get_calibration_or_404
+from codec import decode_test_files
+from downsampling import METHODS as DOWNSAMPLING_METHODS, downsample_columns
+from constants import supabase, BATCH_MAX_IN_FLIGHT
+from executors import cpu_executor, batch_executor, db_executor
 
 router = APIRouter(
     prefix="/calculate",
@@ -8,52 +21,307 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
-# Expected input 
+# Expected input
+# {
+#   "timeStamps": [floats],
+#   "gyroLeft": [floats],
+#   "gyroRight": [floats],
+#   "calibration_id": integer      optional, a saved calibration to apply
+#   "max_points": integer          optional, downsample the response to about this many samples
+#   "downsample": "lttb" | "minmax"
+# }
 @router.post("/")
 async def calc(data: dict):
-    
-    rightGain = 1.12
-    leftGain = 1.13
+    calibration = None
+    if data.get("calibration_id") is not None:
+        calibration = await get_calibration_or_404(data["calibration_id"])
+    if data.get("downsample", "lttb") not in DOWNSAMPLING_METHODS:
+        raise HTTPException(status_code=422, detail=f"Unknown downsampling method: {data['downsample']}")
+    max_points = data.get("max_points")
+    if max_points is not None and (type(max_points) is not int or max_points < 3):
+        raise HTTPException(status_code=422, detail="max_points must be an integer >= 3")
+    return await cpu_executor.run(calculate_kinematics, data, calibration)
 
-    # Apply gain to each element in the smoothed arrays
-    data["gyroRight"] = [x * rightGain for x in data["gyroRight"]]
-    data["gyroLeft"] = [x * leftGain for x in data["gyroLeft"]]
+# Series the downsampled samples are picked by
+DOWNSAMPLING_REFERENCE = ("displacement", "velocity", "heading", "gyroLeft", "gyroRight")
 
+def calculate_kinematics(data, calibration=None):
+    rightGain = 1.12
+    leftGain = 1.13
     # Default wheel_distance if not present
     wheel_distance = 26
+    diameter = 24
+
+    if calibration is not None:
+        rightGain = calibration["right_gain"]
+        leftGain = calibration["left_gain"]
+        wheel_distance = calibration["wheel_distance"]
+        # Calibrations are solved with a unit wheel diameter, their gains already include it
+        diameter = 1
 
-    displacement = get_displacement_m(data["timeStamps"], data["gyroLeft"], data["gyroRight"], 24, wheel_distance)
-    velocity = get_velocity_m_s(data["timeStamps"], data["gyroLeft"], data["gyroRight"], 24, wheel_distance)
-    heading = get_heading_deg(data["timeStamps"], data["gyroLeft"], data["gyroRight"], 24, wheel_distance)
-    trajectory = get_top_traj(disp_m=displacement, vel_ms=velocity, heading_deg=heading, timeStamps=data["timeStamps"])
+    # Apply gain to each element in the smoothed arrays
+    gyroRight = np.asarray(data["gyroRight"], dtype=float) * rightGain
+    gyroLeft = np.asarray(data["gyroLeft"], dtype=float) * leftGain
 
-    # Transform trajectory data to separate x,y arrays to match frontend expectations
-    trajectory_x = [point[0] for point in trajectory] if trajectory else []
-    trajectory_y = [point[1] for point in trajectory] if trajectory else []
+    kinematics = compute_kinematics(data["timeStamps"], gyroLeft, gyroRight, diameter, wheel_distance)
 
-    return {
-        "displacement": displacement,
-        "velocity": velocity,
-        "heading": heading,
-        "trajectory_x": trajectory_x,
-        "trajectory_y": trajectory_y,
-        "gyroLeft": data["gyroLeft"],
-        "gyroRight": data["gyroRight"],
+    response = {
+        **kinematics.to_dict(),
+        "gyroLeft": gyroLeft.tolist(),
+        "gyroRight": gyroRight.tolist(),
         "timeStamp": data["timeStamps"]
     }
 
+    if data.get("max_points") is not None:
+        timeStamps, response = downsample_columns(data["timeStamps"], response, data["max_points"],
+                                                  data.get("downsample", "lttb"), reference=DOWNSAMPLING_REFERENCE)
+        response["timeStamp"] = timeStamps.tolist()
+
+    return response
+
 @router.get("/metrics")
 async def calculateMetrics(data: dict):
-    return data_analyze_main(data["timeStamp"], data["distance"], data["velocity"])
+    return await cpu_executor.run(data_analyze_main, data["timeStamp"], data["distance"], data["velocity"])
+
+# Reprocesses many tests at once, e.g. after changing the wheel diameter or gains
+# JSON payload expected:
+# {
+#   "test_ids": [integers],              test_info ids of stored tests
+#   "tests": [{"id", "timeStamps", "gyroLeft", "gyroRight"}],
+#   "settings": {"leftGain", "rightGain", "diameter", "wheel_distance",
+#                "smooth", "resample", "include_series"}
+# }
+# Each test is smoothed, run through the kinematics and the bout/stroke metrics
+# in a pool of worker processes. Stored tests were already smoothed and gained
+# by the recorder, so they are not smoothed again (see reprocess_test_files). Results are streamed back as NDJSON, one line
+# per test in the order they finish, with "error" set for tests that failed.
+# At most BATCH_MAX_IN_FLIGHT tests are loaded at a time, the next one starts
+# when one finishes, so a large batch does not hold every test in memory.
+@router.post("/batch")
+async def calculate_batch(data: dict):
+    settings = data.get("settings", {})
+    jobs = itertools.chain(
+        (reprocess_stored_test(test_id, settings) for test_id in data.get("test_ids", [])),
+        (reprocess_payload(test, settings) for test in data.get("tests", []))
+    )
+    return StreamingResponse(stream_ndjson(jobs), media_type="application/x-ndjson")
+
+# Runs the coroutines of an iterable, at most max_in_flight at once, and yields
+# their results as NDJSON lines in the order they finish. Coroutines are only
+# created when a slot frees up.
+async def stream_ndjson(jobs, max_in_flight=BATCH_MAX_IN_FLIGHT):
+    jobs = iter(jobs)
+    running = {asyncio.ensure_future(job) for job in itertools.islice(jobs, max_in_flight)}
+    try:
+        while running:
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result()) + "\n"
+                job = next(jobs, None)
+                if job is not None:
+                    running.add(asyncio.ensure_future(job))
+    finally:
+        # The client went away, stop the jobs still running
+        for task in running:
+            task.cancel()
+
+async def reprocess_payload(payload, settings):
+    try:
+        return await batch_executor.run(reprocess_test, payload, settings)
+    except Exception as e:
+        return {"id": payload.get("id") if isinstance(payload, dict) else None, "error": str(e)}
+
+async def reprocess_stored_test(test_id, settings):
+    try:
+        test_files = await db_executor.run(fetch_test_arrays, test_id)
+        return await batch_executor.run(reprocess_test_files, test_id, test_files, settings)
+    except Exception as e:
+        return {"id": test_id, "error": str(e)}
+
+# Loads only the raw arrays of a stored test, time stamps in ms as stored
+def fetch_test_arrays(test_id):
+    response = (
+        supabase.table("test_info")
+        .select("id, test_files(timeStamp, gyroLeft, gyroRight)")
+        .eq("id", test_id)
+        .execute()
+    )
+    if not response.data:
+        raise ValueError(f"Test {test_id} not found")
+    return decode_test_files(response.data[0]["test_files"])
 
+# With resample=true the data is smoothed on a uniform time grid, and the
+# response also holds the uniform "timeStamps" the smoothed data belongs to.
 @router.post("/smooth")
-async def smooth_packet(data: dict):
+async def smooth_packet(data: dict, resample: bool = False):
     print(f"Received data keys: {list(data.keys())}")
     print(f"Data types: {[(k, type(v).__name__, len(v) if isinstance(v, list) else 'N/A') for k, v in data.items()]}")
-    response = smooth_data(data)
+    try:
+        response = await cpu_executor.run(smooth_data, data, resample=resample)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     return {
         "gyro_right_smoothed": response["gyro_right_smoothed"],
-        "gyro_left_smoothed": response["gyro_left_smoothed"]
+        "gyro_left_smoothed": response["gyro_left_smoothed"],
+        "sample_rate": response["sample_rate"],
+        **({"timeStamps": response["timeStamps"]} if resample else {})
     }
 
+# Live recording sessions
+# Instead of re-sending the whole recording on every call, the client opens a
+# session with its calibration, then posts only the new packets. The server
+# keeps the buffered samples and the running kinematics for each session.
+
+# Optional JSON payload:
+# {
+#   "leftGain": float,
+#   "rightGain": float,
+#   "diameter": float,
+#   "wheel_distance": float,
+#   "smooth": bool,
+#   "sample_rate": float,
+#   "cutoff_hz": float
+# }
+@router.post("/session")
+async def open_session(settings: dict = None):
+    try:
+        session = sessions.open(**session_settings(settings or {}))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {**session.settings(), "idle_timeout": sessions.idle_timeout}
+
+# JSON payload expected:
+# {
+#   "timeStamps": [floats],
+#   "gyroLeft": [floats],
+#   "gyroRight": [floats]
+# }
+# Returns the derived points for the new samples only.
+@router.post("/session/{session_id}")
+async def append_to_session(session_id: str, data: dict):
+    session = get_session_or_404(session_id)
+    error = packet_error(data)
+    if error is not None:
+        raise HTTPException(status_code=422, detail=f"Invalid packet: {error}")
+    return session.append(data["timeStamps"], data["gyroLeft"], data["gyroRight"])
+
+# Returns the session settings and every raw sample buffered so far
+@router.get("/session/{session_id}")
+async def get_session(session_id: str):
+    session = get_session_or_404(session_id)
+    samples = session.samples()
+    return {
+        **session.settings(),
+        "timeStamps": samples["timeStamps"].tolist(),
+        "gyroLeft": samples["gyroLeft"].tolist(),
+        "gyroRight": samples["gyroRight"].tolist()
+    }
+
+@router.delete("/session/{session_id}")
+async def close_session(session_id: str):
+    session = sessions.close(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session.settings()
+
+# Picks the calibration settings a session can be opened with out of a request
+def session_settings(data):
+    settings = {key: float(data[key]) for key in ["leftGain", "rightGain", "diameter", "wheel_distance", "sample_rate", "cutoff_hz"] if key in data}
+    if "smooth" in data:
+        settings["smooth"] = str(data["smooth"]).lower() in ("1", "true")
+    return settings
+
+def get_session_or_404(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session
+
+
+# Live data over a WebSocket
+# The recorder keeps one connection open for the whole test and streams raw
+# packets instead of making an HTTP request for every one. Calibration settings
+# are passed as query parameters, e.g. /calculate/ws?leftGain=1.13&rightGain=1.12
+#
+# Messages from the client are packets, or batches of packets:
+#   {"timeStamps": [floats], "gyroLeft": [floats], "gyroRight": [floats]}
+#   {"packets": [packet, ...]}
+# The server first sends {"type": "session", ...settings} and then, for every
+# batch it processes, {"type": "samples", "packets": int, "rejected": int, ...derived series}.
+# Invalid packets are skipped and counted in "rejected" (with a "detail"); a
+# batch with no valid packet is answered with {"type": "error", ...} instead.
+#
+# Packets are read into a bounded queue. When processing falls behind the queue
+# fills up and the server stops reading, which pushes back on the client through
+# the socket. Whatever has queued up meanwhile is processed and answered as one batch.
+WS_QUEUE_SIZE = 64
+WS_MAX_BATCH = 32
+
+@router.websocket("/ws")
+async def live_data(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        settings = session_settings(dict(websocket.query_params))
+        settings.setdefault("smooth", True)
+        session = sessions.open(**settings)
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1003)
+        return
+    await websocket.send_json({"type": "session", **session.settings()})
+
+    queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+    reader = asyncio.create_task(read_packets(websocket, queue))
+    try:
+        while True:
+            packets = [await queue.get()]
+            while len(packets) < WS_MAX_BATCH and not queue.empty():
+                packets.append(queue.get_nowait())
+
+            closed = None in packets
+            packets = [packet for packet in packets if packet is not None]
+            if packets:
+                await websocket.send_json(process_packets(session, packets))
+            if closed:
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+        sessions.close(session.id)
+    # The stream ended on a message that was not a packet, the client is still connected
+    if websocket.client_state == WebSocketState.CONNECTED:
+        await websocket.close(code=1003)
+
+# Reads packets from the socket into the queue; None marks the end of the stream
+async def read_packets(websocket, queue):
+    try:
+        while True:
+            message = await websocket.receive_json()
+            for packet in message.get("packets", [message]):
+                await queue.put(packet)
+    except (WebSocketDisconnect, ValueError, AttributeError, TypeError):
+        # Client went away or sent something that is not a packet
+        await queue.put(None)
+
+# Appends the valid packets of a batch to the session as a single chunk.
+# Invalid packets are left out and counted in "rejected"; every reply says how
+# many packets were appended ("packets") and how many were rejected.
+def process_packets(session, packets):
+    errors = [packet_error(packet) for packet in packets]
+    valid = [packet for packet, error in zip(packets, errors) if error is None]
+    rejected = {"rejected": len(packets) - len(valid)}
+    if rejected["rejected"]:
+        rejected["detail"] = "Invalid packet: " + "; ".join(error for error in errors if error is not None)
+    if not valid:
+        return {"type": "error", "packets": 0, **rejected}
 
+    try:
+        response = session.append(
+            [value for p in valid for value in p["timeStamps"]],
+            [value for p in valid for value in p["gyroLeft"]],
+            [value for p in valid for value in p["gyroRight"]]
+        )
+    except (KeyError, ValueError, TypeError) as e:
+        return {"type": "error", "packets": 0, "rejected": len(packets), "detail": f"Invalid packet: {e}"}
+    return {"type": "samples", "packets": len(valid), **rejected, **response}
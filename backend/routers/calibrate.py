@@ -1,15 +1,22 @@
-from fastapi import APIRouter
-from scipy.optimize import fsolve
+from fastapi import APIRouter, HTTPException
+from scipy.optimize import fsolve, least_squares
+from functools import partial
+from postgrest import APIError
+import asyncio
+import hashlib
+import json
+import time
 import numpy as np
 from calc import (
-    get_top_traj,
-    get_velocity_m_s,
-    get_heading_deg,
-    get_displacement_m,
+    compute_kinematics,
     smooth_data
 )
+from params import IN_TO_M, FILTER_CUTOFF_HZ
 from scipy.spatial import cKDTree
-from constants import supabase
+from cache import LRUCache
+from calibrations import calibrations
+from constants import supabase, CALIBRATION_CACHE_SIZE
+from executors import cpu_executor, db_executor, solver_executor
 
 router = APIRouter(
     prefix="/calibrate",
@@ -17,6 +24,29 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
+# Left gain, right gain and wheel distance the solve starts from
+INITIAL_GUESS = [20, 20, 20]
+
+# Starting points for the multi-start solve, and the bounds it keeps to:
+# positive gains and at least an inch between the wheels.
+# The turn ties the wheel distance to the gains, so the starts are spread
+# along gain == wheel distance over a wide log range.
+MULTISTART_STARTS = [[scale, scale, scale] for scale in (2, 4, 8, 16, 32, 64)]
+SOLVER_BOUNDS = ([1e-3, 1e-3, 1], [np.inf, np.inf, np.inf])
+# Starts far from the answer crawl along the turnaround loss, so each start gets a
+# capped budget and only the best one is polished to convergence
+SOLVER_MAX_NFEV = 100
+
+# Bump when a change to the solve should stop old fingerprints from matching
+CALIBRATION_VERSION = 1
+
+# Saved calibration rows by fingerprint, in front of the fingerprint column of the calibrations table
+calibration_cache = LRUCache(CALIBRATION_CACHE_SIZE)
+# Solves in progress by fingerprint, so a resubmission waits for the first one
+pending_calibrations = {}
+# Postgres error code of an insert that breaks a unique index, here the fingerprint's
+UNIQUE_VIOLATION = "23505"
+
 # JSON payload expected:
 # {
 #	"smarthubId": string,
@@ -25,28 +55,115 @@ router = APIRouter(
 #   "gyroLeft": [integers],
 #   "timeStamps": [integers]
 # }
+# mode=multistart solves from a grid of starting points in parallel with bounded
+# least squares; the default fsolve mode solves once from INITIAL_GUESS.
+# Each saved row is returned with the solver's diagnostics attached.
+#
+# Resubmitting the same recording with the same settings returns the row that
+# was already saved for it instead of solving and inserting it again.
 @router.post("/")
-async def perform_calibration(data: dict):
+async def perform_calibration(data: dict, mode: str = "fsolve"):
+    if mode not in ("fsolve", "multistart"):
+        raise HTTPException(status_code=422, detail=f"Unknown calibration mode: {mode}")
+    fingerprint = calibration_fingerprint(data, mode)
+
+    rows = calibration_cache.get(fingerprint)
+    if rows:
+        return rows
+
+    # Identical submissions that arrive while the first is looking up or solving
+    # share its result. It is registered before the lookup so only one of them
+    # can miss and solve.
+    if fingerprint in pending_calibrations:
+        return await asyncio.shield(pending_calibrations[fingerprint])
+
+    pending = asyncio.get_running_loop().create_future()
+    pending_calibrations[fingerprint] = pending
+    try:
+        rows = await db_executor.run(find_calibration, fingerprint)
+        if not rows:
+            rows = await solve_and_save(data, mode, fingerprint)
+        calibration_cache.put(fingerprint, rows)
+        pending.set_result(rows)
+        return rows
+    except Exception as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        # Cancelled, e.g. the client disconnected: waiters must not wait forever
+        if not pending.done():
+            pending.set_exception(HTTPException(status_code=503, detail="The identical calibration in progress was cancelled, try again"))
+        # Waiters get any exception, nobody else needs to retrieve it
+        pending.exception()
+        pending_calibrations.pop(fingerprint, None)
+
+
+async def solve_and_save(data, mode, fingerprint):
     smarthubId = data["smarthubId"]
     calibrationName = data["calibrationName"]
-    calibration = Calibration(data)
-
-    calibration.perform_calibration()
-    response = await save_calibration(smarthubId, calibration.data, calibration.wheel_dist, calibration.leftGain, calibration.rightGain, calibrationName)
-
-    return response.data
-
-
-# Get all calibrations in the db
-@router.get("/all")
-async def get_all_calibrations():
+    # The solve takes a while, run it off the event loop
+    try:
+        calibration = await cpu_executor.run(run_calibration, data, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    try:
+        response = await save_calibration(smarthubId, calibration.data, calibration.wheel_dist, calibration.leftGain, calibration.rightGain, calibrationName, fingerprint)
+    except APIError as e:
+        if e.code != UNIQUE_VIOLATION:
+            raise
+        # Another server process saved the same calibration first, use its row
+        return await db_executor.run(find_calibration, fingerprint)
+
+    return [{**row, "diagnostics": calibration.diagnostics} for row in response.data]
+
+
+# SHA-256 of the raw recording and everything that changes the solve's answer.
+# The calibration name is left out, renaming a resubmission does not make it new.
+def calibration_fingerprint(data, mode="fsolve"):
+    settings = {
+        "version": CALIBRATION_VERSION,
+        "smarthubId": str(data["smarthubId"]),
+        "mode": mode,
+        "cutoff_hz": FILTER_CUTOFF_HZ,
+        "starts": MULTISTART_STARTS if mode == "multistart" else INITIAL_GUESS,
+        "max_nfev": SOLVER_MAX_NFEV if mode == "multistart" else None
+    }
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for key in ('timeStamps', 'gyroLeft', 'gyroRight'):
+        values = np.ascontiguousarray(data[key], dtype=np.float64)
+        # The length goes in too so the arrays cannot run into each other
+        digest.update(key.encode() + len(values).to_bytes(8, "little"))
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+# Calibration rows already saved under a fingerprint
+def find_calibration(fingerprint):
     response = (
         supabase.table("calibrations")
         .select("*")
+        .eq("fingerprint", fingerprint)
         .execute()
     )
     return response.data
 
+
+# Get all calibrations in the db, or only those of one smarthub.
+# Served from the calibration registry, so rows come without their raw_data.
+@router.get("/all")
+async def get_all_calibrations(smarthub_id: str = None):
+    await db_executor.run(calibrations.refresh_if_stale)
+    if smarthub_id is not None:
+        return calibrations.for_hub(smarthub_id)
+    return calibrations.all()
+
+# Builds and solves a calibration, at module level so it can run in a worker process
+def run_calibration(data, mode="fsolve"):
+    calibration = Calibration(data)
+    calibration.perform_calibration(mode)
+    return calibration
+
 # Class that stores all methods needed for calibration
 class Calibration:
     def __init__(self, data):
@@ -58,72 +175,175 @@ class Calibration:
             'gyroLeftSmoothed': [],
         }
 
-    def perform_calibration(self):
+    def perform_calibration(self, mode="fsolve"):
+        if mode not in ("fsolve", "multistart"):
+            raise ValueError(f"Unknown calibration mode: {mode}")
+        started = time.perf_counter()
+
         response = smooth_data(self.data)
         self.data["gyroRightSmoothed"] = response["gyro_right_smoothed"]
         self.data["gyroLeftSmoothed"] = response["gyro_left_smoothed"]
 
-        self.leftGain, self.rightGain, self.wheel_dist = fsolve(minimize_turnaround, [20,20,20], args=self.data)
-
-def minimize_turnaround(params, test):
-    ml, mr, W = params
-    timeStamps = np.array(test['timeStamps'])
-    
-    min_len = min(len(timeStamps), len(test['gyroLeftSmoothed']), len(test['gyroRightSmoothed']))
-
-    timeStamps = timeStamps[:min_len]
-    gyroLeft = np.array(test['gyroLeftSmoothed'])[:min_len]
-    gyroRight = np.array(test['gyroRightSmoothed'])[:min_len]
-
-    disp_m = np.array(get_displacement_m(timeStamps, gyroLeft*ml, gyroRight*mr, dist_wheels=W, diameter=1))
-    heading = np.array(get_heading_deg(timeStamps, gyroLeft*ml, gyroRight*mr, dist_wheels=W, diameter=1))
-    velocity = np.array(get_velocity_m_s(timeStamps, gyroLeft*ml, gyroRight*mr, dist_wheels=W, diameter=1))
-    traj = np.array(get_top_traj(disp_m, velocity, heading, timeStamps, dist_wheels=W, diameter=1))
-
-    # finds the start and end of the turnaround, make it constant between runs
-    if not hasattr(minimize_turnaround, "start_turn"):
-        heading_diff = [0]
-        for i in range(1, len(heading)):
-            heading_diff.append(heading[i] - heading[i-1])
-
-        turning_points = np.where(np.abs(np.array(heading_diff)) > 0.1)
-        if turning_points:
-            minimize_turnaround.start_turn, minimize_turnaround.end_turn = (largest_consecutive_group(turning_points[0])[0], largest_consecutive_group(turning_points[0])[-1])
-
-    start_turn = minimize_turnaround.start_turn
-    end_turn = minimize_turnaround.end_turn
-
-    net_distance_error = (10 - disp_m[-1])
-
-    first_half = traj[:start_turn]
-    second_half = traj[end_turn:]
+        # The turnaround is found once for this calibration and shared by every evaluation of the solve
+        self.turn = detect_turn(self.data, INITIAL_GUESS)
+        self.problem = CalibrationProblem(self.data, self.turn)
+
+        if mode == "multistart":
+            # Each start is solved in its own worker, the lowest cost wins
+            solutions = solver_executor.map(partial(solve_from_start, self.problem), MULTISTART_STARTS)
+            best = min(solutions, key=lambda solution: solution["cost"])
+            polished = solve_from_start(self.problem, best["params"], max_nfev=None)
+            self.leftGain, self.rightGain, self.wheel_dist = polished["params"]
+            evaluations = sum(solution["evaluations"] for solution in solutions) + polished["evaluations"]
+        else:
+            solutions = []
+            self.leftGain, self.rightGain, self.wheel_dist = fsolve(self.problem.residuals, INITIAL_GUESS)
+            evaluations = self.problem.evaluations
+
+        self.diagnostics = {
+            "mode": mode,
+            "residual": float(np.linalg.norm(self.problem.residuals([self.leftGain, self.rightGain, self.wheel_dist]))),
+            "evaluations": evaluations,
+            "wall_time": time.perf_counter() - started,
+            "turn": [int(self.turn[0]), int(self.turn[1])],
+            "starts": solutions
+        }
 
-    straight_line_start = np.linspace(np.array([0,0]), np.array(first_half[-1]), 3000)
-    straight_line_end = np.linspace(np.array(second_half[0]), np.array([0,0]), 3000)
 
-    turn_loss = (compute_net_loss(first_half, straight_line_start) + compute_net_loss(second_half, straight_line_end)) / 2
+# Solves the calibration from one starting point with bounded least squares
+def solve_from_start(problem, start, max_nfev=SOLVER_MAX_NFEV):
+    evaluations = problem.evaluations
+    result = least_squares(problem.residuals, start, jac=problem.jacobian, bounds=SOLVER_BOUNDS,
+                           x_scale='jac', max_nfev=max_nfev)
+    return {
+        "start": list(start),
+        "params": result.x.tolist(),
+        "cost": float(result.cost),
+        "residual": float(np.linalg.norm(result.fun)),
+        # Residual evaluations, counting the batched ones made for the Jacobian
+        "evaluations": problem.evaluations - evaluations,
+        "jacobian_evaluations": int(result.njev),
+        "success": bool(result.success)
+    }
+
+
+# Finds the start and end sample of the turnaround in a calibration run: the
+# longest stretch where the heading changes by more than threshold_deg per
+# sample, with the heading computed at the given (left gain, right gain, wheel distance).
+def detect_turn(test, params=INITIAL_GUESS, threshold_deg=0.1):
+    ml, mr, W = params
+    timeStamps, gyroLeft, gyroRight = calibration_arrays(test)
+
+    heading = compute_kinematics(timeStamps, gyroLeft*ml, gyroRight*mr, dist_wheels=W, diameter=1).heading
+    heading_diff = np.diff(heading, prepend=heading[:1])
+    turn = largest_consecutive_group(np.flatnonzero(np.abs(heading_diff) > threshold_deg))
+    if len(turn) == 0:
+        raise ValueError("No turnaround found in the calibration data")
+    return turn[0], turn[-1]
+
+
+# Smoothed calibration data as arrays trimmed to a common length
+def calibration_arrays(test):
+    timeStamps = np.asarray(test['timeStamps'], dtype=float)
+    gyroLeft = np.asarray(test['gyroLeftSmoothed'], dtype=float)
+    gyroRight = np.asarray(test['gyroRightSmoothed'], dtype=float)
+
+    min_len = min(len(timeStamps), len(gyroLeft), len(gyroRight))
+    return timeStamps[:min_len], gyroLeft[:min_len], gyroRight[:min_len]
+
+
+# The residuals the solver drives to zero for an out-and-back calibration run.
+# The smoothed data is converted to arrays once, and each evaluation is a single
+# vectorized kinematics pass plus one KD-tree, instead of rebuilding everything
+# on every call. All state belongs to the instance, so separate calibrations
+# can be solved at the same time.
+#
+# The kinematics are linear in the gains (heading and velocity are weighted
+# sums of the two wheels), so the per-wheel sums are precomputed once and
+# several parameter sets can be evaluated together as rows of 2-D arrays.
+class CalibrationProblem:
+    def __init__(self, test, turn=None):
+        timeStamps, gyroLeft, gyroRight = calibration_arrays(test)
+        self.timeStamps, self.gyroLeft, self.gyroRight = timeStamps, gyroLeft, gyroRight
+        # Start and end sample of the turnaround
+        self.start_turn, self.end_turn = turn if turn is not None else detect_turn(test)
+        self.evaluations = 0
+
+        # Same integration as compute_kinematics, with diameter=1 and the gains factored out
+        self.dt = np.diff(timeStamps)
+        self.wheel_radius_m = IN_TO_M / 2
+        left, right = gyroLeft[:-1], gyroRight[:-1]
+        self.distance_left = np.sum(np.abs(left) * self.dt)
+        self.distance_right = np.sum(np.abs(right) * self.dt)
+        self.rotation_left = np.concatenate(([0.0], np.cumsum(left * self.dt)))
+        self.rotation_right = np.concatenate(([0.0], np.cumsum(right * self.dt)))
+        self.velocity_left = np.concatenate(([0.0], left))
+        self.velocity_right = np.concatenate(([0.0], right))
+
+    def residuals(self, params):
+        return self.residuals_batch(np.atleast_2d(params))[0]
+
+    # Residuals for each row of params, an array of (left gain, right gain, wheel distance)
+    def residuals_batch(self, params):
+        params = np.asarray(params, dtype=float)
+        ml, mr, W = params[:, 0, None], params[:, 1, None], params[:, 2, None]
+        self.evaluations += len(params)
+
+        disp_m = (np.abs(ml[:, 0]) * self.distance_left + np.abs(mr[:, 0]) * self.distance_right) / 2 * self.wheel_radius_m
+        heading_rad = (mr * self.rotation_right - ml * self.rotation_left) * self.wheel_radius_m / (W * IN_TO_M)
+        velocity = (mr * self.velocity_right + ml * self.velocity_left) / 2 * self.wheel_radius_m
+
+        # Trajectory, one (n - 1, 2) array of [x, y] positions per row
+        step = velocity[:, :-1] * self.dt
+        traj = np.stack((np.cumsum(step * np.cos(heading_rad[:, :-1]), axis=1),
+                         np.cumsum(step * np.sin(heading_rad[:, :-1]), axis=1)), axis=-1)
+
+        residuals = np.empty((len(params), 3))
+        for i in range(len(params)):
+            net_distance_error = (10 - disp_m[i])
+
+            first_half = traj[i, :self.start_turn]
+            second_half = traj[i, self.end_turn:]
+
+            # How far each half strays from a straight line between the start and the turnaround
+            origin = np.zeros(2)
+            turn_loss = (compute_segment_loss(first_half, origin, first_half[-1]) + compute_segment_loss(second_half, second_half[0], origin)) / 2
+
+            # Compute the net loss between the two halves
+            net_loss = compute_net_loss(first_half, second_half)
+
+            residuals[i] = net_loss, net_distance_error, turn_loss
+        return residuals
+
+    # Forward-difference Jacobian, with the base point and the three steps evaluated as one batch
+    def jacobian(self, params):
+        params = np.asarray(params, dtype=float)
+        steps = np.sqrt(np.finfo(float).eps) * np.maximum(1, np.abs(params))
+        batch = self.residuals_batch(np.vstack((params, params + np.diag(steps))))
+        return ((batch[1:] - batch[0]) / steps[:, None]).T
 
-    # Compute the net loss between the two halves
-    net_loss = compute_net_loss(first_half, second_half)
 
-    return net_loss, net_distance_error, turn_loss
+def minimize_turnaround(params, test):
+    problem = test if isinstance(test, CalibrationProblem) else CalibrationProblem(test)
+    return problem.residuals(params)
 
 
+# Keeps the runs of consecutive values in nums that are longer than min_size and
+# reach above threshold, and returns them joined together in order.
 def largest_consecutive_group(nums, min_size=60, threshold=0.5):
-    groups, current = [], [nums[0]]
-
-    for i in range(1, len(nums)):
-        if nums[i] == nums[i - 1] + 1:
-            current.append(nums[i])
-        else:
-            if len(current) > min_size and any(x > threshold for x in current):
-                groups.extend(current)
-            current = [nums[i]]
+    nums = np.asarray(nums)
+    if len(nums) == 0:
+        return nums
 
-    if len(current) > min_size and any(x > threshold for x in current):
-        groups.extend(current)
+    # Split into runs wherever the next value is not one more than the last
+    breaks = np.flatnonzero(np.diff(nums) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(nums)]))
+    lengths = ends - starts
 
-    return groups
+    # Runs are increasing, so their last value is their largest
+    keep = (lengths > min_size) & (nums[ends - 1] > threshold)
+    return nums[np.repeat(keep, lengths)]
 
 
 def compute_net_loss(points1, points2):
@@ -140,7 +360,8 @@ def compute_net_loss(points1, points2):
     points2 = np.array(points2)
 
     # Build KDTree for efficient nearest-neighbor search
-    tree = cKDTree(points2)
+    # Unbalanced trees build faster, and the tree is only queried once
+    tree = cKDTree(points2, balanced_tree=False, compact_nodes=False)
 
     # Find nearest neighbor distances for all points in points1
     distances, _ = tree.query(points1)
@@ -150,10 +371,26 @@ def compute_net_loss(points1, points2):
     return rms_distance
 
 
+# RMS distance from each point to the straight segment between start and end.
+# Exact point-to-segment distances, where densely sampling the segment and
+# looking up the nearest sample only approximated them.
+def compute_segment_loss(points, start, end):
+    points = np.asarray(points, dtype=float)
+    segment = np.asarray(end, dtype=float) - start
+    offsets = points - start
+
+    length_sq = segment @ segment
+    # Position of each point's projection along the segment, clamped to its ends
+    t = np.clip(offsets @ segment / length_sq, 0, 1) if length_sq > 0 else np.zeros(len(points))
+    distances_sq = np.sum((offsets - t[:, None] * segment) ** 2, axis=1)
+
+    return np.sqrt(np.mean(distances_sq))
+
+
 # Writes to the database the calculated calibration
-async def save_calibration(smarthubId, data, wheel_dist, leftGain, rightGain, calibrationName):
+async def save_calibration(smarthubId, data, wheel_dist, leftGain, rightGain, calibrationName, fingerprint=None):
     # save dictionary to json
-    response = (
+    response = await db_executor.run(
         supabase.table("calibrations")
         .insert({
             'smarthub_id': smarthubId,
@@ -161,8 +398,11 @@ async def save_calibration(smarthubId, data, wheel_dist, leftGain, rightGain, ca
             'wheel_distance': wheel_dist,
             'left_gain': leftGain,
             'right_gain': rightGain,
-            'raw_data': data
+            'raw_data': data,
+            'fingerprint': fingerprint
         })
-        .execute()
+        .execute
     )
+    for row in response.data:
+        calibrations.add(row)
     return response
@@ -1,5 +1,21 @@
-from fastapi import APIRouter
-from constants import supabase
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import asyncio
+import base64
+import hashlib
+import json
+import numpy as np
+from auth_tokens import request_user_id
+from cache import LRUCache
+from codec import decode_test_files, encode_test_files
+from calibrations import get_calibration_or_404
+from constants import (supabase, TEST_COUNT_TTL_S, STORAGE_CODEC, STORAGE_MODE, DERIVED_CACHE_SIZE,
+                       TEST_CACHE_MAX_BYTES, TEST_CACHE_TTL_S)
+from reprocess import DERIVATION_VERSION, derive_series, flatten_series
+from downsampling import METHODS as DOWNSAMPLING_METHODS, DEFAULT_MAX_POINTS, downsample_columns
+from executors import cpu_executor, db_executor
+from lod import LOD_FACTOR, build_pyramid, choose_level, window
 
 router = APIRouter(
     prefix="/db",
@@ -7,82 +23,193 @@ router = APIRouter(
     responses={404: {"description": "Not found"}}
 )
 
+# Total number of tests, shared by every page of the listing
+test_count_cache = LRUCache(maxsize=1, ttl=TEST_COUNT_TTL_S)
+# Pyramid chunk metadata by test id, pyramids do not change once stored
+lod_index_cache = LRUCache(maxsize=256)
+# Series derived on read, by (test id, calibration id, DERIVATION_VERSION)
+derived_series_cache = LRUCache(maxsize=DERIVED_CACHE_SIZE)
+# Rendered /tests/{id} responses by test id and query parameters, see get_test
+test_response_cache = LRUCache(maxsize=1024, ttl=TEST_CACHE_TTL_S, max_bytes=TEST_CACHE_MAX_BYTES)
+
+# Columns of test_files recorded by the sensors, and those derived from them
+RAW_COLUMNS = ("timeStamp", "gyroLeft", "gyroRight", "accelRight", "accelLeft")
+DERIVED_COLUMNS = ("distance", "displacement", "velocity", "heading", "trajectory_x", "trajectory_y")
+
 # Adds a test to the database
-# Add idempotent ability so duplicate writes don't occur
+# Saving is idempotent: the test is stored under an Idempotency-Key header (or
+# "idempotency_key" field), or a hash of its content when the client sends none.
+# A retry with the same key returns the test saved the first time.
+#
+# Both rows and the level-of-detail pyramid for /tests/{id}/window are written
+# by one call to the write_test database function (sql/write_test.sql), in one
+# transaction, and the user comes from the request's token (see auth_tokens.py),
+# so a save is a single round trip.
+#
+# An optional "calibration_id" records the calibration the test belongs to.
+# With STORAGE_MODE=raw only RAW_COLUMNS are stored and get_test derives the
+# rest with that calibration when the test is read.
 @router.post("/write_test")
-async def write_test(data: dict):
-    user = supabase.auth.get_user()
-    user_id = user.user.id
-    test_files_response = (
-        supabase.table("test_files")
-        .insert({
-            "distance": data["testData"]["distance"],
-            "timeStamp": data["testData"]["timeStamp"],
-            "displacement": data["testData"]["displacement"],
-            "velocity": data["testData"]["velocity"],
-            "heading": data["testData"]["heading"],
-            "trajectory_x": data["testData"]["trajectory_x"],
-            "trajectory_y": data["testData"]["trajectory_y"],
-            "gyroLeft": data["testData"]["gyroLeft"],
-            "gyroRight": data["testData"]["gyroRight"],
-            "accelRight": data["testData"]["accelRight"],
-            "accelLeft": data["testData"]["accelLeft"],
-        })
-        .execute()
-    )
-    test_file_id = test_files_response.data[0]["id"]
-    test_info_response = (
-        supabase.table("test_info")
-        .insert({
-            "test_file_id": test_file_id,
-            "comments": data["comments"],
-            "test_name": data["testName"],
-            "recorded_by_user_id": user_id,
+async def write_test(data: dict, authorization: str = Header(None), idempotency_key: str = Header(None)):
+    calibration_id = data.get("calibration_id")
+    if calibration_id is not None:
+        await get_calibration_or_404(calibration_id)
+    user_id = await request_user_id(authorization)
+
+    columns = RAW_COLUMNS if STORAGE_MODE == "raw" else DERIVED_COLUMNS + RAW_COLUMNS
+    test_files = {name: data["testData"][name] for name in columns}
+    test_info = {
+        "comments": data["comments"],
+        "test_name": data["testName"],
+        "recorded_by_user_id": user_id,
+        **test_summary(data["testData"]),
+        **({"calibration_id": calibration_id} if calibration_id is not None else {}),
+    }
+    try:
+        encoded, lod_rows, fingerprint = await cpu_executor.run(prepare_test, test_files, test_info)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid test data: {e}")
+    key = idempotency_key or data.get("idempotency_key") or fingerprint
+
+    response = await db_executor.run(
+        supabase.rpc("write_test", {
+            "p_test_files": encoded,
+            "p_test_info": test_info,
+            "p_lod": lod_rows,
+            "p_idempotency_key": key
         })
-        .execute()
+        .execute
     )
-    return {"test_file_id": test_file_id, "test_info": test_info_response.data[0]}
+    saved = response.data
+    if saved["created"]:
+        test_count_cache.clear()
+
+    return {"test_file_id": saved["test_file_id"], "test_info": saved["test_info"], "created": saved["created"]}
+
+# Arrays compressed for storage (see codec.py), the pyramid rows and the content
+# fingerprint of a test, ready for the write_test database function
+def prepare_test(test_files, test_info):
+    encoded = encode_test_files(test_files, STORAGE_CODEC)
+    return encoded, pyramid_rows(test_files), test_fingerprint(encoded, test_info)
 
-# Fetches all tests with pagination
+# Idempotency key for saves without one: SHA-256 of the stored arrays and test info
+def test_fingerprint(encoded_test_files, test_info):
+    content = json.dumps({"test_files": encoded_test_files, "test_info": test_info}, sort_keys=True, default=str)
+    return "sha256:" + hashlib.sha256(content.encode()).hexdigest()
+
+# Summary fields stored on test_info so test listings never need the arrays.
+# timeStamp is in milliseconds, duration is in seconds.
+# Series may be stored as one list per BLE packet.
+def test_summary(testData):
+    time_stamps = flatten_series(testData.get("timeStamp") or [])
+    distance = testData.get("distance")
+    if isinstance(distance, (list, tuple)):
+        distance = flatten_series(distance)
+        distance = float(distance[-1]) if len(distance) else None
+    return {
+        "sample_count": len(time_stamps),
+        "duration": round(float(time_stamps[-1] - time_stamps[0]) / 1000, 2) if len(time_stamps) else None,
+        "distance": distance,
+    }
+
+# Columns returned for each test by view
+TEST_VIEWS = {
+    # test_info metadata and the summary fields from test_summary
+    "summary": "*",
+    # Also every stored array, only for callers that really need them
+    "full": "*, test_files(*)",
+}
+
+# Fetches all tests with pagination, newest first.
+# The default summary view leaves out the arrays; get_test returns those.
+#
+# Pages are found by id (keyset pagination): pass the next_cursor or
+# previous_cursor from a response as `cursor` to move one page on or back,
+# which costs the same however deep the page is. page still works for the
+# first page and for old callers but gets slower the further in it goes.
+# total_count is cached for TEST_COUNT_TTL_S seconds and may lag behind by that much.
 @router.get("/tests")
-async def get_tests(page: int = 1, limit: int = 25):
-    # Calculate offset for pagination
-    offset = (page - 1) * limit
-    
-    # Get total count for pagination info
-    count_response = (
-        supabase.table("test_info")
-        .select("id", count="exact")
-        .execute()
-    )
-    total_count = count_response.count
-    
-    # Get paginated tests
-    response = (
-        supabase.table("test_info")
-        .select("*, test_files(*)")
-        .order("id", desc=True)  # Order by newest first
-        .range(offset, offset + limit - 1)
-        .execute()
+async def get_tests(page: int = 1, limit: int = 25, view: str = "summary", cursor: str = None):
+    if view not in TEST_VIEWS:
+        raise HTTPException(status_code=422, detail=f"Unknown view: {view}")
+    if limit < 1:
+        raise HTTPException(status_code=422, detail="limit must be at least 1")
+    if page < 1:
+        raise HTTPException(status_code=422, detail="page must be at least 1")
+    after_id, direction = decode_cursor(cursor) if cursor else (None, "next")
+
+    # The count and the page are fetched at the same time
+    total_count, rows = await asyncio.gather(
+        get_test_count(),
+        db_executor.run(fetch_test_page, TEST_VIEWS[view], limit, after_id, direction, page)
     )
-    
-    # Calculate pagination metadata
+
+    # One row more than the page is fetched to tell whether there is another page
+    has_more = len(rows) > limit
+    if direction == "previous":
+        # Fetched upwards from the cursor, flip back to newest first
+        rows = rows[:limit][::-1]
+    else:
+        rows = rows[:limit]
+
+    if direction == "previous":
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, cursor is not None or page > 1
+
+    if view == "full":
+        rows = [{**row, "test_files": decode_test_files(row.get("test_files"))} for row in rows]
+
     total_pages = (total_count + limit - 1) // limit  # Ceiling division
-    has_next = page < total_pages
-    has_previous = page > 1
-    
+
     return {
-        "data": response.data,
+        "data": rows,
         "pagination": {
-            "current_page": page,
+            "current_page": page if cursor is None else None,
             "total_pages": total_pages,
             "total_count": total_count,
             "limit": limit,
             "has_next": has_next,
-            "has_previous": has_previous
+            "has_previous": has_previous,
+            "next_cursor": encode_cursor(rows[-1]["id"], "next") if has_next and rows else None,
+            "previous_cursor": encode_cursor(rows[0]["id"], "previous") if has_previous and rows else None
         }
     }
 
+# Fetches up to limit + 1 tests next to after_id, moving away from it: below it
+# newest first for direction "next", above it oldest first for "previous".
+# Without a cursor it fetches the given page by offset.
+def fetch_test_page(columns, limit, after_id, direction, page=1):
+    query = supabase.table("test_info").select(columns)
+    if after_id is None:
+        offset = (page - 1) * limit
+        return query.order("id", desc=True).range(offset, offset + limit).execute().data
+    if direction == "previous":
+        return query.gt("id", after_id).order("id").limit(limit + 1).execute().data
+    return query.lt("id", after_id).order("id", desc=True).limit(limit + 1).execute().data
+
+# Number of tests, reused for TEST_COUNT_TTL_S seconds
+async def get_test_count():
+    total_count = test_count_cache.get("test_info")
+    if total_count is None:
+        response = await db_executor.run(supabase.table("test_info").select("id", count="exact").limit(1).execute)
+        total_count = response.count
+        test_count_cache.put("test_info", total_count)
+    return total_count
+
+# Cursors are opaque to clients: base64 of the boundary id and the direction
+def encode_cursor(test_id, direction):
+    return base64.urlsafe_b64encode(json.dumps({"id": test_id, "direction": direction}).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if decoded["direction"] not in ("next", "previous"):
+            raise ValueError(decoded["direction"])
+        return int(decoded["id"]), decoded["direction"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid cursor: {cursor}") from e
+
 # Converts the response from supabase into the format:
 #   "displacement" : {"displacement": [], "timeStamp": []},
 #   "velocity" : {"velocity": [], "timeStamp": []},
@@ -128,29 +255,215 @@ def format_for_review(response):
 
     return formatted_response
 
+# Series included in the columnar review format
+REVIEW_SERIES = ("distance", "displacement", "velocity", "heading", "trajectory_x", "trajectory_y")
+
+# Columnar version of format_for_review: one shared time array in seconds and
+# one array per series, instead of a {"time", value} object per sample:
+#   "time": [],
+#   "series": {"distance": [], "displacement": [], "velocity": [], "heading": [],
+#              "trajectory_x": [], "trajectory_y": []}
+# Series are cut or padded with null to the length of time, as in format_for_review.
+# The raw test_files arrays are left out.
+def format_for_review_columnar(response):
+    test_data = response.data[0]
+    test_files = test_data["test_files"]
+    time = np.round(flatten_series(test_files["timeStamp"] or []) / 1000, 2)
+
+    series = {}
+    for name in REVIEW_SERIES:
+        values = flatten_series(test_files.get(name) or [])[:len(time)].tolist()
+        series[name] = values + [None] * (len(time) - len(values))
+
+    return {
+        **{key: value for key, value in test_data.items() if key != "test_files"},
+        "time": time.tolist(),
+        "series": series
+    }
+
+# Downsamples every array of a test_files row to at most max_points samples,
+# picked so the peaks of the review series survive
+def downsample_test_files(test_files, max_points, method="lttb"):
+    arrays = {name: flatten_series(values) for name, values in test_files.items()
+              if isinstance(values, list) and values}
+    time, arrays = downsample_columns(arrays.get("timeStamp", []), arrays, max_points, method, reference=REVIEW_SERIES)
+    return {**test_files, **arrays, "timeStamp": time.tolist()}
+
+# Derived series for a test and calibration, from derived_series_cache or computed
+# from the raw gyro data. Returned as lists ready to put in test_files.
+async def derived_series(test_id, test_files, calibration_id):
+    key = (test_id, calibration_id, DERIVATION_VERSION)
+    derived = derived_series_cache.get(key)
+    if derived is None:
+        calibration = await get_calibration_or_404(calibration_id) if calibration_id is not None else None
+        derived = await cpu_executor.run(derive_series, test_files, calibration)
+        derived_series_cache.put(key, derived)
+    return {name: values.tolist() for name, values in derived.items()}
+
 # Get a single test
+# response_format=review returns the per-sample format_for_review layout,
+# response_format=columnar the smaller format_for_review_columnar one.
+# With max_points the arrays are first downsampled to about that many samples
+# with downsample=lttb (default) or downsample=minmax.
+# Derived series missing from storage are computed with the test's calibration;
+# calibration_id recomputes them with another one.
+#
+# Responses are kept rendered to JSON in test_response_cache, so opening a test
+# again skips the database and the formatting. Tests do not change after
+# write_test except through update_test, which drops their entries.
 @router.get("/tests/{test_id}")
-async def get_test(test_id: int, response_format: str = None):
-    response = (
+async def get_test(test_id: int, response_format: str = None, max_points: int = None, downsample: str = "lttb",
+                   calibration_id: int = None):
+    if downsample not in DOWNSAMPLING_METHODS:
+        raise HTTPException(status_code=422, detail=f"Unknown downsampling method: {downsample}")
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=422, detail="Need max_points >= 3")
+    key = (test_id, response_format, max_points, downsample, calibration_id)
+    body = test_response_cache.get(key)
+    if body is None:
+        result = await load_test(test_id, response_format, max_points, downsample, calibration_id)
+        body = JSONResponse(jsonable_encoder(result)).body
+        # Unknown ids are not cached, the test may still be written. The review
+        # formats are dicts and only exist for tests that were found.
+        if result if isinstance(result, dict) else result.data:
+            test_response_cache.put(key, body)
+    return Response(content=body, media_type="application/json")
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return {"tests": test_response_cache.stats()}
+
+async def load_test(test_id, response_format, max_points, downsample, calibration_id):
+    response = await db_executor.run(
         supabase.table("test_info")
         .select("*, test_files(*)")
         .eq("id", test_id)
-        .execute()
+        .execute
     )
 
+    if response.data and response.data[0].get("test_files"):
+        test_files = await cpu_executor.run(decode_test_files, response.data[0]["test_files"])
+        if calibration_id is not None or any(test_files.get(name) is None for name in DERIVED_COLUMNS):
+            if calibration_id is None:
+                calibration_id = response.data[0].get("calibration_id")
+            test_files.update(await derived_series(test_id, test_files, calibration_id))
+        response.data[0]["test_files"] = test_files
+
+    if max_points is not None and response.data and response.data[0].get("test_files"):
+        response.data[0]["test_files"] = downsample_test_files(response.data[0]["test_files"], max_points, downsample)
+
+    if response_format in ("review", "columnar") and not response.data:
+        raise HTTPException(status_code=404, detail=f"Test {test_id} not found")
+
     if response_format == "review":
         formatted_response = format_for_review(response)
         return formatted_response
 
+    if response_format == "columnar":
+        return format_for_review_columnar(response)
+
     return response
 
+# Serves the samples of a test between t0 and t1 seconds, at most max_points of
+# them, from the coarsest level of its pyramid that still has enough detail.
+# Only the stored chunks overlapping the window are loaded, so the cost does not
+# grow with the length of the recording. Windows that need full resolution are
+# cut from test_files, which level 0 is not copied out of. Tests saved before
+# pyramids existed get theirs built on first use.
+#   {"test_id", "level", "factor", "time": [], "series": {<series>: []}}
+@router.get("/tests/{test_id}/window")
+async def get_test_window(test_id: int, t0: float = float("-inf"), t1: float = float("inf"), max_points: int = DEFAULT_MAX_POINTS):
+    if t1 < t0 or max_points < 3:
+        raise HTTPException(status_code=422, detail="Need t0 <= t1 and max_points >= 3")
+
+    index = lod_index_cache.get(test_id)
+    if index is None:
+        index = await db_executor.run(fetch_pyramid_index, test_id)
+        if not index:
+            index = await build_missing_pyramid(test_id)
+        if not index:
+            raise HTTPException(status_code=404, detail=f"Test {test_id} has no samples")
+        lod_index_cache.put(test_id, index)
+
+    level, chunk_ids = choose_level(index, t0, t1, max_points)
+    chunks = []
+    if chunk_ids and level == 0:
+        chunks = [await full_resolution_chunk(test_id)]
+    elif chunk_ids:
+        chunks = (await db_executor.run(
+            supabase.table("test_lod")
+            .select("chunk, data")
+            .eq("test_id", test_id)
+            .eq("level", level)
+            .in_("chunk", chunk_ids)
+            .execute
+        )).data
+        chunks = [{**chunk, "data": decode_test_files(chunk["data"])} for chunk in chunks]
+
+    return {"test_id": test_id, "level": level, "factor": LOD_FACTOR ** level, **window(chunks, t0, t1, max_points)}
+
+# The whole recording as a single level 0 chunk for lod.window, from test_files
+async def full_resolution_chunk(test_id):
+    response = await load_test(test_id, None, None, "lttb", None)
+    if not response.data or not response.data[0].get("test_files"):
+        raise HTTPException(status_code=404, detail=f"Test {test_id} not found")
+    time, series = await cpu_executor.run(review_arrays, response.data[0]["test_files"])
+    return {"chunk": 0, "data": {"time": time, **series}}
+
+# Chunk metadata of a test's pyramid, without the data
+def fetch_pyramid_index(test_id):
+    response = (
+        supabase.table("test_lod")
+        .select("level, chunk, level_count, start_time, end_time")
+        .eq("test_id", test_id)
+        .execute()
+    )
+    return response.data
+
+async def build_missing_pyramid(test_id):
+    response = await db_executor.run(
+        supabase.table("test_info")
+        .select("id, test_files(*)")
+        .eq("id", test_id)
+        .execute
+    )
+    if not response.data or not response.data[0].get("test_files"):
+        raise HTTPException(status_code=404, detail=f"Test {test_id} not found")
+    rows = await cpu_executor.run(save_pyramid, test_id, response.data[0]["test_files"])
+    return [{key: value for key, value in row.items() if key != "data"} for row in rows]
+
+# Pyramid rows of the review series, without the test id.
+# Tests stored raw only get the row describing level 0: their series depend on
+# the calibration and are derived when read, so every window of them is cut
+# from derived_series with the test's current calibration.
+def pyramid_rows(testData):
+    testData = decode_test_files(testData)
+    time, series = review_arrays(testData)
+    if any(testData.get(name) is None for name in DERIVED_COLUMNS):
+        return build_pyramid(time, {}, min_points=len(time))
+    return build_pyramid(time, series, codec=STORAGE_CODEC)
+
+# Time in seconds and the review series of a decoded test_files row, as flat arrays
+def review_arrays(testData):
+    time = flatten_series(testData.get("timeStamp") or []) / 1000
+    series = {name: flatten_series(testData[name]) for name in REVIEW_SERIES
+              if testData.get(name) is not None and len(testData[name]) > 0}
+    return time, series
+
+# Builds and stores the pyramid of a test saved before pyramids existed, returns the stored rows
+def save_pyramid(test_id, testData):
+    rows = [{**row, "test_id": test_id} for row in pyramid_rows(testData)]
+    if rows:
+        supabase.table("test_lod").insert(rows).execute()
+    return rows
+
 # Get all announcements
 @router.get("/announcements")
 async def get_announcements():
-    response = (
+    response = await db_executor.run(
         supabase.table("announcements")
         .select("*")
-        .execute()
+        .execute
     )
     return response
 
@@ -158,10 +471,11 @@ async def get_announcements():
 # EX. in testName.js the user can change the test name
 @router.put("/update_test/{test_id}")
 async def update_test(test_id: int, new_data: dict):
-    response = (
+    response = await db_executor.run(
         supabase.table("test_info")
         .update(new_data)
         .eq("id", test_id)
-        .execute()
+        .execute
     )
+    test_response_cache.discard_where(lambda key: key[0] == test_id)
     return response
\ No newline at end of file
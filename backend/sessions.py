@@ -0,0 +1,141 @@
+import time
+import uuid
+import numpy as np
+
+from calc import KinematicsStream, LowPassStream
+from params import WHEEL_DIAM_IN, DIST_WHEELS_IN, SAMPLE_RATE_HZ, FILTER_CUTOFF_HZ
+
+# Sessions that have not been touched for this long are dropped
+IDLE_TIMEOUT_S = 5 * 60
+
+# Default calibration, matches the gains used by /calculate/
+DEFAULT_LEFT_GAIN = 1.13
+DEFAULT_RIGHT_GAIN = 1.12
+
+
+PACKET_KEYS = ("timeStamps", "gyroLeft", "gyroRight")
+
+# Why a packet cannot be appended, or None if it can
+def packet_error(packet):
+    if not isinstance(packet, dict):
+        return f"expected an object, got {type(packet).__name__}"
+    missing = [key for key in PACKET_KEYS if key not in packet]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    try:
+        lengths = [np.asarray(packet[key], dtype=float).shape for key in PACKET_KEYS]
+    except (TypeError, ValueError) as e:
+        return str(e)
+    if any(len(shape) != 1 for shape in lengths) or len(set(lengths)) != 1:
+        return "arrays must be flat and have the same length, got " + \
+            ", ".join(f"{key}={shape}" for key, shape in zip(PACKET_KEYS, lengths))
+    return None
+
+
+# Server-side state for one live recording: the calibration it was opened with,
+# the raw samples received so far and the running kinematics integrator.
+# With smooth=True the gyro data is run through a causal low pass filter that
+# carries its state from packet to packet before the gains are applied.
+class RecordingSession:
+    def __init__(self, leftGain=DEFAULT_LEFT_GAIN, rightGain=DEFAULT_RIGHT_GAIN,
+                 diameter=WHEEL_DIAM_IN, wheel_distance=DIST_WHEELS_IN, smooth=False,
+                 sample_rate=SAMPLE_RATE_HZ, cutoff_hz=FILTER_CUTOFF_HZ):
+        self.id = uuid.uuid4().hex
+        self.leftGain = leftGain
+        self.rightGain = rightGain
+        self.diameter = diameter
+        self.wheel_distance = wheel_distance
+        self.smooth = smooth
+        self.filter = LowPassStream(sample_rate, cutoff_hz) if smooth else None
+        self.stream = KinematicsStream(diameter, wheel_distance)
+        # Raw samples are kept as a list of chunks and only joined when read back
+        self._chunks = {'timeStamps': [], 'gyroLeft': [], 'gyroRight': []}
+        self.last_used = time.monotonic()
+
+    def append(self, timeStamps, gyroLeft, gyroRight):
+        # Check before touching any state so a bad packet leaves the session as it was
+        error = packet_error({"timeStamps": timeStamps, "gyroLeft": gyroLeft, "gyroRight": gyroRight})
+        if error is not None:
+            raise ValueError(error)
+        timeStamps = np.asarray(timeStamps, dtype=float)
+        gyroLeft = np.asarray(gyroLeft, dtype=float)
+        gyroRight = np.asarray(gyroRight, dtype=float)
+
+        gyroLeft_gained, gyroRight_gained = gyroLeft, gyroRight
+        if self.smooth:
+            gyroLeft_gained, gyroRight_gained = self.filter.filter(gyroLeft, gyroRight)
+        gyroLeft_gained = gyroLeft_gained * self.leftGain
+        gyroRight_gained = gyroRight_gained * self.rightGain
+        kinematics = self.stream.append(timeStamps, gyroLeft_gained, gyroRight_gained)
+
+        self._chunks['timeStamps'].append(timeStamps)
+        self._chunks['gyroLeft'].append(gyroLeft)
+        self._chunks['gyroRight'].append(gyroRight)
+        # Streamed packets do not go through SessionStore.get, keep the session from looking idle
+        self.last_used = time.monotonic()
+
+        return {
+            **kinematics.to_dict(),
+            "gyroLeft": gyroLeft_gained.tolist(),
+            "gyroRight": gyroRight_gained.tolist(),
+            "timeStamp": timeStamps.tolist(),
+            "count": self.stream.count
+        }
+
+    # Returns every raw sample buffered for this session
+    def samples(self):
+        return {
+            key: np.concatenate(chunks) if chunks else np.empty(0)
+            for key, chunks in self._chunks.items()
+        }
+
+    def settings(self):
+        return {
+            "session_id": self.id,
+            "leftGain": self.leftGain,
+            "rightGain": self.rightGain,
+            "diameter": self.diameter,
+            "wheel_distance": self.wheel_distance,
+            "smooth": self.smooth,
+            "sample_rate": self.filter.sample_rate if self.smooth else None,
+            "cutoff_hz": self.filter.cutoff if self.smooth else None,
+            "count": self.stream.count
+        }
+
+
+# In-memory registry of open recording sessions with idle-timeout eviction.
+# Expired sessions are swept lazily whenever the store is accessed.
+class SessionStore:
+    def __init__(self, idle_timeout=IDLE_TIMEOUT_S):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+
+    def open(self, **settings):
+        self.evict_idle()
+        session = RecordingSession(**settings)
+        self._sessions[session.id] = session
+        return session
+
+    # Returns the session, or None if it does not exist or has expired
+    def get(self, session_id):
+        self.evict_idle()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_used = time.monotonic()
+        return session
+
+    def close(self, session_id):
+        return self._sessions.pop(session_id, None)
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [session_id for session_id, session in self._sessions.items() if session.last_used < cutoff]
+        for session_id in expired:
+            del self._sessions[session_id]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+sessions = SessionStore()
@@ -0,0 +1,8 @@
+-- Content fingerprint of the recording and solver settings a calibration was
+-- solved from (see calibration_fingerprint in routers/calibrate.py). Lets
+-- /calibrate/ return the saved row for a resubmitted recording.
+alter table calibrations add column if not exists fingerprint text;
+
+create unique index if not exists calibrations_fingerprint_idx
+    on calibrations (fingerprint)
+    where fingerprint is not null;
@@ -0,0 +1,3 @@
+-- Calibration a test was recorded with. Tests stored raw (STORAGE_MODE=raw)
+-- get their derived series computed with it when they are read.
+alter table test_info add column if not exists calibration_id bigint references calibrations (id);
@@ -0,0 +1,29 @@
+-- Level-of-detail pyramids of stored tests (see lod.py). Each row holds one
+-- chunk of one level: time in seconds and the review series, encoded like
+-- test_files (see codec.py).
+-- Level 0, the full recording, is read from test_files: its single row only
+-- describes it and has no data.
+create table if not exists test_lod (
+    id bigint generated by default as identity primary key,
+    test_id bigint not null references test_info (id) on delete cascade,
+    level integer not null,
+    chunk integer not null,
+    level_count integer not null,
+    start_time double precision not null,
+    end_time double precision not null,
+    data jsonb,
+    unique (test_id, level, chunk)
+);
+
+-- Pyramids stored before level 0 was read from test_files
+alter table test_lod alter column data drop not null;
+update test_lod set data = null where level = 0 and data is not null;
+
+-- Tests stored raw (STORAGE_MODE=raw) have their series derived on read with
+-- their current calibration, so coarser levels derived when they were saved are dropped
+delete from test_lod
+using test_info, test_files
+where test_lod.test_id = test_info.id
+  and test_files.id = test_info.test_file_id
+  and test_lod.level > 0
+  and test_files.displacement is null;
@@ -0,0 +1,6 @@
+-- Summary fields written by /db/write_test (see test_summary in routers/db.py)
+-- so the test listing can be served from test_info alone. Tests saved before
+-- these columns existed have them null.
+alter table test_info add column if not exists duration double precision;
+alter table test_info add column if not exists distance double precision;
+alter table test_info add column if not exists sample_count integer;
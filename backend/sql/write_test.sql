@@ -0,0 +1,55 @@
+-- Idempotency key of each saved test (see write_test in routers/db.py): the
+-- client's Idempotency-Key header, or a hash of the test's content.
+alter table test_info add column if not exists idempotency_key text;
+
+create unique index if not exists test_info_idempotency_key_idx
+    on test_info (idempotency_key)
+    where idempotency_key is not null;
+
+-- Saves a test in one transaction: its test_files row, its test_info row and
+-- the chunks of its level-of-detail pyramid (see lod.py). A test already saved
+-- under the same idempotency key is returned as it is, with created = false.
+--   {"test_file_id": ..., "test_info": {...}, "created": true | false}
+create or replace function write_test(p_test_files jsonb, p_test_info jsonb, p_lod jsonb, p_idempotency_key text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    saved test_info;
+    new_test_file_id bigint;
+begin
+    select * into saved from test_info where idempotency_key = p_idempotency_key;
+    if found then
+        return jsonb_build_object('test_file_id', saved.test_file_id, 'test_info', to_jsonb(saved), 'created', false);
+    end if;
+
+    begin
+        insert into test_files (distance, "timeStamp", displacement, velocity, heading, trajectory_x, trajectory_y,
+                                "gyroLeft", "gyroRight", "accelRight", "accelLeft")
+        select distance, "timeStamp", displacement, velocity, heading, trajectory_x, trajectory_y,
+               "gyroLeft", "gyroRight", "accelRight", "accelLeft"
+        from jsonb_populate_record(null::test_files, p_test_files)
+        returning id into new_test_file_id;
+
+        insert into test_info (test_file_id, comments, test_name, recorded_by_user_id,
+                               duration, distance, sample_count, calibration_id, idempotency_key)
+        select new_test_file_id, comments, test_name, recorded_by_user_id,
+               duration, distance, sample_count, calibration_id, p_idempotency_key
+        from jsonb_populate_record(null::test_info, p_test_info)
+        returning * into saved;
+
+        insert into test_lod (test_id, level, chunk, level_count, start_time, end_time, data)
+        select saved.id, level, chunk, level_count, start_time, end_time, data
+        from jsonb_populate_recordset(null::test_lod, coalesce(p_lod, '[]'::jsonb));
+    exception when unique_violation then
+        -- A concurrent save with the same key won, everything above is rolled back
+        select * into saved from test_info where idempotency_key = p_idempotency_key;
+        if not found then
+            raise;
+        end if;
+        return jsonb_build_object('test_file_id', saved.test_file_id, 'test_info', to_jsonb(saved), 'created', false);
+    end;
+
+    return jsonb_build_object('test_file_id', new_test_file_id, 'test_info', to_jsonb(saved), 'created', true);
+end;
+$$;
@@ -0,0 +1,24 @@
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from types import SimpleNamespace
+
+from routers import auth
+
+app = FastAPI()
+app.include_router(auth.router)
+client = TestClient(app)
+
+
+def test_login_passes_busy_server_errors_through(monkeypatch):
+    def busy(credentials):
+        raise HTTPException(status_code=503, detail="Server is busy, try again shortly")
+    monkeypatch.setattr(auth, "supabase", SimpleNamespace(auth=SimpleNamespace(sign_in_with_password=busy)))
+    response = client.post("/auth/login", json={"email": "a@b.c", "password": "x"})
+    assert response.status_code == 503
+
+
+def test_failed_login_is_a_404(monkeypatch):
+    def wrong_password(credentials):
+        raise ValueError("Invalid login credentials")
+    monkeypatch.setattr(auth, "supabase", SimpleNamespace(auth=SimpleNamespace(sign_in_with_password=wrong_password)))
+    assert client.post("/auth/login", json={"email": "a@b.c", "password": "x"}).status_code == 404
@@ -0,0 +1,31 @@
+import time
+import pytest
+
+from auth_tokens import InvalidToken, decode_token
+from fakes import FAKE_JWT_SECRET as SECRET, make_token
+
+# Far enough either side of now for the clock leeway
+LATER = time.time() + 3600
+EARLIER = time.time() - 3600
+
+
+def test_accepts_a_valid_token():
+    claims = {"sub": "user-1", "aud": "authenticated", "exp": LATER}
+    assert decode_token(make_token(claims), SECRET)["sub"] == "user-1"
+
+
+@pytest.mark.parametrize("token", [
+    make_token({"sub": "user-1", "aud": "authenticated", "exp": LATER}, secret="other-secret"),
+    make_token({"sub": "user-1", "aud": "authenticated", "exp": EARLIER}),
+    make_token({"sub": "user-1", "aud": "anon", "exp": LATER}),
+    make_token({"sub": "user-1", "aud": "authenticated", "exp": LATER}, alg="none"),
+    make_token({"aud": "authenticated", "exp": LATER}),
+    make_token([1, 2]),
+    # Header and claims that are valid JSON but not objects
+    "MQ.e30.AA",
+    "e30.MQ.AA",
+    "not-a-token",
+])
+def test_rejects_bad_tokens(token):
+    with pytest.raises(InvalidToken):
+        decode_token(token, SECRET)
@@ -0,0 +1,26 @@
+import time
+
+from cache import LRUCache
+
+
+def test_evicts_least_recently_used_until_bytes_fit():
+    cache = LRUCache(maxsize=10, max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    cache.get("a")
+    cache.put("c", b"cccc")
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.stats()["bytes"] == 8
+    # Too large for the whole cache, so it is not kept
+    cache.put("d", b"d" * 11)
+    assert "d" not in cache and len(cache) == 2
+
+
+def test_counts_hits_misses_and_expires_entries():
+    cache = LRUCache(ttl=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 0)
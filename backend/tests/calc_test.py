@@ -0,0 +1,152 @@
+from calc import KinematicsStream, LowPassStream, compute_kinematics, resample_uniform, smooth_data, get_displacement_m, get_velocity_m_s, get_heading_deg, get_top_traj
+from params import IN_TO_M
+import numpy as np
+
+# Reference implementations of the original per-sample loops
+def loop_displacement(timeStamps, gyroLeft, gyroRight, diameter, dist_wheels):
+    dist_m = [0]
+    for i in range(len(gyroRight) - 1):
+        dx_r = (abs(gyroLeft[i])+abs(gyroRight[i]))/2 * (timeStamps[i + 1] - timeStamps[i])
+        dist_m.append(dx_r * (diameter * IN_TO_M / 2) + dist_m[-1])
+    return dist_m
+
+def loop_velocity(timeStamps, gyroLeft, gyroRight, diameter, dist_wheels):
+    vel_ms = [0]
+    for i in range(len(gyroRight) - 1):
+        vel_ms.append((gyroRight[i] * diameter/2*IN_TO_M + gyroLeft[i] * diameter/2*IN_TO_M)/2)
+    return vel_ms
+
+def loop_heading(timeStamps, gyroLeft, gyroRight, diameter, dist_wheels):
+    heading_deg = [0]
+    for i in range(len(gyroRight) - 1):
+        w = ((gyroRight[i]-gyroLeft[i]) * diameter*IN_TO_M/2) / (dist_wheels*IN_TO_M)
+        heading_deg.append(w * (timeStamps[i + 1] - timeStamps[i])*180/np.pi + heading_deg[-1])
+    return heading_deg
+
+def loop_traj(vel_ms, heading_deg, timeStamps):
+    traj, dx, dy = [], 0, 0
+    for i in range(len(vel_ms) - 1):
+        dx += vel_ms[i]*np.cos(heading_deg[i]*np.pi/180) * (timeStamps[i + 1] - timeStamps[i])
+        dy += vel_ms[i]*np.sin(heading_deg[i]*np.pi/180) * (timeStamps[i + 1] - timeStamps[i])
+        traj.append([dx, dy])
+    return traj
+
+def make_recording(n, seed=0):
+    rng = np.random.default_rng(seed)
+    timeStamps = np.cumsum(rng.uniform(0.01, 0.02, n))
+    gyroLeft = np.sin(np.linspace(0, 20, n)) + rng.normal(0, 0.1, n)
+    gyroRight = np.cos(np.linspace(0, 15, n)) + rng.normal(0, 0.1, n)
+    return list(timeStamps), list(gyroLeft), list(gyroRight)
+
+def test_kinematics_match_loops():
+    timeStamps, gyroLeft, gyroRight = make_recording(2000)
+
+    displacement = get_displacement_m(timeStamps, gyroLeft, gyroRight, 24, 26)
+    velocity = get_velocity_m_s(timeStamps, gyroLeft, gyroRight, 24, 26)
+    heading = get_heading_deg(timeStamps, gyroLeft, gyroRight, 24, 26)
+    trajectory = get_top_traj(displacement, velocity, heading, timeStamps)
+
+    np.testing.assert_allclose(displacement, loop_displacement(timeStamps, gyroLeft, gyroRight, 24, 26), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(velocity, loop_velocity(timeStamps, gyroLeft, gyroRight, 24, 26), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(heading, loop_heading(timeStamps, gyroLeft, gyroRight, 24, 26), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(trajectory, loop_traj(velocity, heading, timeStamps), rtol=1e-9, atol=1e-9)
+
+def test_compute_kinematics_single_pass():
+    timeStamps, gyroLeft, gyroRight = make_recording(500, seed=1)
+
+    kinematics = compute_kinematics(timeStamps, gyroLeft, gyroRight, 24, 26)
+    velocity = loop_velocity(timeStamps, gyroLeft, gyroRight, 24, 26)
+    heading = loop_heading(timeStamps, gyroLeft, gyroRight, 24, 26)
+
+    np.testing.assert_allclose(kinematics.displacement, loop_displacement(timeStamps, gyroLeft, gyroRight, 24, 26), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(kinematics.velocity, velocity, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(kinematics.heading, heading, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(kinematics.trajectory, loop_traj(velocity, heading, timeStamps), rtol=1e-9, atol=1e-9)
+
+    result = kinematics.to_dict()
+    assert set(result) == {"displacement", "velocity", "heading", "trajectory_x", "trajectory_y"}
+    assert len(result["trajectory_x"]) == len(result["displacement"]) - 1
+
+def test_kinematics_short_inputs():
+    for n in (0, 1, 2):
+        timeStamps, gyroLeft, gyroRight = make_recording(n)
+        displacement = get_displacement_m(timeStamps, gyroLeft, gyroRight)
+        velocity = get_velocity_m_s(timeStamps, gyroLeft, gyroRight)
+        heading = get_heading_deg(timeStamps, gyroLeft, gyroRight)
+        trajectory = get_top_traj(displacement, velocity, heading, timeStamps)
+
+        assert len(displacement) == max(n, 1)
+        assert len(velocity) == max(n, 1)
+        assert len(heading) == max(n, 1)
+        assert trajectory.shape == (max(n - 1, 0), 2)
+
+def test_stream_matches_batch():
+    timeStamps, gyroLeft, gyroRight = make_recording(1000, seed=2)
+    batch = compute_kinematics(timeStamps, gyroLeft, gyroRight, 24, 26)
+
+    stream = KinematicsStream(24, 26)
+    chunks = []
+    start = 0
+    for size in [1, 4, 4, 0, 37, 200] * 10:
+        end = min(start + size, len(timeStamps))
+        chunks.append(stream.append(timeStamps[start:end], gyroLeft[start:end], gyroRight[start:end]))
+        start = end
+    chunks.append(stream.append(timeStamps[start:], gyroLeft[start:], gyroRight[start:]))
+
+    assert stream.count == len(timeStamps)
+    for series in ("timeStamps", "displacement", "velocity", "heading", "trajectory_x", "trajectory_y"):
+        streamed = np.concatenate([getattr(chunk, series) for chunk in chunks])
+        np.testing.assert_allclose(streamed, getattr(batch, series), rtol=1e-9, atol=1e-9)
+
+def test_low_pass_stream_is_chunk_invariant():
+    rng = np.random.default_rng(3)
+    t = np.arange(2000) / 68
+    gyroLeft = np.sin(2 * np.pi * 1 * t) + 0.5 * np.sin(2 * np.pi * 20 * t) + rng.normal(0, 0.05, len(t))
+    gyroRight = np.cos(2 * np.pi * 1 * t) + 0.5 * np.sin(2 * np.pi * 25 * t)
+
+    whole_left, whole_right = LowPassStream().filter(gyroLeft, gyroRight)
+
+    stream = LowPassStream()
+    chunks = [stream.filter(gyroLeft[i:i + 4], gyroRight[i:i + 4]) for i in range(0, len(t), 4)]
+    np.testing.assert_allclose(np.concatenate([c[0] for c in chunks]), whole_left, atol=1e-10)
+    np.testing.assert_allclose(np.concatenate([c[1] for c in chunks]), whole_right, atol=1e-10)
+
+    # The 1 Hz motion is kept and the 20 Hz noise is removed
+    slow, fast = LowPassStream().filter(np.sin(2 * np.pi * 1 * t), np.sin(2 * np.pi * 20 * t))
+    settled = slice(200, None)
+    assert 0.95 < np.max(np.abs(slow[settled])) < 1.05
+    assert np.max(np.abs(fast[settled])) < 0.01
+
+def test_resample_uniform():
+    rng = np.random.default_rng(4)
+    timeStamps = np.cumsum(rng.uniform(0.005, 0.025, 1000))
+    values = 2 * timeStamps + 1
+
+    uniform_time, (resampled,), sample_rate = resample_uniform(timeStamps, values)
+
+    assert np.isclose(sample_rate, 999 / (timeStamps[-1] - timeStamps[0]))
+    np.testing.assert_allclose(np.diff(uniform_time), 1 / sample_rate)
+    assert timeStamps[0] == uniform_time[0] and uniform_time[-1] <= timeStamps[-1] + 1e-9
+    np.testing.assert_allclose(resampled, 2 * uniform_time + 1)
+
+def test_smooth_data_resampled_reports_rate():
+    rng = np.random.default_rng(5)
+    timeStamps = np.cumsum(rng.uniform(0.005, 0.025, 500)).tolist()
+    gyro = np.sin(np.asarray(timeStamps)).tolist()
+
+    response = smooth_data({'timeStamps': timeStamps, 'gyroLeft': gyro, 'gyroRight': gyro}, resample=True)
+    assert len(response['gyro_left_smoothed']) == len(response['timeStamps'])
+    assert np.isclose(response['sample_rate'], 1 / np.mean(np.diff(timeStamps)))
+
+def test_smooth_data_cutoff():
+    timeStamps = np.arange(1000) / 68
+    slow = np.sin(2 * np.pi * 2 * timeStamps)
+    fast = 0.5 * np.sin(2 * np.pi * 20 * timeStamps)
+
+    response = smooth_data({'timeStamps': timeStamps, 'gyroLeft': slow + fast, 'gyroRight': slow})
+
+    # Away from the edges, the 2 Hz signal is kept and the 20 Hz signal is removed
+    middle = slice(100, -100)
+    np.testing.assert_allclose(np.asarray(response['gyro_left_smoothed'])[middle], slow[middle], atol=0.05)
+    np.testing.assert_allclose(np.asarray(response['gyro_right_smoothed'])[middle], slow[middle], atol=0.05)
+    assert np.isclose(response['sample_rate'], 68)
@@ -0,0 +1,233 @@
+import asyncio
+import json
+from fastapi import FastAPI, WebSocketDisconnect
+from fastapi.testclient import TestClient
+import numpy as np
+import pytest
+
+from calc import compute_kinematics
+from routers import calculate
+from sessions import SessionStore, sessions
+
+app = FastAPI()
+app.include_router(calculate.router)
+client = TestClient(app)
+
+def test_session_matches_full_calculation():
+    rng = np.random.default_rng(0)
+    timeStamps = np.cumsum(rng.uniform(0.01, 0.02, 400)).tolist()
+    gyroLeft = rng.normal(1, 0.2, 400).tolist()
+    gyroRight = rng.normal(1, 0.2, 400).tolist()
+
+    session = client.post("/calculate/session", json={"leftGain": 1.1, "rightGain": 1.2}).json()
+    session_id = session["session_id"]
+
+    heading = []
+    for start in range(0, 400, 4):
+        packet = {
+            "timeStamps": timeStamps[start:start + 4],
+            "gyroLeft": gyroLeft[start:start + 4],
+            "gyroRight": gyroRight[start:start + 4]
+        }
+        response = client.post(f"/calculate/session/{session_id}", json=packet).json()
+        assert len(response["heading"]) == 4
+        heading.extend(response["heading"])
+    assert response["count"] == 400
+
+    expected = compute_kinematics(timeStamps, np.array(gyroLeft) * 1.1, np.array(gyroRight) * 1.2)
+    np.testing.assert_allclose(heading, expected.heading, rtol=1e-9, atol=1e-9)
+
+    buffered = client.get(f"/calculate/session/{session_id}").json()
+    assert buffered["gyroLeft"] == gyroLeft
+
+    assert client.delete(f"/calculate/session/{session_id}").status_code == 200
+    assert client.post(f"/calculate/session/{session_id}", json=packet).status_code == 404
+
+def test_bad_posted_packets_leave_the_session_usable():
+    session_id = client.post("/calculate/session", json={"smooth": True}).json()["session_id"]
+    bad = [{"timeStamps": [[0.0, 0.1]], "gyroLeft": [[1.0, 1.0]], "gyroRight": [[1.0, 1.0]]},
+           {"timeStamps": [0.0, 0.1], "gyroLeft": [[1.0], [1.0]], "gyroRight": [1.0, 1.0]},
+           {"timeStamps": [0.0, 0.1], "gyroLeft": ["a", 1.0], "gyroRight": [1.0, 1.0]},
+           {"timeStamps": [0.0, 0.1]}]
+    for packet in bad:
+        assert client.post(f"/calculate/session/{session_id}", json=packet).status_code == 422
+
+    packet = {"timeStamps": [0.0, 0.1], "gyroLeft": [1.0, 1.0], "gyroRight": [1.0, 1.0]}
+    response = client.post(f"/calculate/session/{session_id}", json=packet)
+    assert response.status_code == 200 and response.json()["count"] == 2
+    client.delete(f"/calculate/session/{session_id}")
+
+def test_idle_sessions_are_evicted():
+    store = SessionStore(idle_timeout=60)
+    session = store.open()
+    assert store.get(session.id) is session
+
+    session.last_used -= 61
+    assert store.get(session.id) is None
+    assert len(store) == 0
+
+def test_websocket_streams_derived_samples():
+    with client.websocket_connect("/calculate/ws?leftGain=1&rightGain=1&smooth=false") as websocket:
+        opened = websocket.receive_json()
+        assert opened["type"] == "session"
+        assert opened["smooth"] is False
+
+        websocket.send_json({"timeStamps": [0.0, 0.1], "gyroLeft": [1.0, 1.0], "gyroRight": [1.0, 1.0]})
+        first = websocket.receive_json()
+        assert first["type"] == "samples"
+        assert first["count"] == 2
+
+        packets = [{"timeStamps": [0.1 * i], "gyroLeft": [1.0], "gyroRight": [1.0]} for i in range(2, 6)]
+        websocket.send_json({"packets": packets})
+        received = 0
+        while received < 4:
+            message = websocket.receive_json()
+            received += message["packets"]
+        assert message["count"] == 6
+        expected = compute_kinematics([0.1 * i for i in range(6)], [1.0] * 6, [1.0] * 6)
+        assert np.isclose(message["displacement"][-1], expected.displacement[-1])
+
+        websocket.send_json({"timeStamps": [1.0]})
+        assert websocket.receive_json()["type"] == "error"
+    # The session goes away with the connection
+    assert sessions.get(opened["session_id"]) is None
+
+def test_appending_keeps_a_session_from_going_idle():
+    store = SessionStore(idle_timeout=60)
+    session = store.open()
+    session.last_used -= 120
+    session.append([0.0], [1.0], [1.0])
+    assert store.get(session.id) is session
+
+def test_bad_packets_are_rejected_one_by_one():
+    session = sessions.open(leftGain=1, rightGain=1)
+    good = {"timeStamps": [0.0, 0.1], "gyroLeft": [1.0, 1.0], "gyroRight": [1.0, 1.0]}
+    # Lengths that only add up across the two packets
+    short = {"timeStamps": [0.2, 0.3, 0.4], "gyroLeft": [1.0] * 4, "gyroRight": [1.0] * 3}
+    long = {"timeStamps": [0.5] * 4, "gyroLeft": [1.0] * 3, "gyroRight": [1.0] * 4}
+    reply = calculate.process_packets(session, [good, short, long, 5])
+    assert (reply["type"], reply["packets"], reply["rejected"], reply["count"]) == ("samples", 1, 3, 2)
+
+    reply = calculate.process_packets(session, [short, long])
+    assert (reply["type"], reply["packets"], reply["rejected"]) == ("error", 0, 2)
+    assert session.stream.count == 2
+    sessions.close(session.id)
+
+def test_websocket_ends_on_a_message_that_is_not_packets():
+    with client.websocket_connect("/calculate/ws") as websocket:
+        websocket.receive_json()
+        websocket.send_json({"packets": 5})
+        with pytest.raises(WebSocketDisconnect):
+            websocket.receive_json()
+
+def test_smooth_rejects_time_stamps_it_cannot_resample():
+    packet = {"timeStamps": [0.0, 0.2, 0.1], "gyroLeft": [1.0] * 3, "gyroRight": [1.0] * 3}
+    assert client.post("/calculate/smooth?resample=true", json=packet).status_code == 422
+
+def test_smooth_rejects_time_stamps_that_do_not_increase():
+    for timeStamps in ([0.1, 0.1, 0.2], [0.2, 0.1, 0.3]):
+        packet = {"timeStamps": timeStamps, "gyroLeft": [1.0] * 3, "gyroRight": [1.0] * 3}
+        assert client.post("/calculate/smooth", json=packet).status_code == 422
+
+def make_walk(n, seed=0):
+    # Pushes at about 1 Hz on top of a steady roll, so the metrics find bouts and strokes
+    t = np.arange(n) / 68
+    rng = np.random.default_rng(seed)
+    gyro = 2 - np.cos(2 * np.pi * t) + rng.normal(0, 0.05, n)
+    return t.tolist(), gyro.tolist()
+
+def test_batch_streams_ndjson():
+    timeStamps, gyro = make_walk(68 * 20)
+    tests = [
+        {"id": "a", "timeStamps": timeStamps, "gyroLeft": gyro, "gyroRight": gyro},
+        # Stored tests keep one list per packet and may lack time stamps
+        {"id": "b", "gyroLeft": [gyro[i:i + 4] for i in range(0, len(gyro), 4)],
+         "gyroRight": [gyro[i:i + 4] for i in range(0, len(gyro), 4)]},
+        {"id": "c", "timeStamps": [0.0], "gyroLeft": [1.0], "gyroRight": [1.0]}
+    ]
+
+    response = client.post("/calculate/batch", json={"tests": tests, "settings": {"include_series": True}})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {result["id"]: result for result in map(json.loads, response.text.splitlines())}
+
+    assert results["a"]["sample_count"] == len(timeStamps)
+    assert results["a"]["metrics"]["bout_num"] == [1]
+    assert len(results["a"]["velocity"]) == len(timeStamps)
+    np.testing.assert_allclose(results["b"]["distance"], results["a"]["distance"])
+    assert "error" in results["c"]
+
+def test_batch_limits_tests_in_flight():
+    running, peak = 0, 0
+
+    async def job(index):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return {"id": index}
+
+    async def collect():
+        return [json.loads(line) async for line in calculate.stream_ndjson((job(i) for i in range(20)), max_in_flight=3)]
+
+    assert sorted(result["id"] for result in asyncio.run(collect())) == list(range(20))
+    assert peak == 3
+
+def test_batch_reports_bad_entries_and_resamples_unsmoothed():
+    tests = [5, {"id": "a", "timeStamps": [0.0, 0.1, 0.25, 0.3], "gyroLeft": [1.0] * 4, "gyroRight": [1.0] * 4}]
+    settings = {"smooth": False, "resample": True, "include_series": True}
+    response = client.post("/calculate/batch", json={"tests": tests, "settings": settings})
+    results = {result["id"]: result for result in map(json.loads, response.text.splitlines())}
+    assert "error" in results[None]
+    resampled = results["a"]
+    np.testing.assert_allclose(np.diff(resampled["timeStamp"]), 0.1)
+
+def test_batch_reprocesses_stored_tests_as_stored(monkeypatch):
+    from codec import encode_test_files
+    from fakes import FakeSupabase
+
+    # 60 s rolling at 1 rad/s, smoothed and gained by the recorder, time in ms
+    time_ms = np.arange(68 * 60 + 1) * 1000 / 68
+    test_files = encode_test_files({"timeStamp": time_ms.tolist(), "gyroLeft": [1.0] * len(time_ms), "gyroRight": [1.0] * len(time_ms)})
+    monkeypatch.setattr(calculate, "supabase", FakeSupabase({"test_info": [{"id": 3, "test_files": test_files}]}))
+
+    response = client.post("/calculate/batch", json={"test_ids": [3]})
+    result = json.loads(response.text)
+    assert result["duration"] == pytest.approx(60)
+    assert result["distance"] == pytest.approx(60 * 24 * 0.0254 / 2)
+
+    doubled = json.loads(client.post("/calculate/batch", json={"test_ids": [3], "settings": {"leftGain": 2.26, "rightGain": 2.24}}).text)
+    assert doubled["distance"] == pytest.approx(2 * result["distance"])
+
+def test_calculate_applies_a_saved_calibration(monkeypatch):
+    import calibrations
+    from fakes import FakeSupabase
+
+    supabase = FakeSupabase({"calibrations": [{"id": 7, "smarthub_id": "a", "left_gain": 13.0, "right_gain": 12.0, "wheel_distance": 25.0}]})
+    monkeypatch.setattr(calibrations, "calibrations", calibrations.CalibrationRegistry(supabase))
+    packet = {"timeStamps": [0, 0.1, 0.2, 0.3], "gyroLeft": [1, 1, 1, 1], "gyroRight": [1, 2, 1, 2]}
+
+    response = client.post("/calculate/", json={**packet, "calibration_id": 7}).json()
+    expected = compute_kinematics(packet["timeStamps"], np.array(packet["gyroLeft"]) * 13.0, np.array(packet["gyroRight"]) * 12.0, 1, 25.0)
+    np.testing.assert_allclose(response["heading"], expected.heading)
+    assert response["gyroLeft"] == [13.0] * 4
+
+    # The first lookup loaded the registry, the second needs no query
+    queries = len(supabase.queries)
+    client.post("/calculate/", json={**packet, "calibration_id": 7})
+    assert len(supabase.queries) == queries
+    assert client.post("/calculate/", json={**packet, "calibration_id": 8}).status_code == 404
+
+def test_calculate_downsamples_to_max_points():
+    n = 20000
+    packet = {"timeStamps": (np.arange(n) / 68).tolist(), "gyroLeft": np.sin(np.arange(n) / 50).tolist(), "gyroRight": np.ones(n).tolist()}
+    full = client.post("/calculate/", json=packet).json()
+    reduced = client.post("/calculate/", json={**packet, "max_points": 2000}).json()
+
+    assert len(reduced["timeStamp"]) <= 2000 and len(reduced["velocity"]) == len(reduced["timeStamp"])
+    indices = np.round(np.asarray(reduced["timeStamp"]) * 68).astype(int)
+    np.testing.assert_allclose(reduced["heading"], np.asarray(full["heading"])[indices])
+    assert max(reduced["velocity"]) == max(full["velocity"][1:])
+    assert client.post("/calculate/", json={**packet, "max_points": 10, "downsample": "fft"}).status_code == 422
+    for max_points in ("abc", 0, -5, 2, 100.5, True):
+        assert client.post("/calculate/", json={**packet, "max_points": max_points}).status_code == 422
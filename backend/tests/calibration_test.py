@@ -1,4 +1,11 @@
-from routers.calibrate import Calibration, minimize_turnaround, compute_net_loss, largest_consecutive_group
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from cache import LRUCache
+from routers import calibrate
+from routers.calibrate import Calibration, MULTISTART_STARTS, compute_net_loss, compute_segment_loss, largest_consecutive_group, run_calibration
+from benchmarks.synthetic import out_and_back
 import numpy as np
 
 def test_full():
@@ -95,3 +102,174 @@ def test_smooth_data():
 
     assert calibration.data["gyroLeftSmoothed"] == expected_left
     assert calibration.data["gyroRightSmoothed"] == expected_right
+
+
+def test_segment_loss_matches_dense_sampling():
+    rng = np.random.default_rng(0)
+    points = rng.normal(0, 2, (500, 2))
+    start, end = np.array([0.0, 0.0]), np.array([5.0, 1.0])
+
+    dense = compute_net_loss(points, np.linspace(start, end, 100000))
+    assert np.isclose(compute_segment_loss(points, start, end), dense, rtol=1e-4)
+
+
+def test_largest_consecutive_group():
+    def loop_groups(nums, min_size=60, threshold=0.5):
+        groups, current = [], [nums[0]]
+        for i in range(1, len(nums)):
+            if nums[i] == nums[i - 1] + 1:
+                current.append(nums[i])
+            else:
+                if len(current) > min_size and any(x > threshold for x in current):
+                    groups.extend(current)
+                current = [nums[i]]
+        if len(current) > min_size and any(x > threshold for x in current):
+            groups.extend(current)
+        return groups
+
+    nums = np.concatenate((np.arange(0, 70), np.arange(100, 130), np.arange(200, 400), [500, 502], np.arange(600, 661)))
+    assert largest_consecutive_group(nums).tolist() == loop_groups(nums)
+    assert largest_consecutive_group(np.arange(0, 2), min_size=1).tolist() == loop_groups(np.arange(0, 2), min_size=1)
+    assert len(largest_consecutive_group([])) == 0
+
+
+def test_concurrent_calibrations_are_independent():
+    runs = [out_and_back(straight_s=8, seed=0), out_and_back(straight_s=12, turn_s=3, seed=1)]
+    sequential = [run_calibration(data) for data in runs]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        concurrent = list(pool.map(run_calibration, runs * 2))
+
+    assert sequential[0].turn != sequential[1].turn
+    for calibration, expected in zip(concurrent, sequential * 2):
+        assert calibration.turn == expected.turn
+        assert np.allclose([calibration.leftGain, calibration.rightGain, calibration.wheel_dist],
+                           [expected.leftGain, expected.rightGain, expected.wheel_dist])
+
+
+def test_jacobian_matches_central_differences():
+    calibration = Calibration(out_and_back(seed=0))
+    calibration.perform_calibration()
+    params = np.array([14.0, 15.0, 14.5])
+    step = 1e-6 * params
+    central = np.column_stack([
+        (calibration.problem.residuals(params + np.eye(3)[i] * step[i]) -
+         calibration.problem.residuals(params - np.eye(3)[i] * step[i])) / (2 * step[i])
+        for i in range(3)
+    ])
+    assert np.allclose(calibration.problem.jacobian(params), central, rtol=1e-3, atol=1e-6)
+
+
+def test_multistart_is_no_worse_than_fsolve():
+    data = out_and_back(straight_s=25, seed=3)
+    single = run_calibration(data)
+    multi = run_calibration(data, mode="multistart")
+
+    assert multi.diagnostics["mode"] == "multistart"
+    assert len(multi.diagnostics["starts"]) == len(MULTISTART_STARTS)
+    assert multi.leftGain > 0 and multi.rightGain > 0 and multi.wheel_dist >= 1
+    assert multi.diagnostics["residual"] <= single.diagnostics["residual"]
+
+
+def test_resubmitted_calibration_is_not_solved_or_saved_again(monkeypatch):
+    saved = []
+
+    class Response:
+        def __init__(self, data):
+            self.data = data
+
+    async def save(smarthubId, data, wheel_dist, leftGain, rightGain, calibrationName, fingerprint=None):
+        saved.append(fingerprint)
+        return Response([{"id": len(saved), "smarthub_id": smarthubId, "calibration_name": calibrationName,
+                          "left_gain": leftGain, "right_gain": rightGain, "wheel_distance": wheel_dist}])
+
+    monkeypatch.setattr(calibrate, "save_calibration", save)
+    monkeypatch.setattr(calibrate, "find_calibration", lambda fingerprint: [])
+    monkeypatch.setattr(calibrate, "calibration_cache", LRUCache(8))
+    app = FastAPI()
+    app.include_router(calibrate.router)
+    client = TestClient(app)
+
+    payload = {"smarthubId": "8888", "calibrationName": "first", **out_and_back(straight_s=8, seed=0)}
+    first = client.post("/calibrate/", json=payload).json()
+    renamed = client.post("/calibrate/", json={**payload, "calibrationName": "second"}).json()
+    assert renamed == first
+    assert len(saved) == 1
+
+    # A different recording or solver mode is a different calibration
+    changed = {**payload, "gyroLeft": [value * 1.01 for value in payload["gyroLeft"]]}
+    assert calibrate.calibration_fingerprint(changed) != saved[0]
+    assert calibrate.calibration_fingerprint(payload, "multistart") != saved[0]
+    assert calibrate.calibration_fingerprint(payload) == saved[0]
+
+    # Submissions that arrive together share one solve
+    calibrate.calibration_cache.clear()
+    async def submit_twice():
+        return await asyncio.gather(calibrate.perform_calibration(payload), calibrate.perform_calibration(payload))
+    together = asyncio.run(submit_twice())
+    assert together[0] == together[1]
+    assert len(saved) == 2
+
+def test_identical_calibrations_look_up_and_solve_once(monkeypatch):
+    lookups, solves = [], []
+
+    def find(fingerprint):
+        lookups.append(fingerprint)
+        return []
+
+    async def solve(data, mode, fingerprint):
+        solves.append(fingerprint)
+        await asyncio.sleep(0.01)
+        return [{"id": 1, "fingerprint": fingerprint}]
+
+    monkeypatch.setattr(calibrate, "find_calibration", find)
+    monkeypatch.setattr(calibrate, "solve_and_save", solve)
+    monkeypatch.setattr(calibrate, "calibration_cache", LRUCache(8))
+    payload = {"smarthubId": "8888", "calibrationName": "first", **out_and_back(straight_s=8, seed=0)}
+
+    async def submit_together():
+        return await asyncio.gather(*(calibrate.perform_calibration(payload) for _ in range(3)))
+    results = asyncio.run(submit_together())
+    assert results[0] == results[1] == results[2]
+    assert len(lookups) == len(solves) == 1
+
+def test_calibration_saved_by_another_process_is_a_cache_hit(monkeypatch):
+    from postgrest import APIError
+    existing = [{"id": 5, "calibration_name": "other process"}]
+
+    async def save(*args, **kwargs):
+        raise APIError({"code": "23505", "message": "duplicate key value violates unique constraint"})
+
+    lookups = []
+    def find(fingerprint):
+        lookups.append(fingerprint)
+        # Nothing is saved yet when this process looks, the other one saves while it solves
+        return existing if len(lookups) > 1 else []
+
+    monkeypatch.setattr(calibrate, "save_calibration", save)
+    monkeypatch.setattr(calibrate, "find_calibration", find)
+    monkeypatch.setattr(calibrate, "calibration_cache", LRUCache(8))
+    payload = {"smarthubId": "8888", "calibrationName": "first", **out_and_back(straight_s=8, seed=0)}
+
+    assert asyncio.run(calibrate.perform_calibration(payload)) == existing
+    assert len(lookups) == 2
+
+def test_waiters_are_released_when_the_first_calibration_is_cancelled(monkeypatch):
+    async def slow_solve(data, mode, fingerprint):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(calibrate, "solve_and_save", slow_solve)
+    monkeypatch.setattr(calibrate, "find_calibration", lambda fingerprint: [])
+    monkeypatch.setattr(calibrate, "calibration_cache", LRUCache(8))
+    payload = {"smarthubId": "8888", "calibrationName": "first", **out_and_back(straight_s=8, seed=0)}
+
+    async def cancel_first():
+        first = asyncio.create_task(calibrate.perform_calibration(payload))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(calibrate.perform_calibration(payload))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        return await asyncio.wait_for(asyncio.gather(waiter, return_exceptions=True), 2)
+
+    (result,) = asyncio.run(cancel_first())
+    assert getattr(result, "status_code", None) == 503
+    assert not calibrate.pending_calibrations
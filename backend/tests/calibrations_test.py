@@ -0,0 +1,27 @@
+from calibrations import CalibrationRegistry
+from fakes import FakeSupabase
+
+
+def calibration_row(id, smarthub_id, gain):
+    return {"id": id, "smarthub_id": smarthub_id, "calibration_name": f"cal {id}", "left_gain": gain,
+            "right_gain": gain, "wheel_distance": 25.0, "created_at": "2025-01-01", "raw_data": {"gyroLeft": [1] * 1000}}
+
+
+def test_registry_refreshes_incrementally():
+    client = FakeSupabase({"calibrations": [calibration_row(1, "a", 10.0), calibration_row(2, "b", 11.0)]})
+    registry = CalibrationRegistry(client)
+
+    assert registry.refresh() == 2
+    assert "raw_data" not in registry.get(1)
+    assert [row["id"] for row in registry.for_hub("a")] == [1]
+
+    client.tables["calibrations"].append(calibration_row(3, "a", 12.0))
+    assert registry.refresh() == 1
+    assert [row["id"] for row in registry.for_hub("a")] == [1, 3]
+    assert [row["id"] for row in registry.all()] == [1, 2, 3]
+
+    # Only rows past the last loaded id are asked for
+    assert registry.last_id == 3
+    assert registry.refresh() == 0
+    assert registry.get("3")["left_gain"] == 12.0
+    assert registry.get(4) is None
@@ -0,0 +1,59 @@
+import base64
+import numpy as np
+import pytest
+
+from codec import (HEADER, PREFIX, SERIES_STEPS, decode_series, decode_test_files, encode_series, encode_test_files,
+                   is_encoded)
+
+
+def test_delta_codec_error_is_within_half_a_step():
+    rng = np.random.default_rng(0)
+    values = np.cumsum(rng.normal(0, 0.05, 5000))
+    decoded = np.asarray(decode_series(encode_series(values.tolist(), 1e-4)))
+    assert np.abs(decoded - values).max() <= 0.5e-4 + 1e-12
+
+    # Large jumps do not fit int16 and switch to int32
+    jumps = np.array([0.0, 1e3, -1e3, 5.0])
+    assert np.allclose(decode_series(encode_series(jumps.tolist(), 1e-4)), jumps)
+
+
+def test_codec_keeps_packets_and_non_finite_values():
+    packets = [[1.0, 2.0], [3.5], [4.25, 5.0, 6.0]]
+    assert decode_series(encode_series(packets, 1e-3)) == packets
+    assert decode_series(encode_series([], 1e-3)) == []
+    decoded = decode_series(encode_series([1.0, float("nan")], 1e-3))
+    assert decoded[0] == 1.0 and np.isnan(decoded[1])
+
+
+def test_test_files_rows_round_trip_and_shrink():
+    rng = np.random.default_rng(1)
+    n = 4000
+    row = {"id": 3, "timeStamp": (np.arange(n) * 1000 / 68).tolist()}
+    for name in SERIES_STEPS:
+        if name != "timeStamp":
+            row[name] = np.round(np.cumsum(rng.normal(0, 0.05, n)), 2).tolist()
+
+    encoded = encode_test_files(row)
+    assert encoded["id"] == 3 and all(is_encoded(encoded[name]) for name in SERIES_STEPS)
+    assert len(str(row)) / len(str(encoded)) > 5
+
+    decoded = decode_test_files(encoded)
+    for name in SERIES_STEPS:
+        assert np.abs(np.asarray(decoded[name]) - row[name]).max() <= SERIES_STEPS[name] / 2 + 1e-9
+    # Rows stored as plain JSON read back unchanged
+    assert decode_test_files(row) == row
+
+
+def test_large_deltas_are_not_wrapped():
+    values = [0.0, 1e6, -1e6, 1e12, 1e20]
+    assert decode_series(encode_series(values, 1e-4)) == values
+    # Past the int32 range the deltas get 8 bytes instead of wrapping
+    encoded = base64.b64decode(encode_series([0.0, 1e6], 1e-4)[len(PREFIX):])
+    assert HEADER.unpack_from(encoded)[3] == 8
+
+
+def test_series_mixing_packets_and_values_are_rejected():
+    with pytest.raises(ValueError):
+        encode_series([[1.0, 2.0], 3.0], 1e-4)
+    with pytest.raises(ValueError):
+        encode_series([[[1.0]]], 1e-4)
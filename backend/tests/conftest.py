@@ -0,0 +1,6 @@
+import os
+
+# constants.py creates the Supabase client at import time. Tests never reach the
+# network, so point it at a placeholder project when no credentials are set.
+os.environ.setdefault("SUPABASE_URL", "https://placeholder.supabase.co")
+os.environ.setdefault("SUPABASE_KEY", "placeholder-key")
@@ -0,0 +1,313 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import httpx
+import numpy as np
+import pytest
+from supabase import ClientOptions, create_client
+from types import SimpleNamespace
+
+import auth_tokens
+from benchmarks.postgrest_stub import PostgrestStub
+from fakes import FAKE_JWT_SECRET, FakeSupabase, make_token
+from routers import db
+
+app = FastAPI()
+app.include_router(db.router)
+client = TestClient(app)
+
+
+def make_test(index):
+    time_stamps = [[0, 500], [1000, 1500, 2000 + index]]
+    return {
+        "testName": f"test {index}",
+        "comments": "",
+        "testData": {
+            "timeStamp": time_stamps,
+            "distance": [[0, 1], [2, 3, 4 + index]],
+            **{key: [0.0] * 5 for key in ("displacement", "velocity", "heading", "trajectory_x", "trajectory_y",
+                                         "gyroLeft", "gyroRight", "accelLeft", "accelRight")}
+        }
+    }
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    supabase = FakeSupabase()
+    monkeypatch.setattr(db, "supabase", supabase)
+    monkeypatch.setattr(auth_tokens, "supabase", supabase)
+    db.test_count_cache.clear()
+    db.test_response_cache.clear()
+    db.lod_index_cache.clear()
+    db.derived_series_cache.clear()
+    return supabase
+
+
+def test_listing_returns_summaries_without_arrays(supabase):
+    for index in range(3):
+        assert client.post("/db/write_test", json=make_test(index)).status_code == 200
+
+    listing = client.get("/db/tests?page=1&limit=2").json()
+    assert [test["test_name"] for test in listing["data"]] == ["test 2", "test 1"]
+    assert listing["data"][0]["sample_count"] == 5
+    assert listing["data"][0]["duration"] == 2.0
+    assert listing["data"][0]["distance"] == 6.0
+    assert "test_files" not in listing["data"][0]
+    assert listing["pagination"]["total_count"] == 3
+
+    page_query = supabase.queries[-1]
+    assert page_query.columns is None and page_query.name == "test_info"
+    assert client.get("/db/tests?view=everything").status_code == 422
+
+
+def test_cursor_pages_walk_both_ways(supabase):
+    supabase.tables["test_info"] = [{"id": test_id, "test_name": f"test {test_id}"} for test_id in range(1, 8)]
+
+    first = client.get("/db/tests?limit=3").json()
+    assert [test["id"] for test in first["data"]] == [7, 6, 5]
+    assert first["pagination"]["total_count"] == 7
+    assert first["pagination"]["previous_cursor"] is None
+
+    second = client.get("/db/tests", params={"limit": 3, "cursor": first["pagination"]["next_cursor"]}).json()
+    assert [test["id"] for test in second["data"]] == [4, 3, 2]
+    third = client.get("/db/tests", params={"limit": 3, "cursor": second["pagination"]["next_cursor"]}).json()
+    assert [test["id"] for test in third["data"]] == [1]
+    assert not third["pagination"]["has_next"] and third["pagination"]["next_cursor"] is None
+
+    back = client.get("/db/tests", params={"limit": 3, "cursor": third["pagination"]["previous_cursor"]}).json()
+    assert [test["id"] for test in back["data"]] == [4, 3, 2]
+    back = client.get("/db/tests", params={"limit": 3, "cursor": back["pagination"]["previous_cursor"]}).json()
+    assert [test["id"] for test in back["data"]] == [7, 6, 5]
+    assert not back["pagination"]["has_previous"]
+
+    # The count is only queried once while it is cached
+    count_queries = [query for query in supabase.queries if query.count]
+    assert len(count_queries) == 1
+    assert client.get("/db/tests", params={"cursor": "not a cursor"}).status_code == 422
+    assert client.get("/db/tests", params={"cursor": "WzFd"}).status_code == 422
+    for page in (0, -1):
+        assert client.get("/db/tests", params={"page": page}).status_code == 422
+
+
+def test_columnar_review_matches_row_format():
+    test_files = {
+        "timeStamp": [0, 14.7, 29.4, 44.1],
+        "distance": [0.0, 0.1, 0.2, 0.3],
+        "displacement": [0.0, 0.1, 0.2],
+        "velocity": [1.0, 1.1, 1.2, 1.3, 1.4],
+        "heading": [0.0, 1.0, 2.0, 3.0],
+        "trajectory_x": [0.0, 0.1, 0.2],
+        "trajectory_y": [0.0, 0.0, 0.0]
+    }
+    response = SimpleNamespace(data=[{"id": 1, "test_name": "a", "test_files": test_files}])
+
+    rows = db.format_for_review(response)
+    columnar = db.format_for_review_columnar(response)
+    assert "test_files" not in columnar and columnar["test_name"] == "a"
+    assert columnar["time"] == [row["time"] for row in rows["velocity"]]
+    for name in ("distance", "displacement", "velocity", "heading"):
+        assert columnar["series"][name] == [row[name] for row in rows[name]]
+    assert columnar["series"]["trajectory_x"] == [row["trajectory_x"] for row in rows["trajectory"]]
+
+
+def test_review_formats_of_unknown_tests_are_404(supabase):
+    for response_format in ("review", "columnar"):
+        assert client.get("/db/tests/404", params={"response_format": response_format}).status_code == 404
+
+
+def test_get_test_downsamples_every_series(supabase):
+    n = 10000
+    time_stamps = (np.arange(n) * 1000 / 68).tolist()
+    test_files = {"timeStamp": time_stamps, "gyroLeft": np.sin(np.arange(n) / 30).tolist(),
+                  **{name: np.cos(np.arange(n) / 40).tolist() for name in db.REVIEW_SERIES}}
+    supabase.tables["test_info"] = [{"id": 1, "test_name": "long", "test_files": test_files}]
+
+    review = client.get("/db/tests/1", params={"response_format": "columnar", "max_points": 500}).json()
+    assert len(review["time"]) <= 500
+    assert all(len(values) == len(review["time"]) for values in review["series"].values())
+    assert client.get("/db/tests/1", params={"max_points": 500, "downsample": "every_tenth"}).status_code == 422
+    for max_points in (0, -1, 2, "abc"):
+        assert client.get("/db/tests/1", params={"max_points": max_points}).status_code == 422
+
+
+def test_window_reads_only_overlapping_chunks(supabase):
+    n = 68 * 600
+    test = make_test(0)
+    test["testData"].update({
+        "timeStamp": (np.arange(n) * 1000 / 68).tolist(),
+        **{name: np.sin(np.arange(n) / 100).tolist() for name in db.REVIEW_SERIES}
+    })
+    test_id = client.post("/db/write_test", json=test).json()["test_info"]["id"]
+    supabase.tables["test_info"][0]["test_files"] = supabase.tables["test_files"][0]
+    # Level 0 is not copied out of test_files
+    assert all(row["data"] is None for row in supabase.tables["test_lod"] if row["level"] == 0)
+    assert all(isinstance(row["data"]["velocity"], str) for row in supabase.tables["test_lod"] if row["level"] > 0)
+
+    overview = client.get(f"/db/tests/{test_id}/window", params={"t0": 60, "max_points": 2000}).json()
+    assert overview["level"] > 0 and len(overview["time"]) <= 2000 and overview["time"][0] >= 60
+    chunk_query = supabase.queries[-1]
+    assert chunk_query.name == "test_lod" and len(chunk_query.response.data) < len(supabase.tables["test_lod"])
+
+    detail = client.get(f"/db/tests/{test_id}/window", params={"t0": 300, "t1": 310, "max_points": 2000}).json()
+    assert detail["level"] == 0
+    assert detail["time"][0] >= 300 and detail["time"][-1] <= 310 and len(detail["time"]) == 68 * 10 + 1
+    np.testing.assert_allclose(detail["series"]["velocity"], np.sin(np.arange(300 * 68, 310 * 68 + 1) / 100), atol=1e-5)
+    assert supabase.queries[-1].name == "test_info"
+
+    # Tests saved before pyramids existed get one built on first use
+    supabase.tables["test_lod"] = []
+    db.lod_index_cache.clear()
+    rebuilt = client.get(f"/db/tests/{test_id}/window", params={"t0": 300, "t1": 310}).json()
+    np.testing.assert_allclose(rebuilt["time"], detail["time"], atol=1e-6)
+
+
+def test_written_arrays_are_stored_encoded_and_read_back(supabase):
+    test = make_test(0)
+    test["testData"]["velocity"] = [0.1, 0.25, 0.3]
+    test_id = client.post("/db/write_test", json=test).json()["test_info"]["id"]
+    stored = supabase.tables["test_files"][0]
+    assert isinstance(stored["velocity"], str)
+
+    supabase.tables["test_info"][0]["test_files"] = stored
+    response = client.get(f"/db/tests/{test_id}").json()
+    assert response["data"][0]["test_files"]["velocity"] == test["testData"]["velocity"]
+    assert response["data"][0]["test_files"]["timeStamp"] == test["testData"]["timeStamp"]
+
+
+# The derived series as the recorder computes and uploads them (calculationUtils.calc
+# in the Electron app), from gyro data it has already smoothed, gained and thresholded
+def recorder_series(time_s, left, right, diameter=24, wheel_distance=26):
+    radius_m = diameter * 0.0254 / 2
+    dt = np.diff(time_s)
+    velocity = np.concatenate(([0.0], (left[:-1] + right[:-1]) / 2 * radius_m))
+    heading = np.concatenate(([0.0], np.cumsum((right[:-1] - left[:-1]) * radius_m / (wheel_distance * 0.0254) * dt))) * 180 / np.pi
+    return {
+        "displacement": np.concatenate(([0.0], np.cumsum((left[:-1] + right[:-1]) / 2 * dt * radius_m))),
+        "distance": np.concatenate(([0.0], np.cumsum((np.abs(left[:-1]) + np.abs(right[:-1])) / 2 * dt * radius_m))),
+        "velocity": velocity,
+        "heading": heading,
+        "trajectory_x": np.cumsum(velocity[:-1] * np.cos(np.radians(heading[:-1])) * dt),
+        "trajectory_y": np.cumsum(velocity[:-1] * np.sin(np.radians(heading[:-1])) * dt),
+    }
+
+
+def test_raw_storage_derives_the_series_full_storage_keeps(supabase, monkeypatch):
+    time_s = np.arange(400) / 68
+    # Rolls forward, then back, turning on the way
+    left = np.round(np.sin(time_s) - 0.4, 4)
+    right = np.round(np.sin(time_s) - 0.4 + 0.3 * np.cos(2 * time_s), 4)
+    left[np.abs(left) <= 0.03] = 0
+    right[np.abs(right) <= 0.03] = 0
+    test = make_test(0)
+    test["testData"].update({"timeStamp": np.round(time_s * 1000, 3).tolist(), "gyroLeft": left.tolist(),
+                             "gyroRight": right.tolist(),
+                             **{name: values.tolist() for name, values in recorder_series(time_s, left, right).items()}})
+    full_id = client.post("/db/write_test", json=test).json()["test_info"]["id"]
+    monkeypatch.setattr(db, "STORAGE_MODE", "raw")
+    db.derived_series_cache.clear()
+    raw_id = client.post("/db/write_test", json={**test, "testName": "raw"}).json()["test_info"]["id"]
+    assert set(supabase.tables["test_files"][1]) - {"id"} == set(db.RAW_COLUMNS)
+
+    for row, test_files in zip(supabase.tables["test_info"], supabase.tables["test_files"]):
+        row["test_files"] = test_files
+    full = client.get(f"/db/tests/{full_id}").json()["data"][0]["test_files"]
+    raw = client.get(f"/db/tests/{raw_id}").json()["data"][0]["test_files"]
+    assert min(full["displacement"]) < 0
+    for name in db.DERIVED_COLUMNS:
+        np.testing.assert_allclose(raw[name], full[name], atol=1e-4, err_msg=name)
+    assert (raw_id, None, db.DERIVATION_VERSION) in db.derived_series_cache
+
+
+def test_windows_of_raw_tests_follow_their_calibration(supabase, monkeypatch):
+    import calibrations
+    monkeypatch.setattr(calibrations, "calibrations", calibrations.CalibrationRegistry(supabase))
+    supabase.tables["calibrations"] = [{"id": 7, "smarthub_id": "a", "left_gain": 2.0, "right_gain": 3.0, "wheel_distance": 25.0}]
+    monkeypatch.setattr(db, "STORAGE_MODE", "raw")
+    n = 68 * 120
+    test = make_test(0)
+    test["testData"].update({"timeStamp": (np.arange(n) * 1000 / 68).tolist(), "gyroLeft": np.sin(np.arange(n) / 100).tolist(),
+                             "gyroRight": np.cos(np.arange(n) / 100).tolist()})
+    test_id = client.post("/db/write_test", json=test).json()["test_info"]["id"]
+    supabase.tables["test_info"][0]["test_files"] = supabase.tables["test_files"][0]
+    # Only level 0 is described, nothing derived with the write-time calibration is stored
+    assert [row["level"] for row in supabase.tables["test_lod"]] == [0]
+
+    def window_matches(calibration_id):
+        window = client.get(f"/db/tests/{test_id}/window", params={"t0": 10, "t1": 20}).json()
+        params = {"calibration_id": calibration_id} if calibration_id is not None else {}
+        test_files = client.get(f"/db/tests/{test_id}", params=params).json()["data"][0]["test_files"]
+        indices = np.round(np.asarray(window["time"]) * 68).astype(int)
+        np.testing.assert_allclose(window["series"]["heading"], np.asarray(test_files["heading"])[indices])
+
+    window_matches(None)
+    client.put(f"/db/update_test/{test_id}", json={"calibration_id": 7})
+    window_matches(7)
+
+
+def test_repeated_reads_are_served_from_cache_until_updated(supabase):
+    test_id = client.post("/db/write_test", json=make_test(0)).json()["test_info"]["id"]
+    supabase.tables["test_info"][0]["test_files"] = supabase.tables["test_files"][0]
+    first = client.get(f"/db/tests/{test_id}", params={"response_format": "columnar"}).json()
+
+    supabase.tables["test_info"][0]["test_name"] = "changed elsewhere"
+    assert client.get(f"/db/tests/{test_id}", params={"response_format": "columnar"}).json() == first
+    assert client.get("/db/cache/stats").json()["tests"]["hits"] == 1
+
+    client.put(f"/db/update_test/{test_id}", json={"test_name": "renamed"})
+    assert client.get(f"/db/tests/{test_id}", params={"response_format": "columnar"}).json()["test_name"] == "renamed"
+
+
+def test_reads_through_the_real_client_share_connections(monkeypatch):
+    rows = [{"id": test_id, "test_name": f"test {test_id}"} for test_id in range(1, 9)]
+    with PostgrestStub({"test_info": rows}, latency=0.02) as stub, httpx.Client() as http_client:
+        monkeypatch.setattr(db, "supabase", create_client(stub.url, "key", ClientOptions(httpx_client=http_client)))
+        db.test_response_cache.clear()
+        for test_id in range(1, 9):
+            assert client.get(f"/db/tests/{test_id}").json()["data"][0]["test_name"] == f"test {test_id}"
+    assert stub.requests == 8 and len(stub.connections) == 1
+
+
+def test_the_configured_client_uses_the_shared_pool():
+    import constants
+    assert constants.supabase.postgrest.session is constants.http_client
+    assert constants.supabase.auth._http_client is constants.http_client
+
+
+def test_retried_writes_save_one_test(supabase, monkeypatch):
+    monkeypatch.setattr(auth_tokens, "SUPABASE_JWT_SECRET", FAKE_JWT_SECRET)
+    headers = {"Authorization": f"Bearer {make_token({'sub': 'user-2', 'aud': 'authenticated', 'exp': 4e9})}"}
+
+    first = client.post("/db/write_test", json=make_test(0), headers={**headers, "Idempotency-Key": "save-1"}).json()
+    retry = client.post("/db/write_test", json=make_test(0), headers={**headers, "Idempotency-Key": "save-1"}).json()
+    assert first["created"] and not retry["created"]
+    assert retry["test_info"]["id"] == first["test_info"]["id"]
+    assert first["test_info"]["recorded_by_user_id"] == "user-2"
+    # Without a key, the same content is recognised by its hash
+    assert client.post("/db/write_test", json=make_test(1), headers=headers).json()["created"]
+    assert not client.post("/db/write_test", json=make_test(1), headers=headers).json()["created"]
+    assert len(supabase.tables["test_info"]) == len(supabase.tables["test_files"]) == 2
+    # Saving is one call to the database function, the token is checked locally
+    assert [query.name for query in supabase.queries] == ["write_test"] * 4
+
+    assert supabase.auth.calls == []
+
+    bad = {"Authorization": f"Bearer {make_token({'sub': 'user-2', 'aud': 'authenticated', 'exp': 4e9}, secret='x')}"}
+    assert client.post("/db/write_test", json=make_test(2), headers=bad).status_code == 401
+    assert client.post("/db/write_test", json=make_test(2), headers={"Authorization": "Bearer MQ.e30.AA"}).status_code == 401
+
+
+def test_writes_without_a_jwt_secret_ask_the_auth_server(supabase, monkeypatch):
+    monkeypatch.setattr(auth_tokens, "SUPABASE_JWT_SECRET", None)
+    token = make_token({"sub": "user-2", "aud": "authenticated", "exp": 4e9})
+
+    saved = client.post("/db/write_test", json=make_test(0), headers={"Authorization": f"Bearer {token}"}).json()
+    assert saved["created"] and saved["test_info"]["recorded_by_user_id"] == "user-1"
+    # Without a token, the server's own session is used
+    assert client.post("/db/write_test", json=make_test(1)).json()["created"]
+    assert supabase.auth.calls == [token, None]
+    assert [query.name for query in supabase.queries] == ["write_test"] * 2
+
+
+def test_malformed_series_are_rejected(supabase):
+    test = make_test(0)
+    test["testData"]["gyroLeft"] = [[0.0, 1.0], 2.0, 3.0, 4.0]
+    assert client.post("/db/write_test", json=test).status_code == 422
@@ -0,0 +1,46 @@
+import numpy as np
+
+from downsampling import downsample_columns, lttb_indices, minmax_indices
+
+
+def loop_lttb(x, y, n_out):
+    n = len(y)
+    every = (n - 2) / (n_out - 2)
+    anchor, kept = 0, [0]
+    for i in range(n_out - 2):
+        start, stop = int(i * every) + 1, int((i + 1) * every) + 1
+        if i == n_out - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_stop = min(int((i + 2) * every) + 1, n)
+            next_x, next_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        area = [abs((x[anchor] - next_x) * (y[j] - y[anchor]) - (x[anchor] - x[j]) * (next_y - y[anchor])) for j in range(start, stop)]
+        anchor = start + int(np.argmax(area))
+        kept.append(anchor)
+    return kept + [n - 1]
+
+
+def test_lttb_matches_loop():
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.uniform(0.01, 0.02, 5000))
+    y = np.cumsum(rng.normal(size=5000))
+    assert lttb_indices(x, y, 300).tolist() == loop_lttb(x, y, 300)
+    assert lttb_indices(x, y, 10000).tolist() == list(range(5000))
+
+
+def test_minmax_keeps_peaks():
+    y = np.sin(np.linspace(0, 20, 10001))
+    y[1234], y[8765] = 5, -5
+    kept = minmax_indices(y, 100)
+    assert len(kept) <= 100 and 1234 in kept and 8765 in kept
+    assert kept[0] == 0 and kept[-1] == 10000
+
+
+def test_downsample_columns_shares_indices():
+    x = np.arange(1000.0)
+    columns = {"a": np.sin(x / 10), "b": np.cos(x / 7), "short": x[:-1].tolist(), "name": "test"}
+    time, downsampled = downsample_columns(x, columns, 100, reference=("a", "b"))
+    assert len(time) <= 100
+    assert downsampled["a"] == np.sin(time / 10).tolist()
+    assert downsampled["short"] == [value for value in time if value < 999]
+    assert downsampled["name"] == "test"
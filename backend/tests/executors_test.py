@@ -0,0 +1,43 @@
+import asyncio
+import time
+import pytest
+from fastapi import HTTPException
+
+from executors import CPUExecutor
+
+def test_executor_runs_off_the_event_loop():
+    executor = CPUExecutor("thread", workers=2, max_queue=0)
+
+    async def main():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+        task = asyncio.create_task(ticker())
+        result = await executor.run(time.sleep, 0.2)
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(main())
+    assert result is None
+    # The loop kept running while the worker slept
+    assert ticks > 5
+    executor.shutdown()
+
+def test_executor_rejects_past_queue_limit():
+    executor = CPUExecutor("thread", workers=1, max_queue=1)
+
+    async def main():
+        return await asyncio.gather(*[executor.run(time.sleep, 0.1) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(main())
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert len(rejected) == 1 and rejected[0].status_code == 503
+    assert executor.pending == 0
+    executor.shutdown()
+
+def test_executor_kind_is_checked():
+    with pytest.raises(ValueError):
+        CPUExecutor("fibers")
@@ -0,0 +1,158 @@
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import re
+from types import SimpleNamespace
+
+# Long enough for an HS256 key, PyJWT warns about shorter ones
+FAKE_JWT_SECRET = "test-secret-test-secret-test-secret"
+
+
+# Access token signed like Supabase signs them, with HS256 and the project's JWT secret
+def make_token(claims, secret=FAKE_JWT_SECRET, alg="HS256"):
+    def segment(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b"=").decode()
+    signing_input = f"{segment({'alg': alg, 'typ': 'JWT'})}.{segment(claims)}"
+    signature = hmac.new(secret.encode(), signing_input.encode(), hashlib.sha256).digest()
+    return f"{signing_input}.{base64.urlsafe_b64encode(signature).rstrip(b'=').decode()}"
+
+
+# In-memory stand-in for the parts of the Supabase client the backend uses.
+# Tables are lists of row dicts; every executed query is recorded in `queries`.
+class FakeSupabase:
+    def __init__(self, tables=None):
+        self.tables = {name: [dict(row) for row in rows] for name, rows in (tables or {}).items()}
+        self.queries = []
+        self._ids = itertools.count(1 + max((row.get("id", 0) for rows in self.tables.values() for row in rows), default=0))
+        self.auth = FakeAuth()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    # Database functions are the rpc_<name> methods below
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+    # Same behaviour as sql/write_test.sql
+    def rpc_write_test(self, p_test_files, p_test_info, p_lod, p_idempotency_key):
+        test_info = self.tables.setdefault("test_info", [])
+        for row in test_info:
+            if row.get("idempotency_key") == p_idempotency_key:
+                return {"test_file_id": row["test_file_id"], "test_info": dict(row), "created": False}
+        test_file = {"id": next(self._ids), **p_test_files}
+        self.tables.setdefault("test_files", []).append(test_file)
+        saved = {"id": next(self._ids), **p_test_info, "test_file_id": test_file["id"], "idempotency_key": p_idempotency_key}
+        test_info.append(saved)
+        self.tables.setdefault("test_lod", []).extend(
+            {"id": next(self._ids), **row, "test_id": saved["id"]} for row in p_lod or [])
+        return {"test_file_id": test_file["id"], "test_info": dict(saved), "created": True}
+
+
+class FakeAuth:
+    def __init__(self, user_id="user-1"):
+        self.user_id = user_id
+        self.calls = []
+
+    def get_user(self, jwt=None):
+        self.calls.append(jwt)
+        return SimpleNamespace(user=SimpleNamespace(id=self.user_id))
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.client.queries.append(self)
+        return FakeResponse(getattr(self.client, f"rpc_{self.name}")(**self.params))
+
+
+class FakeQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.columns = None
+        self.filters = []
+        self.ordering = None
+        self.bounds = (0, None)
+        self.count = None
+        self.values = None
+        self.changes = None
+
+    def select(self, columns="*", count=None):
+        # Embedded tables such as "test_files(*)" are expected to be stored nested in the row,
+        # and are returned whole whatever columns of them are asked for
+        columns = re.sub(r"\([^)]*\)", "", columns)
+        self.columns = None if "*" in columns else [column.strip() for column in columns.split(",")]
+        self.count = count
+        return self
+
+    def insert(self, values):
+        self.values = values
+        return self
+
+    def update(self, changes):
+        self.changes = changes
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering = (column, desc)
+        return self
+
+    def limit(self, size):
+        self.bounds = (self.bounds[0], self.bounds[0] + size)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end + 1)
+        return self
+
+    def execute(self):
+        self.client.queries.append(self)
+        rows = self.client.tables.setdefault(self.name, [])
+        if self.values is not None:
+            inserted = [{"id": next(self.client._ids), **values} for values in
+                        (self.values if isinstance(self.values, list) else [self.values])]
+            rows.extend(inserted)
+            return FakeResponse([dict(row) for row in inserted])
+
+        matched = [row for row in rows if all(test(row) for test in self.filters)]
+        if self.changes is not None:
+            for row in matched:
+                row.update(self.changes)
+            return FakeResponse([dict(row) for row in matched])
+        if self.ordering:
+            column, desc = self.ordering
+            matched.sort(key=lambda row: row[column], reverse=desc)
+        count = len(matched) if self.count else None
+        matched = matched[self.bounds[0]:self.bounds[1]]
+        if self.columns:
+            matched = [{column: row.get(column) for column in self.columns} for row in matched]
+        self.response = FakeResponse([dict(row) for row in matched], count)
+        return self.response
@@ -0,0 +1,32 @@
+import numpy as np
+
+from codec import decode_test_files
+from lod import build_pyramid, choose_level, window
+
+
+def test_pyramid_levels_keep_peaks():
+    n = 100000
+    time = np.arange(n) / 68
+    velocity = np.sin(time)
+    velocity[54321] = 9
+    rows = build_pyramid(time, {"velocity": velocity, "trajectory_x": time[:-1]}, chunk_points=4096)
+
+    counts = {row["level"]: row["level_count"] for row in rows}
+    assert counts[0] == n and min(counts.values()) <= 1000
+    assert all(counts[level] <= counts[level - 1] / 4 + 4 for level in counts if level > 0)
+    # The full recording stays in test_files, level 0 is only described
+    assert [row["data"] for row in rows if row["level"] == 0] == [None]
+    for level in set(counts) - {0}:
+        chunks = [row for row in rows if row["level"] == level]
+        assert max(max(decode_test_files(chunk["data"])["velocity"]) for chunk in chunks) == 9
+
+    index = [{key: value for key, value in row.items() if key != "data"} for row in rows]
+    assert choose_level(index, 0, time[-1], 2000)[0] == max(counts)
+    level, chunk_ids = choose_level(index, 100, 110, 2000)
+    assert level == 0 and len(chunk_ids) == 1
+
+    assert chunk_ids == [0]
+
+    samples = window([{"chunk": 0, "data": {"time": time, "velocity": velocity, "trajectory_x": time[:-1]}}], 100, 110, 2000)
+    assert samples["time"] == time[(time >= 100) & (time <= 110)].tolist()
+    assert len(samples["series"]["trajectory_x"]) == len(samples["time"])